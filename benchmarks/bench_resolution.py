@@ -0,0 +1,178 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+"""
+Resolution benchmark against a local fake tenant (see fake_tenant.py): syllabus
+fetch, Echo360Videos construction and the url strategies of every lesson, for the
+json-only path and the browser fallback (headless Chrome against localhost).
+
+    python benchmarks/bench_resolution.py --lessons 40 --mix json_mp4=2,json_m3u8=1
+    python benchmarks/bench_resolution.py --lessons 20 --mix json_m3u8=1,scrape=1 --browser
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_tenant import FakeTenant, parse_mix  # noqa: E402
+
+from download_echo360.course import Echo360Course, Echo360Video, Echo360Videos  # noqa: E402
+from download_echo360.http_pool import get_shared_pool  # noqa: E402
+from download_echo360.strategy_stats import StrategyStats  # noqa: E402
+
+USERAGENT = "Mozilla/5.0 (X11; Linux x86_64) download_echo360-benchmark"
+
+def summarize(times):
+    if not times:
+        return None
+    ordered = sorted(times)
+    return {
+        "n": len(times),
+        "mean": statistics.mean(times),
+        "median": statistics.median(times),
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max": ordered[-1],
+    }
+
+def start_browsers():
+    # the main driver and a factory of the headless browsers of the pool
+    from download_echo360.downloader import build_chrome_driver, get_chrome_binary_path
+
+    chrome_binary = get_chrome_binary_path()
+
+    def factory():
+        return build_chrome_driver(chrome_binary, USERAGENT, headless=True)
+
+    return factory(), factory
+
+def run_once(tenant, driver, driver_factory, scrape_workers, strategy_stats):
+    session = get_shared_pool().session(tenant.hostname)
+    course = Echo360Course(uuid=tenant.section, hostname=tenant.hostname)
+    course.set_session(session)
+    course.set_driver(driver)
+
+    start = time.perf_counter()
+    lessons = course.get_lessons()
+    syllabus_time = time.perf_counter() - start
+
+    # one lesson at a time, for the latency of each strategy
+    kinds = tenant.kinds()
+    per_lesson = {}
+    strategies = {}
+    for lesson in lessons:
+        lesson_start = time.perf_counter()
+        try:
+            video = Echo360Video(lesson, driver, tenant.hostname, strategy_stats=strategy_stats)
+            strategy = video.strategy
+        except Exception:
+            strategy = None
+        per_lesson.setdefault(kinds[lesson.lesson_id], []).append(
+            time.perf_counter() - lesson_start)
+        strategies[strategy] = strategies.get(strategy, 0) + 1
+
+    # the whole course the way the downloader does it, with the browser pool if any
+    browser_pool = None
+    if driver_factory is not None and scrape_workers > 1:
+        from download_echo360.browser_pool import BrowserPool
+        browser_pool = BrowserPool(driver_factory, size=scrape_workers,
+                                   hostname=tenant.hostname, cookies=[])
+    try:
+        course_start = time.perf_counter()
+        videos = Echo360Videos(lessons, driver, tenant.hostname, browser_pool=browser_pool,
+                               strategy_stats=strategy_stats)
+        resolved = sum(1 for _, video in videos.resolve() if video.url)
+        course_time = time.perf_counter() - course_start
+    finally:
+        if browser_pool is not None:
+            browser_pool.close()
+    return {
+        "syllabus_time": syllabus_time,
+        "per_lesson": per_lesson,
+        "strategies": strategies,
+        "course_time": course_time + syllabus_time,
+        "resolved": resolved,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark lesson resolution on a fake tenant")
+    parser.add_argument("--lessons", type=int, default=20, metavar="N")
+    parser.add_argument("--mix", type=parse_mix, default="json_mp4=1,json_m3u8=1",
+                        help="Weights of the lesson kinds: json_mp4, json_m3u8 and scrape "
+                             "(default: %(default)s)")
+    parser.add_argument("--browser", action="store_true",
+                        help="Use headless Chrome for the scraping fallback (needed for "
+                             "scrape lessons, which fail without it)")
+    parser.add_argument("--scrape-workers", type=int, default=4, metavar="N")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Server latency per request in seconds (default: %(default)s)")
+    parser.add_argument("--learn", action="store_true",
+                        help="Let the strategy order adapt across lessons and repeats, as "
+                             "StrategyStats does on a real host")
+    parser.add_argument("--repeat", type=int, default=3, metavar="N")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    tenant = FakeTenant(lessons=args.lessons, mix=args.mix, latency=args.latency,
+                        seed=args.seed).start()
+    driver, driver_factory = None, None
+    if args.browser:
+        driver, driver_factory = start_browsers()
+    strategy_stats = None
+    if args.learn:
+        strategy_stats = StrategyStats(os.path.join(tempfile.mkdtemp(), "strategy_stats.json"),
+                                       reprobe_rate=0.0)
+    runs = []
+    try:
+        for _ in range(args.repeat):
+            runs.append(run_once(tenant, driver, driver_factory, args.scrape_workers,
+                                 strategy_stats))
+    finally:
+        if driver is not None:
+            driver.quit()
+        tenant.close()
+        get_shared_pool().close()
+
+    per_lesson = {}
+    strategies = {}
+    for run in runs:
+        for kind, times in run["per_lesson"].items():
+            per_lesson.setdefault(kind, []).extend(times)
+        for strategy, n in run["strategies"].items():
+            strategies[str(strategy)] = strategies.get(str(strategy), 0) + n
+    result = {
+        "lessons": args.lessons,
+        "mix": args.mix,
+        "path": "browser" if args.browser else "json",
+        "repeat": args.repeat,
+        "syllabus": summarize([run["syllabus_time"] for run in runs]),
+        "per_lesson": {kind: summarize(times) for kind, times in sorted(per_lesson.items())},
+        "per_course": summarize([run["course_time"] for run in runs]),
+        "resolved": [run["resolved"] for run in runs],
+        "strategies": strategies,
+        "requests": tenant.requests,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print("Resolution on a fake tenant: {0} lessons, mix {1}, {2} path, {3} run(s)".format(
+        args.lessons, args.mix, result["path"], args.repeat))
+    print("-" * 80)
+    print("{0:<22} {1:>6} {2:>10} {3:>10} {4:>10}".format("", "n", "mean ms", "median ms",
+                                                           "p95 ms"))
+    rows = [("syllabus", result["syllabus"])]
+    rows += [("lesson ({})".format(kind), s) for kind, s in result["per_lesson"].items()]
+    rows.append(("course", result["per_course"]))
+    for name, s in rows:
+        print("{0:<22} {1:>6} {2:>10.1f} {3:>10.1f} {4:>10.1f}".format(
+            name, s["n"], s["mean"] * 1000, s["median"] * 1000, s["p95"] * 1000))
+    print("-" * 80)
+    print("Resolved per run: {0}, strategies: {1}, requests: {2}".format(
+        result["resolved"], strategies, tenant.requests))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+"""
+Segment transport benchmark against a local content host (see segment_server.py):
+one hls lecture downloaded by the hls engine with the requests transport (HTTP/1.1,
+a connection per segment in flight) and the http2 transport (h2c multiplexed over
+a few connections). The http2 run needs httpx[http2] and is skipped without it.
+
+    python benchmarks/bench_transport.py --segments 400 --latency 0.03 --handshake 0.1
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_resolution import summarize  # noqa: E402
+from segment_server import SegmentServer  # noqa: E402
+
+from download_echo360.hls_downloader import Downloader  # noqa: E402
+from download_echo360.http_pool import HttpPool  # noqa: E402
+from download_echo360.progress import get_progress_bus  # noqa: E402
+from download_echo360.staging import Staging  # noqa: E402
+from download_echo360 import transport as transports  # noqa: E402
+
+def make_transport(name, session, h2_connections):
+    if name == "http2":
+        return transports.Http2Transport(session, max_connections=h2_connections,
+                                         prior_knowledge=True)
+    return transports.RequestsTransport(session)
+
+def run_once(server, name, pool_size, h2_connections):
+    # a fresh connection pool per run, so every run pays for its connections
+    http_pool = HttpPool(pool_maxsize=pool_size)
+    session = http_pool.session()
+    transport = make_transport(name, session, h2_connections)
+    work_dir = tempfile.mkdtemp(prefix="bench_transport_")
+    server.reset_counts()
+    try:
+        downloader = Downloader(pool_size, session=session, staging=Staging(),
+                                transport=transport)
+        start = time.perf_counter()
+        downloader.run(server.url + "/media.m3u8", work_dir, convert_to_mp4=False,
+                       title="bench")
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(downloader.result_file_name)
+    finally:
+        transport.close()
+        http_pool.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "time": elapsed,
+        "bytes": size,
+        "connections": sum(server.connections.values()),
+        "h2_requests": server.requests["h2"],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hls segment transports")
+    parser.add_argument("--segments", type=int, default=200, metavar="N")
+    parser.add_argument("--segment-size", type=int, default=256, metavar="KB")
+    parser.add_argument("--pool-size", type=int, default=50, metavar="N",
+                        help="Segments in flight, as --pool-size (default: %(default)s)")
+    parser.add_argument("--h2-connections", type=int, default=4, metavar="N",
+                        help="Connections of the http2 transport (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Server latency per request in seconds (default: %(default)s)")
+    parser.add_argument("--handshake", type=float, default=0.05,
+                        help="Setup time of every new connection in seconds, e.g. a TLS "
+                             "handshake (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, metavar="N")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    get_progress_bus().configure(mode="quiet")
+    server = SegmentServer(segments=args.segments, segment_size=args.segment_size * 1024,
+                           latency=args.latency, handshake=args.handshake).start()
+    names = ["requests"]
+    if transports.httpx is not None and server.h2_capable:
+        names.append("http2")
+    elif not args.json:
+        print('Skipping the http2 transport, it needs "httpx[http2]"')
+    runs = {}
+    try:
+        for name in names:
+            runs[name] = [run_once(server, name, args.pool_size, args.h2_connections)
+                          for _ in range(args.repeat)]
+    finally:
+        server.close()
+
+    result = {
+        "segments": args.segments,
+        "segment_size": args.segment_size * 1024,
+        "pool_size": args.pool_size,
+        "latency": args.latency,
+        "handshake": args.handshake,
+        "repeat": args.repeat,
+        "transports": {
+            name: {
+                "time": summarize([run["time"] for run in name_runs]),
+                "throughput": summarize([run["bytes"] / run["time"] for run in name_runs]),
+                "connections": summarize([run["connections"] for run in name_runs]),
+                "multiplexed": all(run["h2_requests"] for run in name_runs) if name == "http2"
+                else None,
+            }
+            for name, name_runs in runs.items()
+        },
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print("Segment transports: {0} segments of {1} KB, {2} in flight, {3} ms latency, "
+          "{4} ms handshake, {5} run(s)".format(
+              args.segments, args.segment_size, args.pool_size, int(args.latency * 1000),
+              int(args.handshake * 1000), args.repeat))
+    print("-" * 80)
+    print("{0:<12} {1:>12} {2:>12} {3:>12} {4:>14}".format(
+        "", "median s", "p95 s", "MB/s", "connections"))
+    for name, stats in result["transports"].items():
+        print("{0:<12} {1:>12.2f} {2:>12.2f} {3:>12.1f} {4:>14.0f}".format(
+            name, stats["time"]["median"], stats["time"]["p95"],
+            stats["throughput"]["median"] / 1024 ** 2, stats["connections"]["median"]))
+    print("-" * 80)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# how a lesson can be resolved: mp4 or m3u8 urls in the syllabus json, or only by
+# loading its classroom page in a browser
+LESSON_KINDS = ("json_mp4", "json_m3u8", "scrape")
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="audio",DEFAULT=YES,URI="s0_a.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=1500000,RESOLUTION=1280x720,AUDIO="audio"
+s1_v.m3u8
+"""
+
+CLASSROOM_PAGE = """<!DOCTYPE html>
+<html><head><title>Classroom</title></head>
+<body>
+<div id="player"></div>
+<script>
+// the player requests its manifests once it has loaded, like the real one
+setTimeout(function () {{
+  {fetches}
+}}, {player_delay});
+</script>
+</body></html>
+"""
+
+def parse_mix(text):
+    # "json_mp4=2,scrape=1" -> {"json_mp4": 2.0, "scrape": 1.0}
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in LESSON_KINDS:
+            raise ValueError("unknown lesson kind {}".format(kind))
+        mix[kind] = float(weight or 1)
+    return mix
+
+class FakeTenant(object):
+    """
+    Local stand-in for an Echo360 tenant: the section syllabus json, lesson classroom
+    pages that request their manifests like the player does, and the content host
+    manifests. Lessons are a configurable mix of LESSON_KINDS.
+    """
+
+    def __init__(self, lessons=20, mix=None, host="127.0.0.1", port=0, latency=0.0,
+                 player_delay=0.2, seed=0):
+        super(FakeTenant, self).__init__()
+        self.section = str(uuid.UUID(int=random.Random(seed).getrandbits(128)))
+        self.latency = latency
+        self.player_delay = player_delay
+        self.requests = 0
+        self._lock = threading.Lock()
+        mix = mix or {"json_mp4": 1.0}
+        rng = random.Random(seed)
+        kinds = sorted(mix.keys())
+        self.lessons = []
+        for i in range(lessons):
+            kind = rng.choices(kinds, weights=[mix[k] for k in kinds])[0]
+            self.lessons.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "media": str(uuid.UUID(int=rng.getrandbits(128))),
+                "kind": kind,
+                "name": "Lecture {}".format(i + 1),
+                "date": "2023-{0:02d}-{1:02d}T09:00:00.000Z".format(1 + i // 28 % 12, 1 + i % 28),
+            })
+        self._server = ThreadingHTTPServer((host, port), FakeTenantRequestHandler)
+        self._server.daemon_threads = True
+        self._server.tenant = self
+        self._thread = None
+
+    @property
+    def hostname(self):
+        host, port = self._server.server_address[:2]
+        return "http://{0}:{1}".format(host, port)
+
+    def kinds(self):
+        return {lesson["id"]: lesson["kind"] for lesson in self.lessons}
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    def manifest_url(self, lesson, name):
+        # what the syllabus lists: a content host url, rewritten by the json strategy
+        return "https://content.example.com/0000.{0}/{1}/1/{2}".format(
+            self.section, lesson["media"], name)
+
+    def syllabus(self):
+        data = []
+        for lesson in self.lessons:
+            media = {"media": {"current": {"primaryFiles": []}, "versions": [{"manifests": []}]}}
+            if lesson["kind"] == "json_mp4":
+                media["media"]["current"]["primaryFiles"] = [
+                    {"s3Url": "{0}/media/{1}/{2}.mp4".format(self.hostname, lesson["media"], q)}
+                    for q in ("sd", "hd")
+                ]
+            elif lesson["kind"] == "json_m3u8":
+                media["media"]["versions"][0]["manifests"] = [
+                    {"uri": self.manifest_url(lesson, name)}
+                    for name in ("s1_av.m3u8", "s2_av.m3u8", "s0_a.m3u8")
+                ]
+            data.append({
+                "lesson": {
+                    "lesson": {"id": lesson["id"], "name": lesson["name"],
+                               "createdAt": lesson["date"]},
+                    "startTimeUTC": lesson["date"],
+                    "hasVideo": True,
+                    # scraped lessons are those whose json does not say where the video is
+                    "hasAvailableVideo": lesson["kind"] == "json_m3u8",
+                    "video": {"published": {"courseName": "FAKE101"}, "media": media},
+                },
+            })
+        return {"status": "ok", "data": data}
+
+    def classroom(self, lesson_id):
+        for lesson in self.lessons:
+            if lesson["id"] == lesson_id:
+                break
+        else:
+            return None
+        fetches = "\n  ".join(
+            'fetch("/{0}/{1}/1/{2}");'.format(self.section, lesson["media"], name)
+            for name in ("s1_av.m3u8", "s2_av.m3u8")
+        )
+        return CLASSROOM_PAGE.format(fetches=fetches, player_delay=int(self.player_delay * 1000))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class FakeTenantRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        _logger.info(format % args)
+
+    def _reply(self, status, body, content_type):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        tenant = self.server.tenant
+        tenant.count()
+        if tenant.latency:
+            time.sleep(tenant.latency)
+        path = self.path.split("?")[0]
+        if path == "/section/{}/syllabus".format(tenant.section):
+            return self._reply(200, json.dumps(tenant.syllabus()), "application/json")
+        match = re.match(r"^/lesson/([^/]+)/classroom$", path)
+        if match:
+            page = tenant.classroom(match.group(1))
+            if page is not None:
+                return self._reply(200, page, "text/html")
+        if path.endswith("av.m3u8") or path.endswith("_v.m3u8") or path.endswith("_a.m3u8"):
+            # the content host, whatever the host name
+            if path.endswith("av.m3u8"):
+                return self._reply(200, MASTER_PLAYLIST, "application/x-mpegURL")
+            return self._reply(200, "#EXTM3U\n#EXT-X-TARGETDURATION:10\n#EXTINF:10.0,\n"
+                                    "segment0.ts\n#EXT-X-ENDLIST\n", "application/x-mpegURL")
+        if path.endswith(".mp4"):
+            return self._reply(200, "", "video/mp4")
+        if path == "/" or path.endswith("/home"):
+            return self._reply(200, "<html><body>Echo360</body></html>", "text/html")
+        self._reply(404, "not found", "text/plain")
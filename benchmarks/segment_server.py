@@ -0,0 +1,199 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    # optional, without it only HTTP/1.1 is served
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+
+class SegmentServer(object):
+    """
+    Local content host of one hls lecture (/media.m3u8 and its segments) speaking
+    HTTP/1.1 and HTTP/2 (h2c with prior knowledge) on the same port.
+
+    Every request is answered after `latency` seconds and every new connection is
+    only served after `handshake` seconds, the cost of a TLS handshake with a CDN.
+    """
+
+    def __init__(self, segments=200, segment_size=256 * 1024, host="127.0.0.1", port=0,
+                 latency=0.02, handshake=0.05):
+        super(SegmentServer, self).__init__()
+        self.segments = segments
+        self.latency = latency
+        self.handshake = handshake
+        self._segment = os.urandom(segment_size)
+        self._lock = threading.Lock()
+        self.connections = {"http/1.1": 0, "h2": 0}
+        self.requests = {"http/1.1": 0, "h2": 0}
+        self._server = ThreadingHTTPServer((host, port), SegmentRequestHandler)
+        self._server.daemon_threads = True
+        self._server.segment_server = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{0}:{1}".format(host, port)
+
+    @property
+    def h2_capable(self):
+        return h2 is not None
+
+    def count(self, protocol, connection=False):
+        with self._lock:
+            if connection:
+                self.connections[protocol] += 1
+            else:
+                self.requests[protocol] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.connections = {"http/1.1": 0, "h2": 0}
+            self.requests = {"http/1.1": 0, "h2": 0}
+
+    def playlist(self):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4",
+                 "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(self.segments):
+            lines += ["#EXTINF:4.0,", "segment{}.ts".format(i)]
+        lines.append("#EXT-X-ENDLIST")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def resource(self, path):
+        # (status, content type, body)
+        path = path.split("?")[0]
+        if path == "/media.m3u8":
+            return 200, "application/x-mpegURL", self.playlist()
+        if path.startswith("/segment") and path.endswith(".ts"):
+            return 200, "video/mp2t", self._segment
+        return 404, "text/plain", b"not found"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class SegmentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        _logger.info(format % args)
+
+    def handle(self):
+        server = self.server.segment_server
+        if server.handshake:
+            time.sleep(server.handshake)
+        if h2 is not None and self._is_h2():
+            server.count("h2", connection=True)
+            return self._serve_h2(server)
+        server.count("http/1.1", connection=True)
+        super(SegmentRequestHandler, self).handle()
+
+    def _is_h2(self):
+        # the client preface of prior-knowledge HTTP/2, before any byte is consumed
+        data = b""
+        while len(data) < len(H2_PREFACE):
+            data = self.request.recv(len(H2_PREFACE), socket.MSG_PEEK)
+            if not data or not H2_PREFACE.startswith(data[:len(H2_PREFACE)]):
+                return False
+            if len(data) < len(H2_PREFACE):
+                time.sleep(0.001)
+        return True
+
+    def do_GET(self):
+        server = self.server.segment_server
+        server.count("http/1.1")
+        if server.latency:
+            time.sleep(server.latency)
+        status, content_type, body = server.resource(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_h2(self, server):
+        sock = self.request
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        # guards conn and the socket, notified when the client opens its flow control windows
+        cond = threading.Condition()
+        closed = threading.Event()
+        with cond:
+            conn.initiate_connection()
+            sock.sendall(conn.data_to_send())
+        try:
+            while not closed.is_set():
+                data = sock.recv(65536)
+                if not data:
+                    break
+                with cond:
+                    events = conn.receive_data(data)
+                    for event in events:
+                        if isinstance(event, h2.events.RequestReceived):
+                            path = dict(event.headers).get(":path", "/")
+                            threading.Thread(
+                                target=self._respond_h2,
+                                args=(server, conn, cond, closed, event.stream_id, path),
+                                daemon=True,
+                            ).start()
+                        elif isinstance(event, h2.events.ConnectionTerminated):
+                            closed.set()
+                    cond.notify_all()
+                    sock.sendall(conn.data_to_send())
+        except OSError as e:
+            _logger.debug("h2 connection closed: {}".format(e))
+        finally:
+            closed.set()
+            with cond:
+                cond.notify_all()
+
+    def _respond_h2(self, server, conn, cond, closed, stream_id, path):
+        server.count("h2")
+        if server.latency:
+            time.sleep(server.latency)
+        status, content_type, body = server.resource(path)
+        sock = self.request
+        try:
+            with cond:
+                conn.send_headers(stream_id, [(":status", str(status)),
+                                              ("content-type", content_type),
+                                              ("content-length", str(len(body)))])
+                sock.sendall(conn.data_to_send())
+            offset = 0
+            while offset < len(body):
+                with cond:
+                    while not closed.is_set() and conn.local_flow_control_window(stream_id) <= 0:
+                        cond.wait()
+                    if closed.is_set():
+                        return
+                    size = min(conn.local_flow_control_window(stream_id),
+                               conn.max_outbound_frame_size, len(body) - offset)
+                    conn.send_data(stream_id, body[offset:offset + size])
+                    offset += size
+                    sock.sendall(conn.data_to_send())
+            with cond:
+                conn.end_stream(stream_id)
+                sock.sendall(conn.data_to_send())
+        except Exception as e:
+            # e.g. the stream was reset by the client
+            _logger.debug("Cannot answer stream {}: {}".format(stream_id, e))
@@ -3,17 +3,57 @@ import argparse
 import logging
 import os
 import re
-from download_echo360.main import main
+import sys
+from download_echo360.course import AUDIO_FORMATS, COMPOSE_LAYOUTS
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.main import main, main_batch
+from download_echo360.planning import FEED_POLICIES
+from download_echo360.progress import PROGRESS_MODES, get_progress_bus
+from download_echo360.replay import start_recording
+from download_echo360.staging import FSYNC_POLICIES
+from download_echo360.store import default_store_dir
+from download_echo360.transport import TRANSPORTS
 
 logging.basicConfig(
     format="[%(levelname)s: %(name)-12s] %(message)s",
     level=logging.ERROR)
 _logger = logging.getLogger(__name__)
 
+def get_course_hostname(course_url, default_hostname=None):
+    match = re.search(r"https?:[/]{2}[^/]*", course_url)
+    if match is None:
+        _logger.info("No hostname found in the URL")
+        return default_hostname
+    return match.group()
+
+def read_batch_file(batch_file):
+    if batch_file == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(os.path.expanduser(batch_file)) as f:
+            lines = f.readlines()
+    # one course url/uuid per line, blank lines and '#' comments are ignored
+    return [
+        line.strip() for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+def parse_time(value):
+    # seconds or [HH:]MM:SS, optionally negative
+    sign = -1 if value.startswith("-") else 1
+    try:
+        seconds = 0.0
+        for part in value.lstrip("-").split(":"):
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid time '{}'".format(value))
+    return sign * seconds
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Download Echo360 videos")
     parser.add_argument(
         "url", 
+        nargs="?",
         help="URL of the Echo360 video to download, \
         e.g. https://echo360.org/section/a1b8850e-3a11-40e8-b413-b79bb7d783a5/home",
     )
@@ -22,8 +62,204 @@ def parse_args():
         help="Output directory to save the video to",
         metavar="OUTPUT_DIR"
     )
+    parser.add_argument(
+        "-b", "--batch",
+        help="File with one course URL (or UUID) per line, or '-' to read from stdin",
+        metavar="BATCH_FILE"
+    )
+    parser.add_argument(
+        "--hostname",
+        default="https://echo360.org",
+        help="Hostname used for courses given only by their UUID (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--scrape-workers",
+        type=int,
+        default=4,
+        help="Number of headless browsers used in parallel when a lesson page has to be "
+             "scraped for its video urls (default: %(default)s, 1 disables the pool)",
+        metavar="N"
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=50,
+        help="Maximum number of keep-alive connections per host, shared by the whole run "
+             "(default: %(default)s)",
+        metavar="N"
+    )
+    parser.add_argument(
+        "--pool-hosts",
+        type=int,
+        default=16,
+        help="Number of hosts whose connection pools are kept alive at once (default: %(default)s)",
+        metavar="N"
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send a duplicate request for segments slower than the running p95 latency "
+             "and keep whichever response arrives first",
+    )
+    parser.add_argument(
+        "--max-hedges",
+        type=int,
+        default=4,
+        help="Maximum number of duplicate segment requests in flight (default: %(default)s)",
+        metavar="N"
+    )
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORTS,
+        default="requests",
+        help="How hls segments are fetched: requests (HTTP/1.1, a connection per segment in "
+             "flight) or http2 (multiplexed over a few connections, needs httpx[http2]; "
+             "hedged requests still use requests) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--scratch-dir",
+        help="Directory for intermediate files, e.g. on a local SSD or tmpfs. Finished "
+             "lectures are moved into the output directory (default: a hidden folder in it)",
+        metavar="SCRATCH_DIR"
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default="final",
+        help="When to fsync written files: never, only finished lectures (final) or every "
+             "intermediate file too (always) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--disk-watermark",
+        type=float,
+        default=0.95,
+        help="Only start lectures whose estimated size keeps the output (and scratch) volume "
+             "below this fraction of its capacity (default: %(default)s)",
+        metavar="FRACTION"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check already downloaded lectures against their recorded size, checksum and "
+             "duration, and download the broken ones again",
+    )
+    parser.add_argument(
+        "--verify-workers",
+        type=int,
+        default=4,
+        help="Number of files verified in parallel (default: %(default)s)",
+        metavar="N"
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const="table",
+        choices=["table", "json"],
+        help="Dry run: list every lesson with its strategy, rendition, duration, estimated "
+             "size and whether it would be fetched, without downloading any media",
+    )
+    parser.add_argument(
+        "--plan-file",
+        help="Write the plan to this file instead of stdout",
+        metavar="PLAN_FILE"
+    )
+    parser.add_argument(
+        "--start",
+        type=parse_time,
+        help="Only download every lecture from this time on, in seconds or [HH:]MM:SS; "
+             "negative values count from the end (e.g. --start=-20:00)",
+        metavar="TIME"
+    )
+    parser.add_argument(
+        "--end",
+        type=parse_time,
+        help="Only download every lecture up to this time, in seconds or [HH:]MM:SS; "
+             "negative values count from the end",
+        metavar="TIME"
+    )
+    parser.add_argument(
+        "--audio-only",
+        nargs="?",
+        const="m4a",
+        choices=sorted(AUDIO_FORMATS.keys()),
+        help="Only download the audio of every lecture (default format: m4a). HLS feeds "
+             "fetch just the audio rendition, or the smallest variant if there is none",
+    )
+    parser.add_argument(
+        "--feeds",
+        choices=FEED_POLICIES,
+        default="all",
+        help="Which feeds of a multi-camera lecture to download: the primary feed only, "
+             "all of them (in parallel) or the one with the highest resolution "
+             "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--compose",
+        choices=sorted(COMPOSE_LAYOUTS.keys()),
+        help="Put the first two feeds of a lecture into one video, side by side or the "
+             "second as picture-in-picture, in a single ffmpeg pass over both feeds",
+    )
+    parser.add_argument(
+        "--store",
+        nargs="?",
+        const="",
+        help="Keep finished lectures in a content-addressed store (default: in the user "
+             "cache directory) and link them into every course that lists them again, "
+             "instead of downloading them twice",
+        metavar="STORE_DIR"
+    )
+    parser.add_argument(
+        "--segment-cache-size",
+        type=int,
+        default=0,
+        help="Size in MB of the on-disk cache of hls segments in the user cache directory. "
+             "The segments of a lecture stay cached until its file is finished, so a failed "
+             "mux or an interrupted run is retried without downloading again "
+             "(default: %(default)s, 0 disables the cache)",
+        metavar="MB"
+    )
+    parser.add_argument(
+        "--progress",
+        choices=PROGRESS_MODES,
+        default="auto",
+        help="How transfer progress is shown: a live dashboard, nothing (quiet), or JSON "
+             "lines on stderr (jsonl). auto is the dashboard on a terminal, quiet otherwise "
+             "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--record",
+        help="Record the HTTP exchanges of the run (without tokens or cookies) into this "
+             "archive, to be replayed offline with 'python -m download_echo360.replay'",
+        metavar="ARCHIVE"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and download the courses submitted to a local job API, reusing "
+             "the logged-in browser and connection pools across jobs",
+    )
+    parser.add_argument(
+        "--listen",
+        default="127.0.0.1:8360",
+        help="Address of the job API in daemon mode: HOST:PORT or unix:PATH "
+             "(default: %(default)s)",
+        metavar="ADDRESS"
+    )
+    parser.add_argument(
+        "--job-file",
+        help="Where the daemon keeps its job queue (default: in the user cache directory)",
+        metavar="JOB_FILE"
+    )
     args = vars(parser.parse_args())
-    course_url = args["url"]
+    if args["url"] is None and args["batch"] is None and not args["daemon"]:
+        parser.error("either a course URL, --batch or --daemon is required")
+
+    if args["batch"] is not None:
+        course_urls = read_batch_file(args["batch"])
+    elif args["url"] is None:
+        course_urls = []
+    else:
+        course_urls = [args["url"]]
 
     output_dir = (
         os.path.expanduser(args["output"])
@@ -32,22 +268,99 @@ def parse_args():
     )
     output_dir = output_dir if os.path.isdir(output_dir) else "download"
 
-    course_hostname = re.search(r"https?:[/]{2}[^/]*", course_url).group()
-    if course_hostname is None:
-        course_hostname = course_hostname.group()
-    else:
-        _logger.info("No hostname found in the URL")
-
-    _logger.info("Hostname: %s, UUID: %s", course_hostname, course_url)
+    courses = []
+    for course_url in course_urls:
+        course_hostname = get_course_hostname(course_url, args["hostname"])
+        _logger.info("Hostname: %s, UUID: %s", course_hostname, course_url)
+        courses.append((course_url, course_hostname))
 
     # expand to other browsers
     webdriver_to_use = "chrome"
 
-    return course_url, output_dir, course_hostname, webdriver_to_use
+    get_progress_bus().configure(mode=args["progress"])
+    if args["record"] is not None:
+        start_recording(os.path.expanduser(args["record"]))
+        if args["transport"] != "requests":
+            # the recorder sits in the requests session
+            print("[WARN] --record fetches the segments with requests.")
+            args["transport"] = "requests"
+    get_shared_pool().configure(
+        pool_connections=max(1, args["pool_hosts"]),
+        pool_maxsize=max(1, args["pool_size"]),
+    )
+
+    downloader_options = {
+        "scrape_workers": max(1, args["scrape_workers"]),
+        "pool_size": max(1, args["pool_size"]),
+        "hedge": args["hedge"],
+        "max_hedges": max(1, args["max_hedges"]),
+        "transport": args["transport"],
+        "scratch_dir": (
+            os.path.expanduser(args["scratch_dir"])
+            if args["scratch_dir"] is not None
+            else None
+        ),
+        "fsync_policy": args["fsync"],
+        "disk_watermark": args["disk_watermark"],
+        "verify": args["verify"],
+        "verify_workers": max(1, args["verify_workers"]),
+        "window": (
+            (args["start"], args["end"])
+            if args["start"] is not None or args["end"] is not None
+            else None
+        ),
+        "audio_format": args["audio_only"],
+        "store_dir": (
+            (os.path.expanduser(args["store"]) if args["store"] else default_store_dir())
+            if args["store"] is not None
+            else None
+        ),
+        "segment_cache_size": max(0, args["segment_cache_size"]) * 1024 ** 2,
+        "feed_policy": args["feeds"],
+        "compose": args["compose"],
+    }
+
+    plan_options = None
+    if args["plan"] is not None:
+        plan_options = {"output_format": args["plan"], "output_file": args["plan_file"]}
+
+    daemon_options = None
+    if args["daemon"]:
+        daemon_options = {
+            "hostname": args["hostname"],
+            "listen": args["listen"],
+            "job_file": args["job_file"],
+        }
+
+    return (courses, output_dir, webdriver_to_use, args["batch"] is not None,
+            downloader_options, plan_options, daemon_options)
 
 def download_echo360():
-    course_url, output_dir, course_hostname, webdriver_to_use = parse_args()
+    (courses, output_dir, webdriver_to_use, is_batch,
+     downloader_options, plan_options, daemon_options) = parse_args()
+    if daemon_options is not None:
+        from download_echo360.daemon import Echo360Daemon
+
+        daemon = Echo360Daemon(output_dir=output_dir,
+            default_hostname=daemon_options["hostname"],
+            webdriver_to_use=webdriver_to_use,
+            downloader_options=downloader_options,
+            job_file=daemon_options["job_file"])
+        for course_url, _ in courses:
+            # courses given on the command line are queued as well
+            daemon.submit(course_url)
+        daemon.run(daemon_options["listen"])
+        return 0
+    if is_batch:
+        return main_batch(courses=courses,
+            output_dir=output_dir,
+            webdriver_to_use=webdriver_to_use,
+            downloader_options=downloader_options,
+            plan_options=plan_options)
+    course_url, course_hostname = courses[0]
     main(course_url=course_url, 
         output_dir=output_dir, 
         course_hostname=course_hostname, 
-        webdriver_to_use=webdriver_to_use)
\ No newline at end of file
+        webdriver_to_use=webdriver_to_use,
+        downloader_options=downloader_options,
+        plan_options=plan_options)
\ No newline at end of file
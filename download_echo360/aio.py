@@ -0,0 +1,222 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import asyncio
+import contextlib
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from download_echo360.course import Echo360Course, Echo360Videos
+from download_echo360.downloader import get_lecture_filename
+from download_echo360.hls_downloader import DownloadCancelled
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.progress import get_progress_bus
+from download_echo360.staging import Staging
+from download_echo360.strategy_stats import StrategyStats
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# files: [(path, expected duration)]; error: the exception of a failed download, if any
+DownloadResult = namedtuple("DownloadResult", ["lesson", "ok", "files", "cancelled", "error"])
+
+class DownloadPolicy(object):
+    """
+    How a lesson is downloaded: the same knobs as the command line options.
+    """
+
+    def __init__(self, pool_size=50, hedge=False, max_hedges=4, window=None, audio_format=None,
+                 scratch_dir=None, fsync_policy="final", store=None, segment_cache=None,
+                 feed_policy="all", compose=None, transport="requests"):
+        super(DownloadPolicy, self).__init__()
+        self.pool_size = pool_size
+        self.hedge = hedge
+        self.max_hedges = max_hedges
+        self.window = window
+        self.audio_format = audio_format
+        self.staging = Staging(scratch_dir=scratch_dir, fsync_policy=fsync_policy)
+        # a ContentStore shared by the courses downloaded with this policy, if any
+        self.store = store
+        # a SegmentCache, so that failed or cancelled lessons are not fetched again
+        self.segment_cache = segment_cache
+        # primary/all/best feeds, and a COMPOSE_LAYOUTS layout to put them in one video
+        self.feed_policy = feed_policy
+        self.compose = compose
+        # a transport.TRANSPORTS name for the hls segments
+        self.transport = transport
+
+    def download_options(self):
+        return {
+            "pool_size": self.pool_size,
+            "segment_options": {"hedge": self.hedge, "max_hedges": self.max_hedges,
+                                "segment_cache": self.segment_cache,
+                                "transport": self.transport},
+            "staging": self.staging,
+            "window": self.window,
+            "audio_format": self.audio_format,
+            "store": self.store,
+            "feed_policy": self.feed_policy,
+            "compose": self.compose,
+        }
+
+class AsyncCourse(object):
+    """
+    asyncio front-end of a course: every blocking step (syllabus, lesson resolution,
+    downloads) runs on a private thread pool, so the event loop is never blocked.
+
+        async with AsyncCourse(uuid, hostname, cookies=cookies) as course:
+            async for lesson in course.lessons():
+                result = await lesson.download(dest, progress=callback)
+
+    `cookies` are those of a logged-in session ({name: value} or selenium's list of
+    dicts). A selenium `driver` is only needed for lessons that must be scraped.
+    """
+
+    def __init__(self, uuid, hostname, cookies=None, driver=None, max_workers=4,
+                 audio_only=False):
+        super(AsyncCourse, self).__init__()
+        if isinstance(cookies, dict):
+            cookies = [{"name": name, "value": value} for name, value in cookies.items()]
+        self._course = Echo360Course(uuid=uuid, hostname=hostname)
+        self._session = get_shared_pool().session(hostname, cookies)
+        self._course.set_session(self._session)
+        self._course.set_driver(driver)
+        self._driver = driver
+        self._audio_only = audio_only
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._redirected, function, *args)
+
+    @staticmethod
+    def _redirected(function, *args):
+        # status messages are logged, the application decides what reaches the terminal
+        with get_progress_bus().redirected(_logger.info):
+            return function(*args)
+
+    @property
+    def hostname(self):
+        return self._course.hostname
+
+    @property
+    def session(self):
+        return self._session
+
+    async def name(self):
+        await self._run(self._course.get_lessons)
+        return self._course.course_name
+
+    async def lessons(self):
+        # lessons in lecture order, each one as soon as it is resolved
+        lessons = await self._run(self._course.get_lessons)
+        strategy_stats = await self._run(StrategyStats.default)
+        videos = Echo360Videos(lessons, self._driver, self.hostname,
+                               strategy_stats=strategy_stats, audio_only=self._audio_only)
+        resolved = videos.resolve()
+        try:
+            while True:
+                item = await self._run(next, resolved, None)
+                if item is None:
+                    break
+                number, video = item
+                parts = video.get_all_parts()
+                for i, part in enumerate(parts):
+                    part_number = number if len(parts) == 1 else "{}.{}".format(number, i + 1)
+                    yield AsyncLesson(self, part_number, part)
+        finally:
+            # also runs when the loop is left early, possibly after close()
+            await asyncio.get_running_loop().run_in_executor(None, resolved.close)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+class AsyncLesson(object):
+    """
+    A resolved lesson of an `AsyncCourse`.
+    """
+
+    def __init__(self, course, number, video):
+        super(AsyncLesson, self).__init__()
+        self._course = course
+        self._video = video
+        self.number = number
+
+    @property
+    def title(self):
+        return self._video.title
+
+    @property
+    def date(self):
+        return self._video.date
+
+    @property
+    def url(self):
+        return self._video.url
+
+    @property
+    def strategy(self):
+        return self._video.strategy
+
+    @property
+    def has_video(self):
+        return self._video.url is not False
+
+    @property
+    def filename(self):
+        return get_lecture_filename(
+            "", self.date, "Lecture {} [{}]".format(self.number, self.title)
+        )
+
+    async def download(self, dest, policy=None, progress=None, filename=None):
+        # progress(lesson, event, snapshot) is called on the event loop; cancelling the
+        # task stops the transfer (and ffmpeg) and removes its partial files
+        if policy is None:
+            policy = DownloadPolicy()
+        if filename is None:
+            filename = self.filename
+        if not self.has_video:
+            return DownloadResult(self, False, [], False, None)
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+
+        def report(event, snapshot):
+            loop.call_soon_threadsafe(progress, self, event, snapshot)
+
+        def run():
+            progress_bus = get_progress_bus()
+            listening = (progress_bus.listening(report) if progress is not None
+                         else contextlib.nullcontext())
+            # status messages are logged, the application decides what reaches the terminal
+            with progress_bus.redirected(_logger.info), listening:
+                try:
+                    ok = self._video.download(dest, filename, session=self._course.session,
+                                              cancel_event=cancel_event,
+                                              **policy.download_options())
+                except DownloadCancelled:
+                    return DownloadResult(self, False, [], True, None)
+                except Exception as e:
+                    _logger.debug("Download of {} failed: {}".format(filename, e))
+                    return DownloadResult(self, False, list(self._video.downloaded_files),
+                                          False, e)
+                finally:
+                    policy.staging.cleanup(dest)
+            return DownloadResult(self, bool(ok), list(self._video.downloaded_files), False, None)
+
+        future = loop.run_in_executor(self._course._executor, run)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            # let the transfer clean up before giving up
+            with contextlib.suppress(Exception):
+                await future
+            raise
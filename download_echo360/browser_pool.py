@@ -0,0 +1,90 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+class BrowserPool(object):
+    """
+    A bounded pool of (headless) browsers used to scrape lesson pages in parallel.
+
+    Browsers are started on demand, at most `size` of them, and each one gets the
+    cookies of the authenticated driver so no extra login is needed.
+    """
+
+    def __init__(self, driver_factory, size, hostname, cookies):
+        super(BrowserPool, self).__init__()
+        self._driver_factory = driver_factory
+        self._size = size
+        self._hostname = hostname
+        self._cookies = cookies
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    def _start_driver(self):
+        driver = self._driver_factory()
+        # cookies can only be added for the domain currently loaded
+        driver.get(self._hostname)
+        for cookie in self._cookies:
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException as e:
+                _logger.debug("Cannot share cookie {}: {}".format(cookie["name"], e))
+        return driver
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if len(self._drivers) < self._size:
+                    # reserve the slot before the (slow) browser start
+                    self._drivers.append(None)
+                    break
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                # re-check, a browser might have failed to start and freed its slot
+                continue
+        try:
+            driver = self._start_driver()
+        except Exception:
+            with self._lock:
+                self._drivers.remove(None)
+            raise
+        with self._lock:
+            self._drivers[self._drivers.index(None)] = driver
+        return driver
+
+    @contextmanager
+    def driver(self):
+        driver = self._acquire()
+        try:
+            yield driver
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        for driver in drivers:
+            if driver is None:
+                continue
+            try:
+                driver.quit()
+            except Exception as e:
+                _logger.debug("Failed to quit browser: {}".format(e))
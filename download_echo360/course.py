@@ -3,25 +3,55 @@ import logging
 
 import json
 import sys
-import operator
-import re
 import dateutil.parser
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import selenium
-import requests
 import ffmpy
 
-from selenium.common.exceptions import StaleElementReferenceException
+try:
+    # optional, lets the syllabus be parsed while it is downloaded
+    import ijson
+    # raised for malformed or truncated syllabi
+    _JSON_ERRORS = (ValueError, ijson.JSONError)
+except ImportError:
+    ijson = None
+    _JSON_ERRORS = (ValueError,)
 
+from download_echo360.network_log import capture_stream_urls
 from download_echo360.naive_m3u8_parser import NaiveM3U8Parser
-from download_echo360.hls_downloader import Downloader
+from download_echo360.hls_downloader import DownloadCancelled, Downloader, run_ffmpeg
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.integrity import probe_duration
+from download_echo360.planning import select_feed_urls
+from download_echo360.progress import get_progress_bus, print_line
+from download_echo360.staging import Staging
 
 logging.basicConfig(
     format="[%(levelname)s: %(name)-12s] %(message)s",
     level=logging.ERROR)
 _logger = logging.getLogger(__name__)
 
+# seconds a lesson page is given to request its streams
+PAGE_LOAD_WAIT = 30
+# used whenever a lecture is trimmed to a time window
+TRIM_CODEC_OPTIONS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-c:a", "aac"]
+# output options of the audio-only formats, the extension is the format name
+AUDIO_FORMATS = {
+    "m4a": ["-vn", "-c:a", "copy", "-bsf:a", "aac_adtstoasc"],
+    "opus": ["-vn", "-c:a", "libopus", "-b:a", "48k"],
+}
+# filter graphs of the multi-camera compositions, input 0 is the primary feed
+COMPOSE_LAYOUTS = {
+    "side-by-side": "[0:v]scale=-2:720,setsar=1[a];[1:v]scale=-2:720,setsar=1[b];"
+                    "[a][b]hstack=inputs=2[v]",
+    "pip": "[1:v]scale=iw/4:-2[p];[0:v][p]overlay=W-w-16:H-h-16:shortest=1[v]",
+}
+
 class Echo360Course(object):
     def __init__(self, uuid, hostname=None):
         super(Echo360Course, self).__init__()
@@ -29,7 +59,12 @@ class Echo360Course(object):
         self._course_name = None
         self._uuid = uuid
         self._videos = None
+        self._lessons = None
         self._driver = None
+        self._session = None
+        self._browser_pool = None
+        self._strategy_stats = None
+        self._audio_only = False
         if hostname is None:
             self._hostname = "https://login.echo360.org/login"
         else:
@@ -64,52 +99,143 @@ class Echo360Course(object):
     @property
     def course_name(self):
         if self._course_name is None:
-            # try each available video as some video might be special has contains
-            # no information about the course.
-            for v in self.course_data["data"]:
-                try:
-                    self._course_name = v["lesson"]["video"]["published"]["courseName"]
-                    break
-                except KeyError:
-                    pass
-            if self._course_name is None:
-                # no available course name found...?
-                self._course_name = "[[UNTITLED]]"
+            # the name is picked up while parsing the syllabus
+            self.get_lessons()
         return self._course_name
     
     def set_driver(self, driver):
         self._driver = driver
+
+    def set_session(self, session):
+        self._session = session
+
+    def set_browser_pool(self, browser_pool):
+        self._browser_pool = browser_pool
+
+    def set_strategy_stats(self, strategy_stats):
+        self._strategy_stats = strategy_stats
+
+    def set_audio_only(self, audio_only):
+        self._audio_only = audio_only
     
     def get_videos(self):
         assert self._driver is not None, "Driver not initialized"
         if self._videos is None:
             try:
-                course_data_json = self._get_course_data()
-                self._videos = Echo360Videos(videos_json=course_data_json["data"], driver=self._driver, hostname=self._hostname)
+                lessons = self.get_lessons()
+                self._videos = Echo360Videos(lessons=lessons, driver=self._driver,
+                                             hostname=self._hostname, browser_pool=self._browser_pool,
+                                             strategy_stats=self._strategy_stats,
+                                             audio_only=self._audio_only)
             except selenium.common.exceptions.NoSuchElementException as e:
                 print("selenium cannot find given elements")
                 raise e
             
         return self._videos
 
+    def get_lessons(self):
+        if self._lessons is None:
+            self._lessons = self._get_course_data()
+            for lesson in self._lessons:
+                # try each available video as some video might be special has contains
+                # no information about the course.
+                if lesson.course_name is not None:
+                    self._course_name = lesson.course_name
+                    break
+            if self._course_name is None:
+                # no available course name found...?
+                self._course_name = "[[UNTITLED]]"
+        return self._lessons
+
     def _get_course_data(self):
         try:
-            self._driver.get(self.video_url)
-            # use requests to retrieve data
-            session = requests.Session()
-            # load cookies from selenium
-            for cookie in self._driver.get_cookies():
-                session.cookies.set(cookie["name"], cookie["value"])
+            # use requests to retrieve data, the browser does not need to load it as well
+            session = self._session
+            if session is None:
+                # load cookies from selenium
+                session = get_shared_pool().session(self._hostname, self._driver.get_cookies())
             
-            request = session.get(self.video_url)
+            request = session.get(self.video_url, stream=True)
             if not request.ok:
                 raise Exception("Error: Failed to get m3u8 info for EchoCourse!")
             
-            json_str = request.text
-        except ValueError as e:
+            # only the fields we use are kept of each lesson, the raw json is dropped
+            # as soon as its record is built
+            if ijson is not None:
+                request.raw.decode_content = True
+                videos_json = ijson.items(request.raw, "data.item")
+            else:
+                videos_json = json.loads(request.text)["data"]
+            lessons = [LessonRecord.from_json(video_json) for video_json in videos_json]
+            del videos_json
+            request.close()
+        except _JSON_ERRORS as e:
             raise Exception("Unable to retrieve JSON (course_data) from url", e)
-        self.course_data = json.loads(json_str)
-        return self.course_data
+        # entries without a lesson id are not lessons we could ever download
+        return [lesson for lesson in lessons if lesson.lesson_id is not None]
+
+class LessonRecord(object):
+    # compact version of a lesson in the syllabus json, with only the fields we use
+    __slots__ = (
+        "lesson_id", "name", "start_time", "created_at", "group_created_at",
+        "group_updated_at", "has_video", "has_available_video", "manifest_urls",
+        "mp4_urls", "course_name",
+    )
+
+    def __init__(self, **fields):
+        for field in LessonRecord.__slots__:
+            setattr(self, field, fields.get(field))
+
+    @staticmethod
+    def _get(json_obj, *keys):
+        for key in keys:
+            try:
+                json_obj = json_obj[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return json_obj
+
+    @classmethod
+    def from_json(cls, video_json):
+        get = cls._get
+        media = get(video_json, "lesson", "video", "media", "media")
+        manifests = get(media, "versions", 0, "manifests") or []
+        primary_files = get(media, "current", "primaryFiles") or []
+        lesson_id = get(video_json, "lesson", "lesson", "id")
+        return cls(
+            lesson_id=None if lesson_id is None else "{0}".format(lesson_id),
+            name=get(video_json, "lesson", "lesson", "name"),
+            start_time=get(video_json, "lesson", "startTimeUTC"),
+            created_at=get(video_json, "lesson", "lesson", "createdAt"),
+            group_created_at=get(video_json, "groupInfo", "createdAt"),
+            group_updated_at=get(video_json, "groupInfo", "updatedAt"),
+            has_video=bool(get(video_json, "lesson", "hasVideo")),
+            has_available_video=bool(get(video_json, "lesson", "hasAvailableVideo")),
+            # a file without its url is skipped, not the whole lesson (or syllabus)
+            manifest_urls=tuple(url for url in (get(m, "uri") for m in manifests) if url),
+            mp4_urls=tuple(url for url in (get(obj, "s3Url") for obj in primary_files) if url),
+            course_name=get(video_json, "lesson", "video", "published", "courseName"),
+        )
+
+def get_lesson_date(lesson, is_multipart_video=False):
+    try:
+        # date is not important so we will just ignore it if something went wrong
+        # Also, some echoCloud videos returns None for video start time... :(
+        date = dateutil.parser.parse(_extract_lesson_date(lesson, is_multipart_video)).date()
+        return date.strftime("%Y-%m-%d")
+    except Exception:
+        return "1970-01-01"
+
+def _extract_lesson_date(lesson, is_multipart_video):
+    if is_multipart_video:
+        if lesson.group_created_at is not None:
+            return lesson.group_created_at
+        if lesson.group_updated_at is not None:
+            return lesson.group_updated_at
+
+    if lesson.start_time is not None:
+        return lesson.start_time
+    return lesson.created_at
 
 def update_course_retrieval_progress(current, total):
     prefix = "> Retrieving couser information..."
@@ -119,46 +245,112 @@ def update_course_retrieval_progress(current, total):
     sys.stdout.flush()
             
 class Echo360Videos(object):
-    def __init__(self, videos_json, driver, hostname, skip_video_on_error=True):
+    """
+    The videos of a course, resolved lazily: iterating yields `(lecture number, video)`
+    in lecture order as soon as each lesson is resolved, while the following lessons
+    are still being resolved in the background.
+    """
+
+    def __init__(self, lessons, driver, hostname, skip_video_on_error=True, browser_pool=None,
+                 strategy_stats=None, audio_only=False):
         super(Echo360Videos, self).__init__()
-        assert videos_json is not None
+        assert lessons is not None
         self._driver = driver
-        self._videos = []
-        total_videos = len(videos_json)
-        update_course_retrieval_progress(0, total_videos)
+        self._hostname = hostname
+        self._skip_video_on_error = skip_video_on_error
+        self._browser_pool = browser_pool
+        self._strategy_stats = strategy_stats
+        self._audio_only = audio_only
+        # lecture numbers follow the date order of the syllabus, whatever resolves first
+        self._lessons = sorted(lessons, key=get_lesson_date)
+        self._resolved = None
+        self._retrieved = 0
+        self._lock = threading.Lock()
 
-        for i, video_json in enumerate(videos_json):
-            try:
-                self._videos.append(
-                    Echo360Video(video_json=video_json, driver=driver, hostname=hostname)
-                )
-            except Exception:
-                if not skip_video_on_error:
-                    raise
-            update_course_retrieval_progress(i + 1, total_videos)
-        
-        self._videos.sort(key=operator.attrgetter("date"))
+    def _retrieve(self, lesson, show_progress, progress_context):
+        try:
+            with get_progress_bus().attached(progress_context):
+                return Echo360Video(lesson=lesson, driver=self._driver, hostname=self._hostname,
+                                    browser_pool=self._browser_pool,
+                                    strategy_stats=self._strategy_stats,
+                                    audio_only=self._audio_only)
+        except Exception:
+            if not self._skip_video_on_error:
+                raise
+            return None
+        finally:
+            with self._lock:
+                self._retrieved += 1
+                if show_progress:
+                    update_course_retrieval_progress(self._retrieved, len(self._lessons))
+
+    def resolve(self, show_progress=False):
+        if self._resolved is not None:
+            for number, video in self._resolved:
+                yield number, video
+            return
+        if show_progress:
+            update_course_retrieval_progress(0, len(self._lessons))
+        # with a browser pool lessons that need the scraping fallback are resolved in
+        # parallel, each on its own browser; otherwise one at a time on the driver
+        workers = 1 if self._browser_pool is None else self._browser_pool.size
+        executor = ThreadPoolExecutor(max_workers=workers)
+        # messages of the workers are reported like those of the caller
+        progress_context = get_progress_bus().context()
+        futures = []
+        try:
+            futures = [executor.submit(self._retrieve, lesson, show_progress, progress_context)
+                       for lesson in self._lessons]
+            resolved = []
+            for number, future in enumerate(futures, 1):
+                video = future.result()
+                if video is None:
+                    # the number stays taken, so later lectures keep their names
+                    continue
+                resolved.append((number, video))
+                yield number, video
+            self._resolved = resolved
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if self._strategy_stats is not None:
+                self._strategy_stats.save()
+
+    def __iter__(self):
+        return self.resolve()
 
     @property
     def videos(self):
-        return self._videos
+        return [video for _, video in self.resolve(show_progress=True)]
 
 class Echo360Video(object):
-    def __init__(self, video_json, driver, hostname):
+    def __init__(self, lesson, driver, hostname, browser_pool=None, strategy_stats=None,
+                 audio_only=False):
         super(Echo360Video, self).__init__()
         self.hostname = hostname
+        self._audio_only = audio_only
         self._driver = driver
-        self.video_json = video_json
+        self._browser_pool = browser_pool
+        self._strategy_stats = strategy_stats
+        self._strategy = None
+        # [(path, expected duration)] written by the last download()
+        self.downloaded_files = []
+        # {path: sha256} of the downloaded files the content store already hashed
+        self.file_digests = {}
+        self._stream_urls = None
+        self._lesson = lesson
         self.is_multipart_video = False
         self.sub_videos = [self]
         
-        self._video_id = "{0}".format(video_json["lesson"]["lesson"]["id"])
-        self._driver.get(self.video_url)
+        self._video_id = lesson.lesson_id
         _logger.info("Retrieving video information for {}".format(self.video_url))
 
-        self._url = self.loop_find_m3u8_url(self.video_url, waitsecounds=30)
-        self._date = self.get_date(video_json)
-        self._title = video_json["lesson"]["lesson"]["name"]
+        self._url = self.loop_find_m3u8_url(self.video_url, waitsecounds=PAGE_LOAD_WAIT)
+        # only needed while resolving
+        self._stream_urls = None
+        self._date = self.get_date(lesson)
+        self._title = lesson.name
     
     @property
     def video_url(self):
@@ -178,52 +370,31 @@ class Echo360Video(object):
     @property
     def url(self):
         return self._url
+
+    @property
+    def strategy(self):
+        # name of the strategy that resolved the url (None if none did)
+        return self._strategy
     
     def get_all_parts(self):
         return self.sub_videos
 
-    def get_date(self, video_json):
-        try:
-            # date is not important so we will just ignore it if something went wrong
-            # Also, some echoCloud videos returns None for video start time... :(
-            date = dateutil.parser.parse(self._extract_date(video_json)).date()
-            return date.strftime("%Y-%m-%d")
-        except Exception:
-            return "1970-01-01"
-    
-    def _extract_date(self, video_json):
-        if self.is_multipart_video:
-            if video_json["groupInfo"]["createdAt"] is not None:
-                return video_json["groupInfo"]["createdAt"]
-            if video_json["groupInfo"]["u'updatedAt'"] is not None:
-                return video_json["groupInfo"]["u'updatedAt'"]
-
-        if "startTimeUTC" in video_json["lesson"]:
-            if video_json["lesson"]["startTimeUTC"] is not None:
-                return video_json["lesson"]["startTimeUTC"]
-        if "createdAt" in video_json["lesson"]["lesson"]:
-            return video_json["lesson"]["lesson"]["createdAt"]
+    def get_date(self, lesson):
+        return get_lesson_date(lesson, self.is_multipart_video)
 
     def loop_find_m3u8_url(self, video_url, waitsecounds=15, max_attempts=5):
-        def brute_force_get_url(suffix):
-            # this is the first method I tried, which sort of works
-            stale_attempt = 1
+        def load_stream_urls(driver):
             refresh_attempt = 1
             while True:
-                self._driver.get(video_url)
                 try:
-                    # the replace is for reversing the escape by the escapped js in the page source
-                    urls = set(
-                        re.findall(
-                            'https://[^,"]*?[.]{}'.format(suffix),
-                            self._driver.page_source.replace("\/", "/"),
-                        )
+                    # a single navigation, the stream urls are picked from the network log;
+                    # only pages that fail to load are loaded again
+                    return capture_stream_urls(
+                        driver, video_url, suffixes=("mp4", "m3u8"), timeout=waitsecounds
                     )
-                    return urls
-
                 except selenium.common.exceptions.TimeoutException:
                     if refresh_attempt >= max_attempts:
-                        print(
+                        print_line(
                             "\r\nERROR: Connection timeouted after {} second for {} attempts... \
                               Possibly internet problem?".format(
                                 waitsecounds, max_attempts
@@ -231,16 +402,21 @@ class Echo360Video(object):
                         )
                         raise
                     refresh_attempt += 1
-                except StaleElementReferenceException:
-                    if stale_attempt >= max_attempts:
-                        print(
-                            "\r\nERROR: Elements are not stable to retrieve after {} attempts... \
-                            Possibly internet problem?".format(
-                                max_attempts
-                            )
-                        )
-                        raise
-                    stale_attempt += 1
+
+        def brute_force_get_url(suffix):
+            # the page is loaded only once and the captured urls are reused for every suffix
+            if self._stream_urls is None:
+                try:
+                    if self._browser_pool is not None:
+                        with self._browser_pool.driver() as driver:
+                            self._stream_urls = load_stream_urls(driver)
+                    else:
+                        self._stream_urls = load_stream_urls(self._driver)
+                except Exception:
+                    # the other suffix fails right away instead of loading the page again
+                    self._stream_urls = {"mp4": set(), "m3u8": set()}
+                    raise
+            return set(self._stream_urls[suffix])
 
         def brute_force_get_mp4_url():
             urls = brute_force_get_url(suffix="mp4")
@@ -251,14 +427,12 @@ class Echo360Video(object):
         def from_json_m3u8():
             # seems like json would also contain that information so this method tries
             # to retrieve based on that
-            if (not self.video_json["lesson"]["hasVideo"]
-                or not self.video_json["lesson"]["hasAvailableVideo"]):
+            if (not self._lesson.has_video
+                or not self._lesson.has_available_video):
                 return False
-            manifests = self.video_json["lesson"]["video"]["media"]["media"]["versions"][0]["manifests"]
-            m3u8urls = [m["uri"] for m in manifests]
+            m3u8urls = self._lesson.manifest_urls
             # somehow the hostname for these urls are from amazon (probably offloading
             # to them.) We need to set the host back to echo360.org
-            from urllib.parse import urlparse
             new_m3u8urls = []
             new_hostname = urlparse(self.hostname).netloc
             for url in m3u8urls:
@@ -271,90 +445,203 @@ class Echo360Video(object):
             return new_m3u8urls
 
         def from_json_mp4():
-            mp4_files = self.video_json["lesson"]["video"]["media"]["media"]["current"][
-                "primaryFiles"
-            ]
-            urls = [obj["s3Url"] for obj in mp4_files]
+            urls = self._lesson.mp4_urls
             if len(urls) == 0:
                 raise ValueError("Cannot find mp4 urls")
             # usually hd is the last one. so we will sort in reverse order
             return next(reversed(urls))
 
-        # try different methods in series, first the preferred ones, then the more
-        # obscure ones.
-        try:
-            _logger.debug("Trying from_json_mp4 method")
-            return from_json_mp4()
-        except Exception as e:
-            _logger.debug("Encountered exception: {}".format(e))
-        try:
-            _logger.debug("Trying from_json_m3u8 method")
-            m3u8urls = from_json_m3u8()
-        except Exception as e:
-            _logger.debug("Encountered exception: {}".format(e))
-        try:
-            _logger.debug("Trying brute_force_all_mp4 method")
-            return brute_force_get_mp4_url()
-        except Exception as e:
-            _logger.debug("Encountered exception: {}".format(e))
-        try:
-            _logger.debug("Trying brute_force_all_m3u8 method")
-            m3u8urls = brute_force_get_url(suffix="m3u8")
-        except Exception as e:
-            _logger.debug("Encountered exception: {}".format(e))
-            _logger.debug("All methods had been exhausted.")
-            print("Tried all methods to retrieve videos but all had failed!")
-            raise
+        def only_audio_video(m3u8urls):
+            # find one that has audio + video
+            m3u8urls = [url for url in m3u8urls if urlparse(url).path.endswith("av.m3u8")]
+            if len(m3u8urls) == 0:
+                raise ValueError("No audio+video m3u8 files found")
+            m3u8urls = list(reversed(m3u8urls))
+            return m3u8urls[:2]
 
-        # find one that has audio + video
-        m3u8urls = [url for url in m3u8urls if url.endswith("av.m3u8")]
-        
-        if len(m3u8urls) == 0:
-            print(
-                "No audio+video m3u8 files found! Skipping...\n"
-                "This can either be \n(i) Credential failure? \n(ii) Logic error "
-                "in the script. \n(iii) This lecture only provides audio?\n"
-                "This script is hard-coded to download audio+video. \n"
-                "If this is your intended behaviour, please contact the author."
-            )
-            return False
-        
-        m3u8urls = list(reversed(m3u8urls))
-        
-        return m3u8urls[:2]
+        def only_audio(m3u8urls):
+            # audio-only manifests (e.g. s0_a.m3u8) first, audio+video ones still have audio
+            paths = {url: urlparse(url).path for url in m3u8urls}
+            audio_urls = [url for url in m3u8urls if paths[url].endswith("_a.m3u8")]
+            av_urls = [url for url in m3u8urls if paths[url].endswith("av.m3u8")]
+            if len(audio_urls) + len(av_urls) == 0:
+                raise ValueError("No audio m3u8 files found")
+            return (list(reversed(audio_urls)) + list(reversed(av_urls)))[:2]
+
+        select_m3u8 = only_audio if self._audio_only else only_audio_video
+
+        strategies = {
+            "from_json_mp4": from_json_mp4,
+            "from_json_m3u8": lambda: select_m3u8(from_json_m3u8() or []),
+            "brute_force_mp4": brute_force_get_mp4_url,
+            "brute_force_m3u8": lambda: select_m3u8(brute_force_get_url(suffix="m3u8")),
+        }
+
+        # try different methods in series, by default first the preferred ones, then the
+        # more obscure ones. The order is adapted to what historically worked for the host.
+        hostname = urlparse(self.hostname).netloc
+        groups = [list(strategies.keys())]
+        if self._audio_only:
+            # m3u8 manifests can be narrowed to the audio rendition, an mp4 has to be
+            # fetched whole, so they come first whatever worked before
+            groups = [[name for name in groups[0] if name.endswith(suffix)]
+                      for suffix in ("m3u8", "mp4")]
+        if self._strategy_stats is not None:
+            groups = [self._strategy_stats.order(hostname, group) for group in groups]
+        order = [name for group in groups for name in group]
+        for name in order:
+            _logger.debug("Trying {} method".format(name))
+            start_time = time.time()
+            try:
+                result = strategies[name]()
+            except Exception as e:
+                _logger.debug("Encountered exception: {}".format(e))
+                result = None
+            if self._strategy_stats is not None:
+                self._strategy_stats.record(
+                    hostname, name, success=bool(result), latency=time.time() - start_time
+                )
+            if result:
+                self._strategy = name
+                return result
+
+        _logger.debug("All methods had been exhausted.")
+        print_line(
+            "No audio+video m3u8 files found! Skipping...\n"
+            "This can either be \n(i) Credential failure? \n(ii) Logic error "
+            "in the script. \n(iii) This lecture only provides audio?\n"
+            "This script downloads audio+video unless --audio-only is given. \n"
+            "If this is your intended behaviour, please contact the author."
+        )
+        return False
     
-    def download(self, output_dir, filename, pool_size=50):
-        print("-" * 80)
-        print("Downloading video: {}".format(filename))
+    def download(self, output_dir, filename, pool_size=50, session=None, segment_options=None,
+                 staging=None, window=None, audio_format=None, cancel_event=None, store=None,
+                 feed_policy="all", compose=None):
+        print_line("-" * 80)
+        print_line("Downloading video: {}".format(filename))
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
+        if staging is None:
+            staging = Staging()
+        self.downloaded_files = []
+        self.file_digests = {}
 
-        session = requests.Session()
-        for cookie in self._driver.get_cookies():
-            session.cookies.set(cookie["name"], cookie["value"])
+        if session is None:
+            session = get_shared_pool().session(self.hostname, self._driver.get_cookies())
         
         urls = self.url
         if not isinstance(urls, list):
             urls = [urls]
+        if audio_format is not None:
+            # every feed carries the same sound
+            urls = urls[:1]
+        else:
+            urls = select_feed_urls(session, urls, feed_policy)
+
+        if compose is not None and len(urls) > 1:
+            if self.download_composed(session, urls, output_dir, filename, staging, window,
+                                      compose, store, cancel_event):
+                return True
+            print_line("  > Downloading the feeds separately")
 
-        final_result = True
-        for counter, single_url in enumerate(urls):
-            print("- Downloading video feed {}...".format(counter + 1))
+        def download_feed(counter, single_url):
+            print_line("- Downloading video feed {}...".format(counter + 1))
             new_filename = (
                 (filename + str(counter + 1))
             )
+            final_file = os.path.join(output_dir, new_filename + self._extension(audio_format))
+            if store is not None:
+                key = store.key(single_url, self._store_variant(window, audio_format))
+                entry = store.materialize(key, final_file)
+                if entry is not None:
+                    # e.g. the same lecture cross-listed in another section
+                    print_line("  > Linked from the store")
+                    self.downloaded_files.append((final_file, entry["duration"]))
+                    self.file_digests[final_file] = entry["object"]
+                    return True
             result = self.download_single(
-                session, single_url, output_dir, new_filename, pool_size
+                session, single_url, output_dir, new_filename, pool_size, segment_options, staging,
+                window, audio_format, cancel_event,
             )
-            final_result = final_result and result
-        
-        return final_result
+            if result and store is not None:
+                for path, expected_duration in list(self.downloaded_files):
+                    if path == final_file:
+                        self.file_digests[path] = store.add(
+                            key, path, self._extension(audio_format), expected_duration)
+            return result
+
+        if len(urls) == 1:
+            return download_feed(0, urls[0])
+        # the feeds (camera, slides, ...) are fetched side by side. Progress listeners
+        # are per thread, the caller's ones follow every feed to its worker thread
+        progress_bus = get_progress_bus()
+        progress_context = progress_bus.context()
+
+        def download_feed_listening(counter, single_url):
+            with progress_bus.attached(progress_context):
+                return download_feed(counter, single_url)
+
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            results = list(executor.map(download_feed_listening, range(len(urls)), urls))
+        self.downloaded_files.sort()
+        return all(results)
+
+    def download_composed(self, session, urls, output_dir, filename, staging, window, layout,
+                          store=None, cancel_event=None):
+        # the first two feeds in one video, composed by ffmpeg while it reads both feeds
+        final_file = os.path.join(output_dir, filename + ".mp4")
+        if store is not None:
+            key = store.key(urls[0], "{0}|{1}".format(self._store_variant(window, None), layout))
+            entry = store.materialize(key, final_file)
+            if entry is not None:
+                print_line("  > Linked from the store")
+                self.downloaded_files.append((final_file, entry["duration"]))
+                self.file_digests[final_file] = entry["object"]
+                return True
+        work_file = os.path.join(staging.scratch_dir_for(output_dir), filename + ".mp4")
+        print_line("- Composing the video feeds ({})...".format(layout))
+        success, expected_duration = self.compose_feeds(session, urls[:2], work_file, layout,
+                                                        window, cancel_event)
+        if not success:
+            if os.path.exists(work_file):
+                os.remove(work_file)
+            return False
+        final_file = staging.finalize(work_file, final_file)
+        if store is not None:
+            self.file_digests[final_file] = store.add(key, final_file, ".mp4", expected_duration)
+        self.downloaded_files.append((final_file, expected_duration))
+        print_line("Done!")
+        print_line("-" * 60)
+        return True
+
+    @staticmethod
+    def _extension(audio_format):
+        return ".mp4" if audio_format is None else "." + audio_format
+
+    @staticmethod
+    def _store_variant(window, audio_format):
+        # a lecture is stored per time window and audio format
+        variant = audio_format or "video"
+        if window is not None:
+            variant += "|{0}-{1}".format(*window)
+        return variant
 
-    def download_single(self, session, single_url, output_dir, filename, pool_size=50):
-        if single_url.endswith(".m3u8"):
+    def download_single(self, session, single_url, output_dir, filename, pool_size=50,
+                        segment_options=None, staging=None, window=None, audio_format=None,
+                        cancel_event=None):
+        if staging is None:
+            staging = Staging()
+        # everything is written to the scratch directory and moved in when finished
+        work_dir = staging.scratch_dir_for(output_dir)
+        if audio_format is not None:
+            return self.download_audio(session, single_url, work_dir, output_dir, filename,
+                                       pool_size, segment_options, staging, window, audio_format,
+                                       cancel_event)
+        if urlparse(single_url).path.endswith(".m3u8"):
             request = session.get(single_url)
             if not request.ok:
-                print("ERROR: Cannot retrieve m3u8 file")
+                print_line("ERROR: Cannot retrieve m3u8 file")
                 return False
             
             lines = [n for n in request.content.decode().split("\n")]
@@ -366,95 +653,402 @@ class Echo360Video(object):
                 m3u8_parser.parse()
             except Exception as e:
                 _logger.debug("Exception occurred while parsing m3u8: {}".format(e))
-                print("Failed to parse m3u8. Skipping...")
+                print_line("Failed to parse m3u8. Skipping...")
                 return False
 
             m3u8_video, m3u8_audio = m3u8_parser.get_video_and_audio()
 
             if m3u8_video is None:
-                print("ERROR: Failed to find video m3u8... skipping this one")
+                print_line("ERROR: Failed to find video m3u8... skipping this one")
                 return False
             
             from download_echo360.hls_downloader import urljoin
+            # the segments of both renditions are cached until the mp4 is in place
+            cache_owner = os.path.join(output_dir, filename + ".mp4")
             audio_file = None
+            audio_offset = None
             if m3u8_audio is not None:
-                print("  > Downloading audio:")
-                audio_file = self._download_url_to_dir(
+                print_line("  > Downloading audio:")
+                audio_file, _, audio_offset = self._download_url_to_dir(
                     urljoin(single_url, m3u8_audio),
-                    output_dir,
+                    work_dir,
                     filename + "_audio",
                     pool_size,
                     convert_to_mp4=False,
+                    session=session,
+                    segment_options=segment_options,
+                    staging=staging,
+                    window=window,
+                    cancel_event=cancel_event,
+                    cache_owner=cache_owner,
                 )
-            print("  > Downloading video:")
-            video_file = self._download_url_to_dir(
-                urljoin(single_url, m3u8_video),
-                output_dir,
-                filename + "_video",
-                pool_size,
-                convert_to_mp4=False,
-            )
-            sys.stdout.write("  > Converting to mp4... ")
-            sys.stdout.flush()
+                if audio_file is None:
+                    return False
+            print_line("  > Downloading video:")
+            try:
+                video_file, expected_duration, video_offset = self._download_url_to_dir(
+                    urljoin(single_url, m3u8_video),
+                    work_dir,
+                    filename + "_video",
+                    pool_size,
+                    convert_to_mp4=False,
+                    session=session,
+                    segment_options=segment_options,
+                    staging=staging,
+                    window=window,
+                    cancel_event=cancel_event,
+                    cache_owner=cache_owner,
+                )
+            except DownloadCancelled:
+                if audio_file is not None:
+                    os.remove(audio_file)
+                raise
+            if video_file is None:
+                if audio_file is not None:
+                    os.remove(audio_file)
+                return False
+            print_line("  > Converting to mp4... ", end="")
 
             # combine audio file with video (separate audio might not exists.)
-            if self.combine_audio_video(audio_file=audio_file,
-                video_file=video_file, final_file=os.path.join(output_dir, filename + ".mp4")):
+            final_file = os.path.join(work_dir, filename + ".mp4")
+            try:
+                combined = self.combine_audio_video(audio_file=audio_file,
+                    video_file=video_file, final_file=final_file,
+                    video_offset=video_offset, audio_offset=audio_offset,
+                    duration=expected_duration if window is not None else None,
+                    cancel_event=cancel_event)
+            except DownloadCancelled:
+                print_line("Cancelled")
+                for leftover in (audio_file, video_file):
+                    if leftover is not None:
+                        os.remove(leftover)
+                raise
+            if combined:
                 # remove left-over plain audio/video files. (if mixing was successful)
                 if audio_file is not None:
                     os.remove(audio_file)
                 os.remove(video_file)
+                final_file = staging.finalize(final_file, os.path.join(output_dir, filename + ".mp4"))
+                self._release_segments(segment_options, cache_owner)
+                self.downloaded_files.append((final_file, expected_duration))
+            else:
+                # keep the plain audio/video files, as before, but the lecture is not done
+                for leftover in (audio_file, video_file):
+                    if leftover is not None:
+                        staging.finalize(
+                            leftover, os.path.join(output_dir, os.path.basename(leftover))
+                        )
+                return False
+        elif window is not None:
+            work_file = os.path.join(work_dir, filename + ".mp4")
+            print_line("  > Downloading window:")
+            success, expected_duration = self.transcode_remote(
+                session, single_url, work_file, window, cancel_event=cancel_event
+            )
+            if not success:
+                if os.path.exists(work_file):
+                    os.remove(work_file)
+                return False
+            work_file = staging.finalize(work_file, os.path.join(output_dir, filename + ".mp4"))
+            self.downloaded_files.append((work_file, expected_duration))
         else: 
-            import tqdm
-
             r = session.get(single_url, stream=True)
             total_size = int(r.headers.get("content-length", 0))
-            block_size = 1024  # 1 kilobyte
-            with tqdm.tqdm(total=total_size, unit="iB", unit_scale=True) as pbar:
-                with open(os.path.join(output_dir, filename + ".mp4"), "wb") as f:
-                    for data in r.iter_content(block_size):
-                        pbar.update(len(data))
-                        f.write(data)
-
-        print("Done!")
-        print("-" * 60)
+            block_size = 64 * 1024
+            work_file = os.path.join(work_dir, filename + ".mp4")
+            progress = get_progress_bus().job(filename, total=total_size or None, unit="bytes")
+            with open(work_file, "wb") as f:
+                staging.preallocate(f, total_size)
+                for data in r.iter_content(block_size):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    progress.add_bytes(len(data))
+                    f.write(data)
+                # the estimate could be off (e.g. compressed transfer)
+                f.truncate(f.tell())
+            if cancel_event is not None and cancel_event.is_set():
+                r.close()
+                progress.finish(ok=False)
+                os.remove(work_file)
+                raise DownloadCancelled(single_url)
+            progress.finish()
+            if (total_size and not r.headers.get("content-encoding")
+                    and os.path.getsize(work_file) != total_size):
+                print_line("ERROR: Expected {} bytes but got {}".format(
+                    total_size, os.path.getsize(work_file)))
+                os.remove(work_file)
+                return False
+            work_file = staging.finalize(work_file, os.path.join(output_dir, filename + ".mp4"))
+            self.downloaded_files.append((work_file, None))
+
+        print_line("Done!")
+        print_line("-" * 60)
         return True
     
-    def _download_url_to_dir(
-        self, url, output_dir, filename, pool_size, convert_to_mp4=True):
-        echo360_downloader = Downloader(
-            pool_size, selenium_cookies=self._driver.get_cookies()
+    def download_audio(self, session, single_url, work_dir, output_dir, filename, pool_size,
+                       segment_options, staging, window, audio_format, cancel_event=None):
+        # only the audio is fetched (for hls), the result is an m4a/opus file
+        final_file = os.path.join(work_dir, "{0}.{1}".format(filename, audio_format))
+        if urlparse(single_url).path.endswith(".m3u8"):
+            request = session.get(single_url)
+            if not request.ok:
+                print_line("ERROR: Cannot retrieve m3u8 file")
+                return False
+            m3u8_parser = NaiveM3U8Parser(request.content.decode().split("\n"))
+            try:
+                m3u8_parser.parse()
+            except Exception as e:
+                _logger.debug("Exception occurred while parsing m3u8: {}".format(e))
+                print_line("Failed to parse m3u8. Skipping...")
+                return False
+
+            from download_echo360.hls_downloader import urljoin
+            m3u8_audio = m3u8_parser.get_audio()
+            # not a master playlist, the segments are listed directly
+            audio_url = single_url if m3u8_audio is None else urljoin(single_url, m3u8_audio)
+            cache_owner = os.path.join(output_dir, os.path.basename(final_file))
+            print_line("  > Downloading audio:")
+            audio_file, expected_duration, audio_offset = self._download_url_to_dir(
+                audio_url,
+                work_dir,
+                filename + "_audio",
+                pool_size,
+                convert_to_mp4=False,
+                session=session,
+                segment_options=segment_options,
+                staging=staging,
+                window=window,
+                cancel_event=cancel_event,
+                cache_owner=cache_owner,
+            )
+            if audio_file is None:
+                return False
+            print_line("  > Extracting audio... ", end="")
+            try:
+                extracted = self.extract_audio(
+                    audio_file, final_file, audio_format,
+                    offset=audio_offset if window is not None else None,
+                    duration=expected_duration if window is not None else None,
+                    cancel_event=cancel_event)
+            except DownloadCancelled:
+                print_line("Cancelled")
+                os.remove(audio_file)
+                raise
+            if not extracted:
+                staging.finalize(audio_file, os.path.join(output_dir, os.path.basename(audio_file)))
+                return False
+            os.remove(audio_file)
+            self._release_segments(segment_options, cache_owner)
+        else:
+            # mp4 feeds interleave audio and video, ffmpeg drops the video while reading
+            print_line("  > Downloading audio:")
+            success, expected_duration = self.transcode_remote(
+                session, single_url, final_file, window, AUDIO_FORMATS[audio_format],
+                cancel_event
+            )
+            if not success:
+                if os.path.exists(final_file):
+                    os.remove(final_file)
+                return False
+        final_file = staging.finalize(
+            final_file, os.path.join(output_dir, os.path.basename(final_file))
         )
-        echo360_downloader.run(url, output_dir, convert_to_mp4=convert_to_mp4)
+        self.downloaded_files.append((final_file, expected_duration))
+        print_line("Done!")
+        print_line("-" * 60)
+        return True
+
+    @staticmethod
+    def _release_segments(segment_options, cache_owner):
+        segment_cache = (segment_options or {}).get("segment_cache")
+        if segment_cache is not None:
+            segment_cache.release(cache_owner)
+
+    def _download_url_to_dir(
+        self, url, output_dir, filename, pool_size, convert_to_mp4=True, session=None,
+        segment_options=None, staging=None, window=None, cancel_event=None, cache_owner=None):
+        if session is None:
+            session = get_shared_pool().session(self.hostname, self._driver.get_cookies())
+        echo360_downloader = Downloader(pool_size, session=session, staging=staging,
+                                        cancel_event=cancel_event, **(segment_options or {}))
+        if not echo360_downloader.run(url, output_dir, convert_to_mp4=convert_to_mp4,
+                                      window=window, title=filename, cache_owner=cache_owner):
+            # e.g. the window is past the end of the lecture
+            return None, None, None
 
         # rename file
         ext = echo360_downloader.result_file_name.split(".")[-1]
         result_full_path = os.path.join(output_dir, "{0}.{1}".format(filename, ext))
-        os.rename(os.path.join(echo360_downloader.result_file_name), result_full_path)
-        return result_full_path
+        os.replace(os.path.join(echo360_downloader.result_file_name), result_full_path)
+        return result_full_path, echo360_downloader.duration, echo360_downloader.window_offset
+
+    @staticmethod
+    def transcode_remote(session, url, final_file, window=None, output_options=None,
+                         cancel_event=None):
+        # returns (success, duration of the result if known). ffmpeg reads the moov index
+        # first and then seeks with range requests, so for a window only the bytes of the
+        # window (plus the index) are transferred
+        if output_options is None:
+            output_options = TRIM_CODEC_OPTIONS
+        cookies = "; ".join("{0}={1}".format(c.name, c.value) for c in session.cookies)
+        input_options = ["-headers", "Cookie: {}\r\n".format(cookies)] if cookies else []
+        duration = None
+        if window is not None:
+            start, end = window
+            if (start is not None and start < 0) or end is None or end < 0:
+                total_duration = probe_duration(url, input_options=input_options)
+                if total_duration is None:
+                    print_line("ERROR: Cannot read the duration of the mp4 file")
+                    return False, None
+                start, end = Downloader.resolve_window(window, total_duration)
+            if end <= start:
+                print_line("ERROR: The requested window is empty")
+                return False, None
+            duration = end - start
+            input_options = input_options + ["-ss", "{:.3f}".format(start)]
+            output_options = ["-t", "{:.3f}".format(duration)] + output_options
+        if os.path.exists(final_file):
+            os.remove(final_file)
+        try:
+            ff = ffmpy.FFmpeg(
+                global_options="-loglevel panic",
+                inputs={url: input_options},
+                outputs={final_file: output_options},
+            )
+            run_ffmpeg(ff, cancel_event, final_file)
+        except ffmpy.FFExecutableNotFoundError:
+            print_line('[WARN] Cannot transcode the mp4 file because "ffmpeg" not installed.')
+            return False, None
+        except ffmpy.FFRuntimeError as e:
+            _logger.debug("Failed to transcode {}: {}".format(url, e))
+            print_line("ERROR: Failed to transcode the mp4 file")
+            return False, None
+        return True, duration
+
+    @staticmethod
+    def _feed_streams(session, url):
+        # (video url, separate audio url or None) of a feed, as download_single picks them
+        if not urlparse(url).path.endswith(".m3u8"):
+            return url, None
+        request = session.get(url)
+        if not request.ok:
+            return None, None
+        m3u8_parser = NaiveM3U8Parser(request.content.decode().split("\n"))
+        m3u8_parser.parse()
+        if not m3u8_parser.videos:
+            # a media playlist
+            return url, None
+        m3u8_video, m3u8_audio = m3u8_parser.get_video_and_audio()
+        from download_echo360.hls_downloader import urljoin
+        return (urljoin(url, m3u8_video),
+                None if m3u8_audio is None else urljoin(url, m3u8_audio))
+
+    @staticmethod
+    def compose_feeds(session, urls, final_file, layout, window=None, cancel_event=None):
+        # returns (success, duration of the result if known). A single ffmpeg run reads
+        # both feeds from the network and encodes the composition, with the sound of
+        # the primary feed
+        cookies = "; ".join("{0}={1}".format(c.name, c.value) for c in session.cookies)
+        header_options = ["-headers", "Cookie: {}\r\n".format(cookies)] if cookies else []
+        try:
+            primary_video, primary_audio = Echo360Video._feed_streams(session, urls[0])
+            secondary_video, _ = Echo360Video._feed_streams(session, urls[1])
+        except Exception as e:
+            _logger.debug("Cannot read the feeds {}: {}".format(urls, e))
+            primary_video = secondary_video = None
+        if primary_video is None or secondary_video is None:
+            print_line("ERROR: Cannot retrieve the video feeds")
+            return False, None
+        input_options = list(header_options)
+        output_options = ["-filter_complex", COMPOSE_LAYOUTS[layout], "-map", "[v]",
+                          "-map", "2:a" if primary_audio is not None else "0:a?"]
+        output_options += TRIM_CODEC_OPTIONS
+        duration = None
+        if window is not None:
+            start, end = window
+            if (start is not None and start < 0) or end is None or end < 0:
+                total_duration = probe_duration(primary_video, input_options=header_options)
+                if total_duration is None:
+                    print_line("ERROR: Cannot read the duration of the video feed")
+                    return False, None
+                start, end = Downloader.resolve_window(window, total_duration)
+            if end <= start:
+                print_line("ERROR: The requested window is empty")
+                return False, None
+            duration = end - start
+            input_options += ["-ss", "{:.3f}".format(start)]
+            output_options = ["-t", "{:.3f}".format(duration)] + output_options
+        inputs = {primary_video: input_options, secondary_video: input_options}
+        if primary_audio is not None:
+            inputs[primary_audio] = input_options
+        if os.path.exists(final_file):
+            os.remove(final_file)
+        try:
+            ff = ffmpy.FFmpeg(
+                global_options="-loglevel panic",
+                inputs=inputs,
+                outputs={final_file: output_options},
+            )
+            run_ffmpeg(ff, cancel_event, final_file)
+        except ffmpy.FFExecutableNotFoundError:
+            print_line('[WARN] Cannot compose the video feeds because "ffmpeg" not installed.')
+            return False, None
+        except ffmpy.FFRuntimeError as e:
+            _logger.debug("Failed to compose {}: {}".format(urls, e))
+            print_line("ERROR: Failed to compose the video feeds")
+            return False, None
+        return True, duration
+
+    @staticmethod
+    def extract_audio(infile, final_file, audio_format, offset=None, duration=None,
+                      cancel_event=None):
+        if os.path.exists(final_file):
+            os.remove(final_file)
+        output_options = AUDIO_FORMATS[audio_format]
+        if duration is not None:
+            output_options = ["-t", "{:.3f}".format(duration)] + output_options
+        try:
+            ff = ffmpy.FFmpeg(
+                global_options="-loglevel panic",
+                inputs={infile: None if offset is None else ["-ss", "{:.3f}".format(offset)]},
+                outputs={final_file: output_options},
+            )
+            run_ffmpeg(ff, cancel_event, final_file)
+        except ffmpy.FFExecutableNotFoundError:
+            print_line('[WARN] Cannot extract the audio because "ffmpeg" not installed.')
+            return False
+        except ffmpy.FFRuntimeError as e:
+            _logger.debug("Failed to extract audio of {}: {}".format(infile, e))
+            return False
+        return True
 
     @staticmethod
-    def combine_audio_video(audio_file, video_file, final_file):
+    def combine_audio_video(audio_file, video_file, final_file, video_offset=None,
+                            audio_offset=None, duration=None, cancel_event=None):
         if os.path.exists(final_file):
             os.remove(final_file)
         _inputs = {}
-        _inputs[video_file] = None
+        _inputs[video_file] = None if video_offset is None else ["-ss", "{:.3f}".format(video_offset)]
         if audio_file is not None:
-            _inputs[audio_file] = None
+            _inputs[audio_file] = None if audio_offset is None else ["-ss", "{:.3f}".format(audio_offset)]
+        output_options = ["-c:v", "copy", "-c:a", "ac3"]
+        if duration is not None:
+            # a stream copy can only cut on keyframes, re-encode for an accurate cut
+            output_options = ["-t", "{:.3f}".format(duration)] + TRIM_CODEC_OPTIONS
         try:
             ff = ffmpy.FFmpeg(
                 global_options="-loglevel panic",
                 inputs=_inputs,
-                outputs={final_file: ["-c:v", "copy", "-c:a", "ac3"]},
+                outputs={final_file: output_options},
             )
-            ff.run()
+            run_ffmpeg(ff, cancel_event, final_file)
         except ffmpy.FFExecutableNotFoundError:
-            print(
+            print_line(
                 '[WARN] Skipping mixing of audio/video because "ffmpeg" not installed.'
             )
             return False
         except ffmpy.FFRuntimeError:
-            print(
+            print_line(
                 "[Error] Skipping mixing of audio/video because ffmpeg exited with non-zero status code."
             )
             return False
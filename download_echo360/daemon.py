@@ -0,0 +1,297 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from download_echo360.downloader import Echo360Downloader
+from download_echo360.main import (
+    get_course_uuid, print_connection_summary, run_course, run_setup_credentials,
+    setup_webdriver_binary,
+)
+from download_echo360.paths import get_user_cache_dir
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+def default_job_file():
+    return os.path.join(get_user_cache_dir("daemon"), "jobs.json")
+
+class JobQueue(object):
+    """
+    The jobs of the daemon, persisted to a JSON file after every change so that
+    queued (and interrupted) jobs survive a restart.
+    """
+
+    def __init__(self, path):
+        super(JobQueue, self).__init__()
+        self._path = path
+        self._condition = threading.Condition()
+        self._cancel_events = {}
+        try:
+            with open(path) as f:
+                self._jobs = json.load(f)
+        except FileNotFoundError:
+            self._jobs = []
+        except ValueError as e:
+            _logger.debug("Ignoring corrupt job file {}: {}".format(path, e))
+            self._jobs = []
+        for job in self._jobs:
+            if job["status"] == "running":
+                # interrupted by the last shutdown, run it again
+                job["status"] = "queued"
+        self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._jobs, f, indent=2)
+        os.replace(tmp_path, self._path)
+
+    def _find(self, job_id):
+        for job in self._jobs:
+            if job["id"] == job_id:
+                return job
+        return None
+
+    def submit(self, course_url, hostname):
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "course": course_url,
+            "hostname": hostname,
+            "status": "queued",
+            "detail": None,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+        }
+        with self._condition:
+            self._jobs.append(job)
+            self._save()
+            self._condition.notify_all()
+        return dict(job)
+
+    def get(self, job_id):
+        with self._condition:
+            job = self._find(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self):
+        with self._condition:
+            return [dict(job) for job in self._jobs]
+
+    def cancel(self, job_id):
+        # queued jobs are dropped, running ones stop after their current lecture
+        with self._condition:
+            job = self._find(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["finished"] = time.time()
+                self._save()
+            elif job["status"] == "running":
+                self._cancel_events[job_id].set()
+            return dict(job)
+
+    def next(self, timeout=None):
+        # blocks until a job is queued, marks it as running
+        with self._condition:
+            deadline = None if timeout is None else time.time() + timeout
+            while True:
+                for job in self._jobs:
+                    if job["status"] == "queued":
+                        job["status"] = "running"
+                        job["started"] = time.time()
+                        self._cancel_events[job["id"]] = threading.Event()
+                        self._save()
+                        return dict(job), self._cancel_events[job["id"]]
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                self._condition.wait(remaining)
+
+    def finish(self, job_id, status, detail):
+        with self._condition:
+            job = self._find(job_id)
+            job["status"] = status
+            job["detail"] = detail
+            job["finished"] = time.time()
+            self._cancel_events.pop(job_id, None)
+            self._save()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    # POST /jobs {"course": ..., "hostname": ...}, GET /jobs, GET /jobs/<id>,
+    # DELETE /jobs/<id> (or POST /jobs/<id>/cancel)
+
+    def address_string(self):
+        # unix sockets have no client address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        _logger.info(format % args)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job_id(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if len(parts) >= 2 and parts[0] == "jobs":
+            return parts[1], parts[2:]
+        return None, parts
+
+    def do_GET(self):
+        jobs = self.server.echo360_daemon.jobs
+        job_id, rest = self._job_id()
+        if job_id is None and rest == ["jobs"]:
+            return self._reply(200, {"jobs": jobs.list()})
+        job = jobs.get(job_id) if job_id is not None and not rest else None
+        if job is None:
+            return self._reply(404, {"error": "not found"})
+        self._reply(200, job)
+
+    def do_POST(self):
+        job_id, rest = self._job_id()
+        if job_id is not None and rest == ["cancel"]:
+            return self._cancel(job_id)
+        if job_id is not None or rest != ["jobs"]:
+            return self._reply(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+            course_url = body["course"]
+            get_course_uuid(course_url)
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return self._reply(400, {"error": "expected {\"course\": <course url or uuid>}"})
+        job = self.server.echo360_daemon.submit(course_url, body.get("hostname"))
+        self._reply(201, job)
+
+    def do_DELETE(self):
+        job_id, rest = self._job_id()
+        if job_id is None or rest:
+            return self._reply(404, {"error": "not found"})
+        self._cancel(job_id)
+
+    def _cancel(self, job_id):
+        job = self.server.echo360_daemon.jobs.cancel(job_id)
+        if job is None:
+            return self._reply(404, {"error": "not found"})
+        self._reply(200, job)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Echo360Daemon(object):
+    """
+    Long-running downloader: keeps one logged-in browser per host and the HTTP
+    pools warm, and runs the courses submitted over a local HTTP API one by one.
+    """
+
+    def __init__(self, output_dir, default_hostname, webdriver_to_use="chrome",
+                 downloader_options=None, job_file=None):
+        super(Echo360Daemon, self).__init__()
+        self._output_dir = output_dir
+        self._default_hostname = default_hostname
+        self._webdriver_to_use = webdriver_to_use
+        self._downloader_options = downloader_options or {}
+        self.jobs = JobQueue(job_file if job_file is not None else default_job_file())
+        self._downloaders = {}
+        self._server = None
+        self._stopped = threading.Event()
+
+    def submit(self, course_url, hostname=None):
+        if hostname is None:
+            from download_echo360 import get_course_hostname
+            hostname = get_course_hostname(course_url, self._default_hostname)
+        return self.jobs.submit(course_url, hostname)
+
+    def _get_downloader(self, hostname):
+        # one browser (and login) per host, reused by every job of that host
+        downloader = self._downloaders.get(hostname)
+        if downloader is None:
+            print("> Please wait for Echo360 to load on SSO for {0}".format(hostname))
+            downloader = Echo360Downloader(course=None, output_dir=self._output_dir,
+                                           webdriver_to_use=self._webdriver_to_use,
+                                           **self._downloader_options)
+            try:
+                run_setup_credentials(driver=downloader._driver, url=hostname)
+            except BaseException:
+                # e.g. no terminal to log in from: don't leave the browser behind
+                try:
+                    downloader.close()
+                except Exception as e:
+                    _logger.debug("Cannot close the browser of {}: {}".format(hostname, e))
+                raise
+            self._downloaders[hostname] = downloader
+        return downloader
+
+    def serve(self, listen):
+        # "HOST:PORT" or "unix:PATH"
+        if listen.startswith("unix:"):
+            path = listen[len("unix:"):]
+            if os.path.exists(path):
+                os.remove(path)
+            self._server = UnixHTTPServer(path, JobRequestHandler)
+        else:
+            host, _, port = listen.rpartition(":")
+            self._server = ThreadingHTTPServer((host or "127.0.0.1", int(port)),
+                                               JobRequestHandler)
+        self._server.echo360_daemon = self
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        print("> Listening for jobs on {0}".format(listen))
+
+    def run(self, listen):
+        setup_webdriver_binary(self._webdriver_to_use)
+        # log in to the default host up front, other hosts on their first job
+        self._get_downloader(self._default_hostname)
+        self.serve(listen)
+        try:
+            while not self._stopped.is_set():
+                job, cancel_event = self.jobs.next(timeout=1.0)
+                if job is None:
+                    continue
+                print("=" * 80)
+                print("> Job {0}: {1}".format(job["id"], job["course"]))
+                try:
+                    downloader = self._get_downloader(job["hostname"])
+                    status, detail = run_course(downloader, job["course"], job["hostname"],
+                                                cancel_event=cancel_event)
+                except Exception as e:
+                    _logger.debug("Job {} failed: {}".format(job["id"], e))
+                    status, detail = "FAIL", str(e)
+                self.jobs.finish(job["id"], {
+                    "OK": "ok", "PARTIAL": "partial", "FAIL": "failed", "CANCELLED": "cancelled",
+                }[status], detail)
+                print("> Job {0}: {1} ({2})".format(job["id"], status, detail))
+        except KeyboardInterrupt:
+            print("> Shutting down, unfinished jobs are resumed on the next start")
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self._downloaders:
+            # every host shares the store, it is cleaned up once per run
+            next(iter(self._downloaders.values())).collect_store_garbage()
+        for downloader in self._downloaders.values():
+            downloader.close()
+        self._downloaders = {}
+        print_connection_summary()
@@ -1,13 +1,89 @@
 # Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
 import os
 import platform
+import re
+import subprocess
+
+import requests
+
 from download_echo360.download_binary.downloader import BinaryDownloader
 
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# chromedriver of the newest patch release of every chrome build (major.minor.build)
+LATEST_PATCH_VERSIONS_URL = (
+    "https://googlechromelabs.github.io/chrome-for-testing/"
+    "latest-patch-versions-per-build-with-downloads.json"
+)
+
+_chrome_versions = {}
+
+def get_chrome_version(chrome_binary):
+    # e.g. "119.0.6045.105", None if unknown (chrome on windows does not print it)
+    if chrome_binary is None:
+        return None
+    if chrome_binary not in _chrome_versions:
+        version = None
+        try:
+            output = subprocess.check_output(
+                [chrome_binary, "--version"], stderr=subprocess.DEVNULL, timeout=10
+            )
+            match = re.search(r"(\d+\.\d+\.\d+\.\d+)", output.decode(errors="replace"))
+            if match:
+                version = match.group(1)
+        except (OSError, subprocess.SubprocessError) as e:
+            _logger.debug("Cannot get the version of {}: {}".format(chrome_binary, e))
+        _chrome_versions[chrome_binary] = version
+    return _chrome_versions[chrome_binary]
+
 class ChromedriverDownloader(BinaryDownloader):
-    def __init__(self):
+    def __init__(self, chrome_binary=None):
         self._name = "chromedriver"
         self._download_link_root = "https://edgedl.me.gvt1.com/edgedl/chrome/chrome-for-testing/"
+        self._download_link = None
+        # used when the installed chrome cannot be matched
         self._version = "119.0.6045.105"
+        self._chrome_binary = chrome_binary
+        self._resolve_version()
+
+    def _find_installed(self, build):
+        # newest cached driver of the same chrome build, so warm starts need no network
+        suffix = "-{}".format(self.get_os_suffix())
+        versions = []
+        for name in os.listdir(self.get_cache_root()):
+            if name.startswith(build + ".") and name.endswith(suffix):
+                versions.append(name[:-len(suffix)])
+        versions.sort(key=lambda v: [int(n) for n in v.split(".") if n.isdigit()])
+        for version in reversed(versions):
+            if self._read_install(os.path.join(self.get_cache_root(), version + suffix)):
+                return version
+        return None
+
+    def _resolve_version(self):
+        chrome_version = get_chrome_version(self._chrome_binary)
+        if chrome_version is None:
+            return
+        build = ".".join(chrome_version.split(".")[:3])
+        installed = self._find_installed(build)
+        if installed is not None:
+            self._version = installed
+            return
+        try:
+            r = requests.get(LATEST_PATCH_VERSIONS_URL, timeout=15)
+            r.raise_for_status()
+            release = r.json()["builds"][build]
+            self._version = release["version"]
+            for download in release["downloads"]["chromedriver"]:
+                if download["platform"] == self.get_os_suffix():
+                    self._download_link = download["url"]
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print("Cannot find a chromedriver for Chrome {0}, using {1}".format(
+                chrome_version, self._version))
+            _logger.debug("Cannot resolve the chromedriver version: {}".format(e))
 
     def get_os_suffix(self):
         os_name = platform.system().lower()
@@ -29,26 +105,22 @@ class ChromedriverDownloader(BinaryDownloader):
             elif os_arch == 'x86_64':
                 self._os_darwin_64 = 'mac-x64'
         return super(ChromedriverDownloader, self).get_os_suffix()
-    
+
     def get_filename(self):
         os_suffix = self.get_os_suffix()
-        return "chromedriver-{0}".format(os_suffix) 
+        return "chromedriver-{0}".format(os_suffix)
 
     def get_download_link(self):
         os_suffix = self.get_os_suffix()
         filename = self.get_filename() + ".zip"
-        download_link = "{0}/{1}/{2}/{3}".format(
-            self._download_link_root, self._version, os_suffix, filename
-        )
+        download_link = self._download_link
+        if download_link is None:
+            download_link = "{0}/{1}/{2}/{3}".format(
+                self._download_link_root, self._version, os_suffix, filename
+            )
         print("Download link: {0}".format(download_link))
         return download_link, filename
 
-    def get_bin_root_path(self):
-        return super(ChromedriverDownloader, self).get_bin_root_path()
-
     def get_bin(self):
         extension = ".exe" if "win" in self.get_os_suffix() else ""
-        return "{0}/{1}{2}".format(self.get_bin_root_path(), self._name, extension)
-
-    def download(self):
-        super(ChromedriverDownloader, self).download()
\ No newline at end of file
+        return os.path.join(self.get_bin_root_path(), "{0}{1}".format(self._name, extension))
@@ -1,17 +1,33 @@
 # Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import base64
+import hashlib
+import json
 import sys
 import os
 import stat
-import wget
 import shutil
+import tempfile
 import logging
 
+import requests
+
+from download_echo360.integrity import hash_file
+from download_echo360.paths import get_user_cache_dir
+
 logging.basicConfig(
     format="[%(levelname)s: %(name)-12s] %(message)s",
     level=logging.ERROR)
 _logger = logging.getLogger(__name__)
 
 class BinaryDownloader(object):
+    """
+    Installs a binary into the per-user cache, one folder per version and platform,
+    so that it is downloaded once per machine and found from any working directory.
+    Installs are checksummed and atomic: a folder only appears once it is complete.
+    """
+
+    INSTALL_FILE = "install.json"
+
     def __init__(self):
         raise NotImplementedError
 
@@ -38,52 +54,102 @@ class BinaryDownloader(object):
     def get_download_link(self):
         raise NotImplementedError
 
+    def get_cache_root(self):
+        return get_user_cache_dir(self._name)
+
     def get_bin_root_path(self):
-        return "{0}/bin".format(os.getcwd())
+        return os.path.join(
+            self.get_cache_root(), "{0}-{1}".format(self._version, self.get_os_suffix())
+        )
 
     def get_bin(self):
         raise NotImplementedError
 
+    def _read_install(self, bin_root_path):
+        try:
+            with open(os.path.join(bin_root_path, BinaryDownloader.INSTALL_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_installed(self):
+        install = self._read_install(self.get_bin_root_path())
+        if install is None or not os.path.isfile(self.get_bin()):
+            return False
+        # a truncated or modified binary is installed again
+        if hash_file(self.get_bin()) != install.get("sha256"):
+            _logger.debug("Checksum mismatch of {}".format(self.get_bin()))
+            return False
+        return True
+
+    def ensure(self):
+        if not self.is_installed():
+            self.download()
+        return self.get_bin()
+
+    @staticmethod
+    def _fetch(link, path):
+        # returns False if the server advertises a checksum that does not match
+        md5 = hashlib.md5()
+        with requests.get(link, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in r.iter_content(1024 * 1024):
+                    md5.update(chunk)
+                    f.write(chunk)
+            # e.g. "crc32c=...,md5=..." on google storage
+            for item in r.headers.get("x-goog-hash", "").split(","):
+                algorithm, _, value = item.strip().partition("=")
+                if algorithm == "md5" and base64.b64decode(value) != md5.digest():
+                    return False
+        return True
+
     def download(self):
         print(
             '>> Downloading {0} binary file for "{1}"'.format(
                 self._name, self.get_os_suffix()
             )
         )
-        # Download bin for this os
         link, filename = self.get_download_link()
-        bin_path = self.get_bin_root_path()
-        # delete bin directory if exists
-        if os.path.exists(bin_path):
-            shutil.rmtree(bin_path)
-        os.makedirs(bin_path)
-        # remove existing binary file or folder
-        wget.download(link, out="{0}/{1}".format(bin_path, filename))
-        print('\r\n>> Extracting archive file "{0}"'.format(filename))
-        if sys.version_info >= (3, 0):  # compatibility for python 2 & 3
-            shutil.unpack_archive(
-                "{0}/{1}".format(bin_path, filename), extract_dir=bin_path
-            )
-        else:
-            if ".zip" in filename:
-                import zipfile
-
-                with zipfile.ZipFile("{0}/{1}".format(bin_path, filename), "r") as zip:
-                    zip.extractall(bin_path)
-            elif ".tar" in filename:
-                import tarfile
-
-                with tarfile.open("{0}/{1}".format(bin_path, filename)) as tar:
-                    tar.extractall(path=bin_path)
-        # check if its a folder or file
-        if os.path.isdir("{0}/{1}".format(bin_path, filename.split(".")[0])):
-            # move the folder to bin path
-            shutil.move(
-                "{0}/{1}/chromedriver".format(bin_path, filename.split(".")[0]),
-                "{0}/".format(bin_path),
-            )
-            # remove the extracted folder
-            shutil.rmtree("{0}/{1}".format(bin_path, filename.split(".")[0]))
-        # Make the extracted bin executable
-        st = os.stat(self.get_bin())
-        os.chmod(self.get_bin(), st.st_mode | stat.S_IEXEC)
\ No newline at end of file
+        bin_root_path = self.get_bin_root_path()
+        bin_name = os.path.basename(self.get_bin())
+        # everything happens in a temporary folder next to the final one
+        tmp_path = tempfile.mkdtemp(prefix=".install-", dir=self.get_cache_root())
+        try:
+            archive = os.path.join(tmp_path, filename)
+            if not self._fetch(link, archive):
+                raise IOError("Checksum mismatch of {}".format(link))
+            print('>> Extracting archive file "{0}"'.format(filename))
+            extract_path = os.path.join(tmp_path, "extracted")
+            shutil.unpack_archive(archive, extract_dir=extract_path)
+            for root, _, files in os.walk(extract_path):
+                if bin_name in files:
+                    shutil.move(os.path.join(root, bin_name), os.path.join(tmp_path, bin_name))
+                    break
+            else:
+                raise IOError("{0} not found in {1}".format(bin_name, filename))
+            shutil.rmtree(extract_path)
+            os.remove(archive)
+            # Make the extracted bin executable
+            bin_path = os.path.join(tmp_path, bin_name)
+            st = os.stat(bin_path)
+            os.chmod(bin_path, st.st_mode | stat.S_IEXEC)
+            with open(os.path.join(tmp_path, BinaryDownloader.INSTALL_FILE), "w") as f:
+                json.dump({
+                    "version": self._version,
+                    "platform": self.get_os_suffix(),
+                    "url": link,
+                    "sha256": hash_file(bin_path),
+                }, f, indent=2)
+            if os.path.exists(bin_root_path):
+                # a broken install
+                shutil.rmtree(bin_root_path)
+            try:
+                os.replace(tmp_path, bin_root_path)
+            except OSError:
+                # installed by another process meanwhile
+                if not self.is_installed():
+                    raise
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
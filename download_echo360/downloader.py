@@ -1,14 +1,31 @@
 # Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import functools
+import json
 import logging
 import os
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 # selenium
 import selenium
 from selenium import webdriver
 import warnings
 
+from download_echo360.browser_pool import BrowserPool
+from download_echo360.course import AUDIO_FORMATS
+from download_echo360.download_binary.chromedriver import ChromedriverDownloader
+from download_echo360.hls_downloader import DownloadCancelled, Downloader
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.integrity import DownloadManifest
+from download_echo360.network_log import PERFORMANCE_LOGGING_PREFS
+from download_echo360.planning import DownloadPlanner
+from download_echo360.progress import format_size
+from download_echo360.segment_cache import SegmentCache
+from download_echo360.staging import Staging
+from download_echo360.store import ContentStore
+from download_echo360.strategy_stats import StrategyStats
+
 logging.basicConfig(
     format="[%(levelname)s: %(name)-12s] %(message)s",
     level=logging.ERROR)
@@ -16,6 +33,7 @@ logger = logging.getLogger(__name__)
 
 warnings.filterwarnings("ignore", category=UserWarning, module="selenium")
 
+@functools.lru_cache(maxsize=None)
 def get_chrome_binary_path():
     if sys.platform.startswith("win"):
         # check if chrome is installed in the default directory
@@ -75,6 +93,80 @@ def get_chrome_binary_path():
                     print("Invalid path")
                     print("-" * 80)
 
+def build_chrome_driver(binary_location, useragent, headless=False):
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+
+    opts = Options()
+    opts.binary_location = binary_location
+    if headless:
+        opts.add_argument("--headless=new")
+    opts.add_argument("--window-size=1920x1080")
+    opts.add_argument("user-agent={}".format(useragent))
+    # lets the resolver read stream urls from the network events
+    opts.set_capability("goog:loggingPrefs", PERFORMANCE_LOGGING_PREFS)
+    # the chromedriver matching this browser, from the per-user cache
+    service = Service(executable_path=ChromedriverDownloader(binary_location).ensure())
+    return webdriver.Chrome(service=service, options=opts)
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(round(seconds))
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def format_window(window):
+    start, end = window
+    return "{0}-{1}".format(
+        "start" if start is None else "{:g}s".format(start),
+        "end" if end is None else "{:g}s".format(end),
+    )
+
+def write_plans(plans, output_format="table", output_file=None):
+    if output_format == "json":
+        text = json.dumps({"courses": plans}, indent=2)
+    else:
+        text = "\n\n".join(
+            format_plan_table(plan["course"], plan["lessons"]) for plan in plans
+        )
+    if output_file is None:
+        print(text)
+    else:
+        with open(output_file, "w") as f:
+            f.write(text + "\n")
+
+def format_plan_table(course_name, lessons):
+    lines = ["Course: {0}".format(course_name), "-" * 80]
+    lines.append("{0:<20} {1:<17} {2:<11} {3:>8} {4:>10}  {5}".format(
+        "Action", "Strategy", "Rendition", "Duration", "Size", "Lecture"))
+    for lesson in lessons:
+        renditions = [f["rendition"] or f["kind"] or "?" for f in lesson["feeds"]]
+        lines.append("{0:<20} {1:<17} {2:<11} {3:>8} {4:>10}  {5}".format(
+            lesson["action"],
+            lesson["strategy"] or "-",
+            "+".join(renditions) or "-",
+            format_duration(lesson["duration"]),
+            format_size(lesson["size"]),
+            lesson["filename"],
+        ))
+    fetched = [lesson for lesson in lessons if lesson["action"] == "fetch"]
+    lines.append("-" * 80)
+    lines.append("Would fetch {0} of {1} lectures, about {2}".format(
+        len(fetched), len(lessons),
+        format_size(sum(lesson["size"] or 0 for lesson in fetched))))
+    return "\n".join(lines)
+
+INVALID_FILENAME_CHARACTERS = re.compile(r"[\\\\/:*?\"<>|]")
+
+def get_lecture_filename(course, date, title):
+    if course:
+        # add [:150] to avoid filename too long exception
+        filename = "{} - {} - {}".format(course, date, title[:150])
+    else:
+        filename = "{} - {}".format(date, title[:150])
+    # replace invalid character for files
+    return INVALID_FILENAME_CHARACTERS.sub("_", filename)
+
 def names_contain(names, name):
     for n in names:
         if name in n:
@@ -82,109 +174,369 @@ def names_contain(names, name):
     return False
 
 class Echo360Downloader(object):
-    def __init__(self, course, output_dir, webdriver_to_use="chrome"):
+    def __init__(self, course, output_dir, webdriver_to_use="chrome", pool_size=50,
+                 scrape_workers=4, hedge=False, max_hedges=4, scratch_dir=None,
+                 fsync_policy="final", disk_watermark=0.95, verify=False, verify_workers=4,
+                 window=None, audio_format=None, store_dir=None,
+                 segment_cache_size=0, feed_policy="all", compose=None,
+                 transport="requests"):
         super(Echo360Downloader, self).__init__()
-        self._course = course
+        self._course = None
         root_path = os.path.dirname(os.path.abspath(sys.modules["__main__"].__file__))
         if output_dir == "":
             output_dir = root_path
+        self._base_output_dir = output_dir
         self._output_dir = output_dir
+        self._pool_size = pool_size
+        self._scrape_workers = scrape_workers
+        # passed on to every hls_downloader.Downloader
+        self._segment_options = {
+            "hedge": hedge,
+            "max_hedges": max_hedges,
+            "segment_cache": SegmentCache(max_size=segment_cache_size) if segment_cache_size else None,
+            "transport": transport,
+        }
+        self._staging = Staging(scratch_dir=scratch_dir, fsync_policy=fsync_policy)
+        self._disk_watermark = disk_watermark
+        self._verify = verify
+        self._verify_workers = verify_workers
+        # (start, end) in seconds to only download part of every lecture
+        self._window = window
+        # m4a/opus to only download the audio of every lecture, None for audio+video
+        self._audio_format = audio_format
+        # which feeds of a multi-camera lecture are fetched, and how they are put together
+        self._feed_policy = feed_policy
+        self._compose = compose
+        # finished lectures are shared between courses through the content store
+        self._store = ContentStore(store_dir) if store_dir is not None else None
+        self._browser_pool = None
+        self._driver_factory = None
 
         self._useragent = "Mozilla/5.0 (iPad; CPU OS 6_0 like Mac OS X) AppleWebKit/536.26 (KHTML, like Gecko) Version/6.0 Mobile/10A5376e Safari/8536.25"
 
         if webdriver_to_use == "chrome":
-            from selenium.webdriver.chrome.service import Service
-            from selenium.webdriver.chrome.options import Options
-            from download_echo360.download_binary.chromedriver import (
-                ChromedriverDownloader as binary_downloader
+            chrome_binary = get_chrome_binary_path()
+            self._driver = build_chrome_driver(chrome_binary, self._useragent)
+            # headless instances for the scraping fallback, started on demand
+            self._driver_factory = lambda: build_chrome_driver(
+                chrome_binary, self._useragent, headless=True
             )
-
-            _binary_downloader = binary_downloader()
-            opts = Options()
-            opts.binary_location = get_chrome_binary_path()
-            opts.add_argument("--window-size=1920x1080")
-            opts.add_argument("user-agent={}".format(self._useragent))
-            service = Service(executable_path="bin/chromedriver")
-            self._driver = webdriver.Chrome(service=service, options=opts)
         
-        self._course.set_driver(self._driver)
+        # connection pool of the course host, shared process-wide (see set_course)
+        self._session = None
         self._videos = []
 
-        self.regex_replace_invalid = re.compile(r"[\\\\/:*?\"<>|]")
+        self.regex_replace_invalid = INVALID_FILENAME_CHARACTERS
+        if course is not None:
+            self.set_course(course)
 
-    def _find_pos(self, videos, the_video):
-        # compare by object id, because date could possibly be the same in some case.
-        return videos.index(the_video)
+    def set_course(self, course):
+        self._course = course
+        self._output_dir = self._base_output_dir
+        self._session = get_shared_pool().session(course.hostname)
+        self._course.set_driver(self._driver)
+        self._course.set_session(self._session)
+        self._course.set_strategy_stats(StrategyStats.default())
+        self._course.set_audio_only(self._audio_format is not None)
+
+    def _load_cookies(self):
+        # refresh cookies from selenium, as the user may have logged in since
+        for cookie in self._driver.get_cookies():
+            self._session.cookies.set(cookie["name"], cookie["value"])
+
+    def _get_browser_pool(self):
+        if self._browser_pool is None and self._scrape_workers > 1 \
+                and self._driver_factory is not None:
+            self._browser_pool = BrowserPool(
+                self._driver_factory,
+                size=self._scrape_workers,
+                hostname=self._course.hostname,
+                cookies=self._driver.get_cookies(),
+            )
+        return self._browser_pool
+
+    def _close_browser_pool(self):
+        if self._browser_pool is not None:
+            self._browser_pool.close()
+            self._browser_pool = None
+
+    def close(self):
+        self._close_browser_pool()
+        self._session.close()
+        self._driver.quit()
+
+    def collect_store_garbage(self):
+        # once per run: stored lectures no course folder refers to anymore are removed
+        if self._store is None:
+            return
+        removed, freed = self._store.gc()
+        if removed:
+            print("> Removed {0} unreferenced lecture(s) ({1}) from the store".format(
+                removed, format_size(freed)))
 
     def _get_filename(self, course, date, title):
-        if course:
-            # add [:150] to avoid filename too long exception
-            filename = "{} - {} - {}".format(course, date, title[:150])
-        else:
-            filename = "{} - {}".format(date, title[:150])
-        # replace invalid character for files
-        return self.regex_replace_invalid.sub("_", filename)
+        return get_lecture_filename(course, date, title)
 
-    def download_all(self):
+    def _resolve_videos(self):
+        # iterating yields (lecture number, video) in lecture order, later lessons keep
+        # resolving in the background; the caller closes the browser pool when done
         print("> I assume you have already logged in to Echo360...")
+        self._load_cookies()
+        self._course.set_browser_pool(self._get_browser_pool())
         print("> Retrieving couser information...", flush=True)
-        print("> Done!")
-        videos = self._course.get_videos().videos
         # change the output directory to be inside a folder named after the course
         self._output_dir = os.path.join(
-            self._output_dir, "{0}".format(self._course.nice_name).strip()
+            self._base_output_dir, "{0}".format(self._course.nice_name).strip()
         )
-        print("> Downloading videos to: {0}".format(self._output_dir))
+        print("> Done!")
+        return self._course.get_videos()
+
+    def _planned_feed_policy(self):
+        # audio-only downloads take the sound of the first feed only
+        return "primary" if self._audio_format is not None else self._feed_policy
+
+    def _list_downloaded(self, verbose=True):
         if os.path.exists(self._output_dir):
             already = os.listdir(self._output_dir)
-            print(f"These files are already under that directory: {already}")
+            if verbose:
+                print(f"These files are already under that directory: {already}")
         else:
             already = []
-        # replace invalid character for folder
-        self.regex_replace_invalid.sub("_", self._output_dir)
-        videos_to_be_download = []
-        for video in videos:
-            lecture_number = self._find_pos(videos, video)
-            sub_videos = video.get_all_parts()
-
-            for i, sub_video in list(enumerate(sub_videos)):
-                sub_lecture_num = lecture_number + 1
-                if len(sub_videos) > 1:
-                    sub_lecture_num = "{}.{}".format(sub_lecture_num, i + 1)
-                title = "Lecture {} [{}]".format(sub_lecture_num, sub_video.title)
-                filename = self._get_filename(self._course.course_id,
-                                                date=sub_video.date,
-                                                title=title)
-                
-                # check if the video is already downloaded
-                print("> Checking if the video '{0}' has already been downloaded...".format(filename))
-                if names_contain(already, filename):
-                    print(
-                        ">> Skipping Lecture '{0}' as it has already been downloaded.".format(
-                            filename
+        # audio-only and audio+video downloads of a lecture don't count for each other
+        if self._audio_format is not None:
+            return [n for n in already if n.endswith("." + self._audio_format)]
+        return [n for n in already if os.path.splitext(n)[1][1:] not in AUDIO_FORMATS]
+
+    def _get_jobs(self, lecture_number, video, already):
+        # [(filename, video, already downloaded)] of every part of a lecture
+        jobs = []
+        sub_videos = video.get_all_parts()
+        for i, sub_video in list(enumerate(sub_videos)):
+            sub_lecture_num = lecture_number
+            if len(sub_videos) > 1:
+                sub_lecture_num = "{}.{}".format(sub_lecture_num, i + 1)
+            title = "Lecture {} [{}]".format(sub_lecture_num, sub_video.title)
+            filename = self._get_filename(self._course.course_id,
+                                            date=sub_video.date,
+                                            title=title)
+            if self._window is not None:
+                filename = "{} [{}]".format(filename, format_window(self._window))
+            jobs.append((filename, sub_video, names_contain(already, filename)))
+        return jobs
+
+    def _verify_downloads(self, manifest):
+        print("> Verifying {0} downloaded file(s)...".format(len(manifest.entries)))
+        broken = manifest.verify(workers=self._verify_workers)
+        for name, problem in sorted(broken.items()):
+            # removing the file queues the lecture for download again
+            print(">> '{0}' is broken ({1}), it will be downloaded again.".format(name, problem))
+            path = os.path.join(self._output_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+            if self._store is not None:
+                # a linked file shares its content with the store object
+                self._store.discard(manifest.entries[name]["sha256"])
+            manifest.remove(name)
+        print("> {0} file(s) OK, {1} broken".format(
+            len(manifest.entries), len(broken)))
+
+    def _verify_unrecorded(self, manifest, planner, jobs):
+        # jobs: [(filename, video, file names)], returns [(filename, video)] to download again
+        checks = []
+        for (filename, video, names), inspection in zip(
+                jobs, planner.inspect([video for _, video, _ in jobs])):
+            expected_duration = inspection["duration"]
+            if expected_duration is not None and self._window is not None:
+                start, end = Downloader.resolve_window(self._window, expected_duration)
+                expected_duration = max(0.0, end - start)
+            checks += [(filename, video, name, expected_duration) for name in names]
+        print("> Verifying {0} downloaded file(s) without a recorded checksum...".format(
+            len(checks)))
+        with ThreadPoolExecutor(max_workers=self._verify_workers) as executor:
+            results = list(executor.map(
+                lambda check: manifest.check_unrecorded(check[2], check[3]), checks))
+        again = []
+        unverified = 0
+        for (filename, video, name, _), (problem, reason) in zip(checks, results):
+            if problem is None:
+                print(">> '{0}' is unverified ({1}).".format(name, reason))
+                unverified += 1
+                continue
+            print(">> '{0}' is broken ({1}), it will be downloaded again.".format(name, problem))
+            os.remove(os.path.join(self._output_dir, name))
+            if (filename, video) not in again:
+                again.append((filename, video))
+        print("> {0} file(s) unverified, {1} broken".format(unverified, len(checks) - unverified))
+        return again
+
+    def download_all(self, close_driver=True, cancel_event=None):
+        videos = self._resolve_videos()
+        print("> Downloading videos to: {0}".format(self._output_dir))
+        manifest = DownloadManifest(self._output_dir)
+        if self._verify:
+            self._verify_downloads(manifest)
+        already = self._list_downloaded()
+        # sizes are estimated per lecture as it is resolved, and a lecture is only started
+        # while the disk stays under the watermark, counting every lecture admitted before
+        planner = DownloadPlanner(self._session, self._staging, watermark=self._disk_watermark,
+                                  feed_policy=self._planned_feed_policy())
+        admission = planner.admission(self._output_dir)
+
+        total_videos = 0
+        estimates = []
+        # already downloaded lectures with files the manifest knows nothing about
+        unrecorded = []
+        downloaded_videos = []
+        failed_videos = []
+
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        def download(filename, sub_video):
+            estimate = planner.estimate([sub_video])[0]
+            estimates.append(estimate)
+            if not admission.admit(estimate):
+                print(
+                    ">> Skipping Lecture '{0}' as it would fill the disk over the "
+                    "{1:.0f}% watermark.".format(filename, self._disk_watermark * 100)
+                )
+                failed_videos.append(filename)
+                return
+            try:
+                ok = sub_video.download(self._output_dir, filename,
+                                        pool_size=self._pool_size, session=self._session,
+                                        segment_options=self._segment_options,
+                                        staging=self._staging,
+                                        window=self._window,
+                                        audio_format=self._audio_format,
+                                        store=self._store,
+                                        feed_policy=self._feed_policy,
+                                        compose=self._compose,
+                                        cancel_event=cancel_event)
+            except DownloadCancelled:
+                # stopped in the middle of the lecture, its partial files are removed
+                print(">> Cancelled Lecture '{0}'.".format(filename))
+                failed_videos.append(filename)
+                return
+            except Exception as e:
+                # one broken lecture does not stop the course
+                logger.debug("Download of {} failed".format(filename), exc_info=True)
+                print(">> Failed to download Lecture '{0}': {1}".format(filename, e))
+                ok = False
+            if ok:
+                downloaded_videos.append(filename)
+            else:
+                failed_videos.append(filename)
+            for path, expected_duration in sub_video.downloaded_files:
+                manifest.record(path, expected_duration, sha256=sub_video.file_digests.get(path))
+
+        try:
+            # downloads start with the first resolved lesson, the next ones resolve meanwhile
+            for number, video in videos:
+                if cancelled():
+                    break
+                for filename, sub_video, is_downloaded in self._get_jobs(number, video, already):
+                    total_videos += 1
+                    # check if the video is already downloaded
+                    print("> Checking if the video '{0}' has already been downloaded...".format(
+                        filename))
+                    if is_downloaded:
+                        print(
+                            ">> Skipping Lecture '{0}' as it has already been downloaded.".format(
+                                filename
+                            )
                         )
-                    )
-                else:
-                    print("> Adding video '{0}' to the download list...".format(filename))
-                    videos_to_be_download.append((filename, sub_video))
-        
+                        names = [n for n in already if filename in n and n not in manifest.entries]
+                        if self._verify and names and sub_video.url is not False:
+                            unrecorded.append((filename, sub_video, names))
+                        continue
+                    if sub_video.url is False:
+                        print(
+                            ">> Skipping Lecture '{0}' as it says it does "
+                            "not contain any video.".format(filename)
+                        )
+                        continue
+                    if cancelled():
+                        break
+                    download(filename, sub_video)
+        finally:
+            # every lesson is resolved by now, so the extra browsers can go
+            self._close_browser_pool()
+
+        if unrecorded and not cancelled():
+            # broken files found among them are downloaded again
+            for filename, sub_video in self._verify_unrecorded(manifest, planner, unrecorded):
+                if cancelled():
+                    break
+                download(filename, sub_video)
+        if cancelled():
+            print(">> Cancelled, skipping the remaining lectures.")
+
+        known = [e for e in estimates if e is not None]
         print("-" * 80)
         print("    Course: {0}".format(self._course.nice_name))
         print(
-            "    Total videos to download: {0} out of {1}".format(
-                len(videos_to_be_download), len(videos)
+            "    Videos downloaded: {0} out of {1}".format(len(downloaded_videos), total_videos)
+        )
+        print(
+            "    Estimated size: {0} ({1} of {2} lectures with a known size)".format(
+                format_size(sum(known)), len(known), len(estimates)
             )
         )
         print("-" * 80)
+        self._staging.cleanup(self._output_dir)
+        if close_driver:
+            self._driver.close()
+        return failed_videos
 
-        downloaded_videos = []
-        for filename, video in videos_to_be_download:
-            if video.url is False:
-                print(
-                    ">> Skipping Lecture '{0}' as it says it does "
-                    "not contain any video.".format(filename)
-                )
+    def plan(self, close_driver=True):
+        # dry run: what would be fetched, without downloading any media
+        videos = self._resolve_videos()
+        try:
+            already = self._list_downloaded(verbose=False)
+            jobs = [job for number, video in videos.resolve(show_progress=True)
+                    for job in self._get_jobs(number, video, already)]
+        finally:
+            self._close_browser_pool()
+        planner = DownloadPlanner(self._session, self._staging, watermark=self._disk_watermark,
+                                  feed_policy=self._planned_feed_policy())
+        inspections = planner.inspect([video for _, video, _ in jobs])
+
+        pending = [
+            (filename, video, inspection["size"])
+            for (filename, video, is_downloaded), inspection in zip(jobs, inspections)
+            if not is_downloaded and video.url is not False
+        ]
+        admitted, _, _ = planner.plan(
+            [(f, v) for f, v, _ in pending], self._output_dir,
+            estimates=[size for _, _, size in pending],
+        )
+        admitted = set(filename for filename, _ in admitted)
+
+        lessons = []
+        for (filename, video, is_downloaded), inspection in zip(jobs, inspections):
+            if is_downloaded:
+                action = "skip (downloaded)"
+            elif video.url is False:
+                action = "skip (no video)"
+            elif filename not in admitted:
+                action = "skip (disk watermark)"
             else:
-                if video.download(self._output_dir, filename):
-                    downloaded_videos.append(filename)
-        self._driver.close()
+                action = "fetch"
+            lessons.append({
+                "filename": filename,
+                "date": video.date,
+                "title": video.title,
+                "strategy": video.strategy,
+                "action": action,
+                "duration": inspection["duration"],
+                "size": inspection["size"],
+                "feeds": inspection["feeds"],
+            })
+        if close_driver:
+            self._driver.close()
+        return {
+            "course": self._course.nice_name,
+            "output_dir": self._output_dir,
+            "lessons": lessons,
+        }
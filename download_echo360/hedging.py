@@ -0,0 +1,132 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+class RequestCancelled(Exception):
+    pass
+
+class HedgedFetcher(object):
+    """
+    Fetches urls with hedging: when a request takes longer than the running
+    percentile of previous requests, a duplicate is sent (the session hands it
+    another connection), the first response wins and the other one is cancelled.
+    """
+
+    def __init__(self, session, concurrency=50, max_hedges=4, percentile=0.95, min_samples=20,
+                 min_delay=0.5, timeout=20, block_size=64 * 1024):
+        super(HedgedFetcher, self).__init__()
+        self._session = session
+        self._percentile = percentile
+        self._min_samples = min_samples
+        self._min_delay = min_delay
+        self._timeout = timeout
+        self._block_size = block_size
+        self._latencies = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self._hedge_slots = threading.BoundedSemaphore(max_hedges)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency + max_hedges)
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def threshold(self):
+        with self._lock:
+            if len(self._latencies) < self._min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self._percentile))
+        return max(self._min_delay, latencies[index])
+
+    def _fetch(self, url, cancelled, opened=None):
+        # opened collects the response, for a winner to drop it while its body is read
+        start = time.time()
+        r = self._session.get(url, timeout=self._timeout, stream=True)
+        if opened is not None:
+            opened.append(r)
+        try:
+            if cancelled.is_set():
+                raise RequestCancelled(url)
+            chunks = []
+            for chunk in r.iter_content(self._block_size):
+                if cancelled.is_set():
+                    raise RequestCancelled(url)
+                chunks.append(chunk)
+        finally:
+            # returns the connection to the pool, or drops it if the body was not read
+            r.close()
+        return r, b"".join(chunks), time.time() - start
+
+    @staticmethod
+    def _drop(response):
+        # response.close() would wait for the read in progress; shutting the socket down
+        # ends that read right away, and the reading thread then closes the response
+        connection = getattr(response.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError as e:
+            _logger.debug("Cannot shut down the losing connection: {}".format(e))
+
+    def _record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def get(self, url):
+        # returns (response, content); the response body is already consumed
+        threshold = self.threshold()
+        if threshold is None:
+            r, content, latency = self._fetch(url, threading.Event())
+            self._record(latency)
+            return r, content
+
+        primary_cancelled = threading.Event()
+        primary_opened = []
+        primary = self._executor.submit(self._fetch, url, primary_cancelled, primary_opened)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._hedge_slots.acquire(blocking=False):
+            r, content, latency = primary.result()
+            self._record(latency)
+            return r, content
+
+        _logger.debug("Hedging request for {} after {:.2f}s".format(url, threshold))
+        self.hedges_sent += 1
+        hedge_cancelled = threading.Event()
+        hedge_opened = []
+        hedge = self._executor.submit(self._fetch, url, hedge_cancelled, hedge_opened)
+        hedge.add_done_callback(lambda _: self._hedge_slots.release())
+        cancel_events = {primary: primary_cancelled, hedge: hedge_cancelled}
+        responses = {primary: primary_opened, hedge: hedge_opened}
+
+        pending = set(cancel_events.keys())
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    r, content, latency = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                # the loser's connection is dropped, even in the middle of reading a chunk
+                for other in pending:
+                    cancel_events[other].set()
+                    for response in list(responses[other]):
+                        self._drop(response)
+                if future is hedge:
+                    self.hedges_won += 1
+                self._record(latency)
+                return r, content
+        raise error
+
+    def close(self):
+        self._executor.shutdown(wait=False)
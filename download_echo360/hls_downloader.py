@@ -2,123 +2,207 @@
 import ffmpy
 import gevent
 from gevent.pool import Pool
-import requests
-import os, sys
-import time
-import tqdm
-
-def urljoin(a, b):
-    # get url relative root path
-    a = a[: a.rfind("/") + 1]
-    # remove slashes at beginning if needed
-    while b[0] == "/":
-        b = b[1:]
-    return a + b
-
-
-# update_progress() : Displays or updates a console progress bar
-## Accepts a float between 0 and 1. Any int will be converted to a float.
-## A value under 0 represents a 'halt'.
-## A value at 1 or bigger represents 100%
-def update_progress(current, total, title=None):
-    if title is None:
-        title = "Progress"
-    barLength = 20  # Modify this to change the length of the progress bar
-    status = " {}/{}".format(current, total)
-    progress = float(current) / float(total)
-    if progress < 0:
-        progress = 0
-        status = "Halt...\r\n"
-    if progress >= 1:
-        progress = 1
-        status += " Done!\r\n"
-    block = "=" * int(round(barLength * progress))
-    if len(block) < barLength:
-        block += ">"
-    text = "\r{0}: [{1}] {2:.2f}% {3}".format(
-        title, block + " " * (barLength - len(block)), progress * 100, status
-    )
-    sys.stdout.write(text)
-    sys.stdout.flush()
+import os
+import threading
+import urllib.parse
 
+from download_echo360.hedging import HedgedFetcher
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.naive_m3u8_parser import NaiveM3U8Parser
+from download_echo360.progress import get_progress_bus, print_line
+from download_echo360.staging import Staging
+from download_echo360.transport import get_transport
+
+# master playlists followed at most, to stop on playlists that refer to each other
+MAX_PLAYLIST_DEPTH = 8
+
+def urljoin(base, uri):
+    # relative to the playlist (without its query), absolute paths and urls as they are
+    return urllib.parse.urljoin(base, uri.strip())
+
+def url_resolver(base):
+    # urljoin for the many uris of one playlist: plain relative names (the usual case)
+    # are appended to the playlist's directory, anything else is fully resolved
+    directory = urllib.parse.urljoin(base, ".")
+
+    def resolve(uri):
+        if "://" in uri or uri.startswith(("/", ".", "?", "#")):
+            return urljoin(base, uri)
+        return directory + uri
+    return resolve
+
+
+class DownloadCancelled(Exception):
+    pass
+
+def run_ffmpeg(ff, cancel_event=None, output=None):
+    # ff.run(), but ffmpeg is terminated as soon as cancel_event is set: its partial
+    # output is removed and DownloadCancelled raised
+    if cancel_event is None:
+        ff.run()
+        return
+    if cancel_event.is_set():
+        raise DownloadCancelled(output)
+    done = threading.Event()
+
+    def terminate_when_cancelled():
+        while not done.wait(0.25):
+            # the process only exists once run() has started it
+            if cancel_event.is_set() and getattr(ff, "process", None) is not None:
+                ff.process.terminate()
+                return
+
+    threading.Thread(target=terminate_when_cancelled, daemon=True).start()
+    try:
+        ff.run()
+    except ffmpy.FFRuntimeError:
+        if not cancel_event.is_set():
+            raise
+    finally:
+        done.set()
+    if cancel_event.is_set():
+        if output is not None and os.path.exists(output):
+            os.remove(output)
+        raise DownloadCancelled(output)
 
 class Downloader:
-    def __init__(self, pool_size, retry=3, selenium_cookies=None):
+    def __init__(self, pool_size, retry=3, selenium_cookies=None, session=None,
+                 hedge=False, max_hedges=4, staging=None, cancel_event=None,
+                 segment_cache=None, transport="requests"):
         self.pool = Pool(pool_size)
-        self.session = self._get_http_session(
-            pool_size, pool_size, retry, selenium_cookies
-        )
+        self.staging = staging if staging is not None else Staging()
+        # requests is blocking, so the actual requests are run on gevent's thread pool
+        # to keep pool_size segments in flight
+        self._threadpool = gevent.get_hub().threadpool
+        self._threadpool.maxsize = max(self._threadpool.maxsize, pool_size)
+        if session is None:
+            session = get_shared_pool().session(selenium_cookies=selenium_cookies)
+        # the connection pool is shared with the rest of the run
+        self.session = session
+        # how the segments are fetched: a TRANSPORTS name or a transport object
+        if isinstance(transport, str):
+            transport = get_transport(session, transport)
+        self._transport = transport
+        self._hedged_fetcher = None
+        if hedge:
+            self._hedged_fetcher = HedgedFetcher(
+                session, concurrency=pool_size, max_hedges=max_hedges
+            )
         self.retry = retry
         self.dir = ""
         self.succed = {}
         self.failed = []
         self.ts_total = 0
+        # playlist duration (sum of #EXTINF) of what was downloaded
+        self.duration = None
+        # seconds to skip at the start of the result, when only a window was fetched
+        self.window_offset = 0.0
         self._result_file_name = None
+        self._progress = None
+        # set from another thread to stop fetching, run() then raises DownloadCancelled
+        self._cancel_event = cancel_event
+        # segments are served from (and kept in) this cache, if any
+        self._segment_cache = segment_cache
 
-    def _get_http_session(
-        self, pool_connections, pool_maxsize, max_retries, selenium_cookies=None
-    ):
-        session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=pool_connections,
-            pool_maxsize=pool_maxsize,
-            max_retries=max_retries,
-        )
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        if selenium_cookies is not None:
-            # load cookies
-            for cookie in selenium_cookies:
-                session.cookies.set(cookie["name"], cookie["value"])
-        return session
-
-    def run(self, m3u8_url, dir="", convert_to_mp4=True):
+    @staticmethod
+    def resolve_window(window, total_duration):
+        # negative times count from the end, None is the start/end of the playlist
+        start, end = window
+        if start is None:
+            start = 0.0
+        elif start < 0:
+            start = max(0.0, total_duration + start)
+        if end is None:
+            end = total_duration
+        elif end < 0:
+            end = total_duration + end
+        return start, min(end, total_duration)
+
+    def _resolve_playlist(self, m3u8_url):
+        # follows master (or wrapping) playlists down to the media playlist, returns its
+        # url and lines, or (url, None) if a playlist cannot be retrieved
+        url = m3u8_url
+        for _ in range(MAX_PLAYLIST_DEPTH):
+            r = self.session.get(url, timeout=20)
+            if not r.ok:
+                print_line("Failed status code: {}".format(r.status_code))
+                return url, None
+            lines = r.content.decode().splitlines()
+            variant = NaiveM3U8Parser.get_variant(lines)
+            if variant is None:
+                return url, lines
+            url = urljoin(url, variant)
+        print_line("Playlist nested more than {} levels: {}".format(
+            MAX_PLAYLIST_DEPTH, m3u8_url))
+        return url, None
+
+    def _plan_segments(self, playlist_url, lines, window=None):
+        # [(url, index)] to download in playlist order, an #EXT-X-MAP init segment before
+        # every segment whose map differs from the previous one's; only the minimal run of segments covering
+        # the window (using the cumulative #EXTINF) if one is given
+        segments = NaiveM3U8Parser.iter_segments(lines)
+        start, end = 0.0, None
+        if window is not None:
+            # the total duration is needed first when counting from the end
+            segments = list(segments)
+            start, end = Downloader.resolve_window(
+                window, sum(duration for _, duration, _ in segments))
+        resolve = url_resolver(playlist_url)
+        plan = []
+        current_map = None
+        first_segment_start = None
+        position = 0.0
+        for uri, duration, map_uri in segments:
+            if end is None or (position + duration > start and position < end):
+                if first_segment_start is None:
+                    first_segment_start = position
+                if map_uri is not None and map_uri != current_map:
+                    plan.append((resolve(map_uri), len(plan)))
+                current_map = map_uri
+                plan.append((resolve(uri), len(plan)))
+            position += duration
+        if window is None:
+            self.duration = position
+        else:
+            # where the window starts inside the downloaded part, for trimming
+            self.window_offset = start - (first_segment_start or 0.0)
+            self.duration = max(0.0, end - start)
+        return plan
+
+    def run(self, m3u8_url, dir="", convert_to_mp4=True, window=None, title=None,
+            cache_owner=None):
         self.dir = dir
         if self.dir and not os.path.isdir(self.dir):
             os.makedirs(self.dir)
-        r = self.session.get(m3u8_url, timeout=10)
-        if r.ok:
-            body = r.content
-            if body:
-                # use set to prevent duplicates
-                ts_list = {
-                    urljoin(m3u8_url, n.strip())
-                    for n in body.decode().split("\n")
-                    if n and not n.startswith("#")
-                }
-                ts_list = list(ts_list)
-                # this is very hacky as well.. But idk how to overcome some m3u8 has nested
-                # m3u8 and some don't.
-                if len(ts_list) == 1 and ts_list[0].split(".")[-1] not in (
-                    "ts",
-                    "mp4",
-                    "m4s",
-                ):
-                    file_name = ts_list[0].split("/")[-1].split("?")[0]
-                    chunk_list_url = "{0}/{1}".format(
-                        m3u8_url[: m3u8_url.rfind("/")], file_name
-                    )
-                    r = self.session.get(chunk_list_url, timeout=20)
-                    if r.ok:
-                        body = r.content
-                        ts_list = [
-                            urljoin(m3u8_url, n.strip())
-                            for n in body.decode().split("\n")
-                            if n and not n.startswith("#")
-                        ]
-                    # re-retrieve to get all ts file list
-
-                ts_list = zip(ts_list, [n for n in range(len(ts_list))])
-                ts_list = list(ts_list)
-
-                if ts_list:
-                    self.ts_total = len(ts_list)
-                    self.ts_current = 0
-                    g1 = gevent.spawn(self._join_file)
-                    self._download(ts_list)
-                    g1.join()
-        else:
-            print("Failed status code: {}".format(r.status_code))
+        playlist_url, lines = self._resolve_playlist(m3u8_url)
+        if lines is None:
+            raise IOError("Cannot retrieve the playlist {}".format(m3u8_url))
+        ts_list = self._plan_segments(playlist_url, lines, window)
+        # only the plan is needed from here on, drop the (possibly huge) playlist
+        del lines
+        if not ts_list:
+            if window is not None:
+                print_line("ERROR: The requested window is empty")
+            else:
+                print_line("ERROR: The playlist lists no segments")
+            return False
+        if self._segment_cache is not None and cache_owner is not None:
+            # kept until the caller releases them, once the lecture is done
+            self._segment_cache.pin(cache_owner, [url for url, _ in ts_list])
+        self.ts_total = len(ts_list)
+        self.ts_current = 0
+        if title is None:
+            title = m3u8_url.split("/")[-1].split("?")[0]
+        self._progress = get_progress_bus().job(title, total=self.ts_total)
+        g1 = gevent.spawn(self._join_file)
+        self._download(ts_list)
+        g1.join()
+        self._progress.finish(ok=not self._cancelled())
+        if self._hedged_fetcher is not None:
+            self._hedged_fetcher.close()
+        if self._cancelled():
+            self._remove_partial_files()
+            raise DownloadCancelled(m3u8_url)
         infile_name = os.path.join(
             self.dir,
             self._result_file_name.split(".")[0]
@@ -128,27 +212,49 @@ class Downloader:
         self._result_file_name = infile_name
         if convert_to_mp4:
             outfile_name = infile_name.split(".")[0] + ".mp4"
-            sys.stdout.write("  > Converting to mp4... ")
-            sys.stdout.flush()
+            print_line("  > Converting to mp4... ", end="")
             try:
                 ff = ffmpy.FFmpeg(
                     global_options="-loglevel panic",
                     inputs={infile_name: None},
                     outputs={outfile_name: ["-c", "copy"]},
                 )
-                ff.run()
+                run_ffmpeg(ff, self._cancel_event, outfile_name)
                 # delete source file after done
                 os.remove(infile_name)
                 self._result_file_name = outfile_name
-                print("Done!")
+                print_line("Done!")
             except ffmpy.FFExecutableNotFoundError:
-                print('Skipping! Because "ffmpeg" not installed.')
+                print_line('Skipping! Because "ffmpeg" not installed.')
                 self._result_file_name = infile_name
             except ffmpy.FFRuntimeError:
-                print("Error! ffmpeg exited with non-zero status code.")
+                print_line("Error! ffmpeg exited with non-zero status code.")
                 self._result_file_name = infile_name
+            except DownloadCancelled:
+                print_line("Cancelled")
+                os.remove(infile_name)
+                raise DownloadCancelled(m3u8_url)
+        return True
+
+    def _cancelled(self):
+        return self._cancel_event is not None and self._cancel_event.is_set()
+
+    def _remove_partial_files(self):
+        names = list(self.succed.values())
+        if self._result_file_name is not None:
+            names.append(self._joined_file_name(self._result_file_name))
+        for name in names:
+            path = os.path.join(self.dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _joined_file_name(file_name):
+        return file_name.split(".")[0] + "_all." + file_name.split(".")[-1]
 
     def _download(self, ts_list):
+        if self._cancelled():
+            return
         if len(ts_list) == 1:
             self._worker_single(ts_list[0])
         else:
@@ -158,68 +264,92 @@ class Downloader:
             self.failed = []
             self._download(ts_list)
 
+    @staticmethod
+    def _segment_file_name(url, index):
+        # prefixed with the index, a playlist may list the same name twice
+        return "{0}_{1}".format(index, url.split("/")[-1].split("?")[0])
+
+    def _from_cache(self, url, index):
+        if self._segment_cache is None:
+            return False
+        file_name = self._segment_file_name(url, index)
+        if not self._segment_cache.get(url, os.path.join(self.dir, file_name)):
+            return False
+        self.succed[index] = file_name
+        self.ts_current += 1
+        self._progress.segment_done()
+        return True
+
+    def _to_cache(self, url, file_name):
+        if self._segment_cache is not None:
+            self._segment_cache.put(url, os.path.join(self.dir, file_name))
+
     def _worker_single(self, ts_tuple):
         url = ts_tuple[0]
         index = ts_tuple[1]
         retry = self.retry
-        update_progress(
-            self.ts_current, self.ts_total, title="  > {}".format("Progress")
-        )
-        while retry:
+        if self._from_cache(url, index):
+            return
+        while retry and not self._cancelled():
             try:
                 r = self.session.get(url, stream=True, timeout=20)
-                total_size = int(r.headers.get("content-length", 0))
-                block_size = 1024  # 1 kilobyte
-                file_name = url.split("/")[-1].split("?")[0]
+                block_size = 64 * 1024
+                file_name = self._segment_file_name(url, index)
                 result_full_path = os.path.join(self.dir, file_name)
-                with tqdm.tqdm(total=total_size, unit="iB", unit_scale=True) as pbar:
-                    with open(result_full_path, "wb") as f:
-                        for data in r.iter_content(block_size):
-                            pbar.update(len(data))
-                            f.write(data)
+                with open(result_full_path, "wb") as f:
+                    for data in r.iter_content(block_size):
+                        self._progress.add_bytes(len(data))
+                        f.write(data)
+                self._to_cache(url, file_name)
                 self.succed[index] = file_name
                 self.ts_current += 1
+                self._progress.segment_done()
                 return
             except EnvironmentError as e:
-                print("\r\nError in writing file: {}".format(e))
+                print_line("Error in writing file: {}".format(e))
             except:
                 retry -= 1
-        sys.stdout.write("[FAIL]")
+        if self._cancelled():
+            return
+        print_line("[FAIL] {}".format(self._segment_file_name(url, index)))
         self.failed.append((url, index))
 
+    def _get_segment(self, url):
+        if self._hedged_fetcher is not None:
+            return self._hedged_fetcher.get(url)
+        return self._transport.get(url, timeout=20)
+
     def _worker(self, ts_tuple):
         url = ts_tuple[0]
         index = ts_tuple[1]
         retry = self.retry
-        update_progress(
-            self.ts_current, self.ts_total, title="  > {}".format("Progress")
-        )
-        while retry:
+        if self._cancelled() or self._from_cache(url, index):
+            return
+        while retry and not self._cancelled():
             try:
-                r = self.session.get(url, timeout=20)
+                r, content = self._threadpool.apply(self._get_segment, (url,))
                 if r.ok:
-                    file_name = url.split("/")[-1].split("?")[0]
+                    file_name = self._segment_file_name(url, index)
                     with open(os.path.join(self.dir, file_name), "wb") as f:
-                        f.write(r.content)
+                        f.write(content)
+                    self._to_cache(url, file_name)
                     self.succed[index] = file_name
                     self.ts_current += 1
-                    update_progress(
-                        self.ts_current,
-                        self.ts_total,
-                        title="  > {}".format("Progress"),
-                    )
+                    self._progress.segment_done(len(content))
                     return
             except EnvironmentError as e:
-                print("\r\nError in writing file: {}".format(e))
+                print_line("Error in writing file: {}".format(e))
             except:
                 retry -= 1
-        sys.stdout.write("[FAIL]")
+        if self._cancelled():
+            return
+        print_line("[FAIL] {}".format(self._segment_file_name(url, index)))
         self.failed.append((url, index))
 
     def _join_file(self):
         index = 0
         outfile = ""
-        while index < self.ts_total:
+        while index < self.ts_total and not self._cancelled():
             file_name = self.succed.get(index, "")
             if file_name:
                 if self._result_file_name is None:
@@ -227,21 +357,21 @@ class Downloader:
                 infile = open(os.path.join(self.dir, file_name), "rb")
                 if not outfile:
                     outfile = open(
-                        os.path.join(
-                            self.dir,
-                            file_name.split(".")[0]
-                            + "_all."
-                            + file_name.split(".")[-1],
-                        ),
-                        "wb",
+                        os.path.join(self.dir, self._joined_file_name(file_name)), "wb"
                     )
+                    # estimate the total size from the first segment, trimmed when done
+                    segment_size = os.fstat(infile.fileno()).st_size
+                    self.staging.preallocate(outfile, segment_size * self.ts_total)
                 outfile.write(infile.read())
                 infile.close()
                 os.remove(os.path.join(self.dir, file_name))
                 index += 1
             else:
-                time.sleep(1)
+                # yield to the segment workers
+                gevent.sleep(0.1)
         if outfile:
+            outfile.truncate(outfile.tell())
+            self.staging.sync(outfile)
             outfile.close()
 
     @property
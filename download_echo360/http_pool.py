@@ -0,0 +1,133 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
+import threading
+
+import requests
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+class CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    # keeps the connection counters of urllib3 pools that get evicted or closed
+
+    def __init__(self, *args, **kwargs):
+        self.retired = {}
+        self._retired_lock = threading.Lock()
+        super(CountingHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._retire
+
+    def _retire(self, pool):
+        with self._retired_lock:
+            counts = self.retired.setdefault(pool.host, [0, 0])
+            counts[0] += pool.num_connections
+            counts[1] += pool.num_requests
+        pool.close()
+
+    def connection_counts(self):
+        # {host: [new connections, requests]}
+        with self._retired_lock:
+            counts = {host: list(c) for host, c in self.retired.items()}
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_counts = counts.setdefault(pool.host, [0, 0])
+            host_counts[0] += pool.num_connections
+            host_counts[1] += pool.num_requests
+        return counts
+
+class HttpPool(object):
+    """
+    Process-wide, cookie-aware connection pools: one `requests.Session` per Echo360
+    host, kept alive for the whole run and shared by every course, lecture and
+    segment downloader of that host.
+    """
+
+    def __init__(self, pool_connections=16, pool_maxsize=50, max_retries=3):
+        super(HttpPool, self).__init__()
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._max_retries = max_retries
+        # e.g. the recording or replaying adapters of download_echo360.replay
+        self._adapter_factory = CountingHTTPAdapter
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pool_connections=None, pool_maxsize=None, max_retries=None,
+                  adapter_factory=None):
+        # only affects sessions created afterwards
+        if pool_connections is not None:
+            self._pool_connections = pool_connections
+        if pool_maxsize is not None:
+            self._pool_maxsize = pool_maxsize
+        if max_retries is not None:
+            self._max_retries = max_retries
+        if adapter_factory is not None:
+            self._adapter_factory = adapter_factory
+
+    def _new_session(self):
+        session = requests.Session()
+        # pool_connections is the number of hosts (echo360, content, s3, ...) kept
+        # alive at once, pool_maxsize the number of connections per host
+        adapter = self._adapter_factory(
+            pool_connections=self._pool_connections,
+            pool_maxsize=self._pool_maxsize,
+            max_retries=self._max_retries,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session(self, hostname=None, selenium_cookies=None):
+        with self._lock:
+            session = self._sessions.get(hostname)
+            if session is None:
+                session = self._new_session()
+                self._sessions[hostname] = session
+        if selenium_cookies is not None:
+            for cookie in selenium_cookies:
+                session.cookies.set(cookie["name"], cookie["value"])
+        return session
+
+    def stats(self):
+        # {host: (new connections, reused connections)} over every session
+        totals = {}
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            adapter = session.get_adapter("https://")
+            for host, (new, requests_made) in adapter.connection_counts().items():
+                host_totals = totals.setdefault(host, [0, 0])
+                host_totals[0] += new
+                host_totals[1] += max(0, requests_made - new)
+        return {host: tuple(t) for host, t in totals.items()}
+
+    def print_summary(self):
+        stats = self.stats()
+        if not stats:
+            return
+        print("    Connections (new / reused):")
+        for host, (new, reused) in sorted(stats.items()):
+            print("      {0}: {1} / {2}".format(host, new, reused))
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_pool():
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = HttpPool()
+        return _shared_pool
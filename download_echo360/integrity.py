@@ -0,0 +1,134 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import hashlib
+import json
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpy
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+def hash_file(path, buffer_size=HASH_BUFFER_SIZE):
+    # large reads into a reused buffer; hashlib releases the GIL so files hash in parallel
+    digest = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def probe_duration(path, input_options=None):
+    try:
+        ff = ffmpy.FFprobe(
+            global_options="-v error",
+            inputs={path: (input_options or []) + [
+                "-show_entries", "format=duration", "-of", "default=nw=1:nk=1"
+            ]},
+        )
+        stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return float(stdout.decode().strip())
+    except (ffmpy.FFExecutableNotFoundError, ffmpy.FFRuntimeError, ValueError) as e:
+        _logger.debug("Cannot probe duration of {}: {}".format(path, e))
+        return None
+
+def duration_problem(duration, expected_duration, duration_tolerance=2.0):
+    # allow a little slack (or 1%) for container vs playlist timing
+    tolerance = max(duration_tolerance, expected_duration * 0.01)
+    if abs(duration - expected_duration) > tolerance:
+        return "duration {0:.1f}s != {1:.1f}s".format(duration, expected_duration)
+    return None
+
+class DownloadManifest(object):
+    """
+    Size, checksum and expected duration of every lecture downloaded into a course
+    folder, kept next to the lectures so that they can be verified later.
+    """
+
+    FILENAME = ".download_echo360.json"
+
+    def __init__(self, output_dir):
+        super(DownloadManifest, self).__init__()
+        self._output_dir = output_dir
+        self._path = os.path.join(output_dir, DownloadManifest.FILENAME)
+        try:
+            with open(self._path) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except ValueError as e:
+            _logger.debug("Ignoring corrupt manifest {}: {}".format(self._path, e))
+            self._entries = {}
+
+    @property
+    def entries(self):
+        return self._entries
+
+    def save(self):
+        os.makedirs(self._output_dir, exist_ok=True)
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._path)
+
+    def record(self, path, expected_duration=None, sha256=None):
+        # sha256 if already known (e.g. from the content store), hashed otherwise
+        self._entries[os.path.basename(path)] = {
+            "size": os.path.getsize(path),
+            "sha256": sha256 if sha256 is not None else hash_file(path),
+            "duration": expected_duration,
+        }
+        self.save()
+
+    def remove(self, name):
+        self._entries.pop(name, None)
+        self.save()
+
+    def check(self, name, duration_tolerance=2.0):
+        # returns None if fine, the problem otherwise
+        entry = self._entries[name]
+        path = os.path.join(self._output_dir, name)
+        if not os.path.isfile(path):
+            return "missing"
+        size = os.path.getsize(path)
+        if size != entry["size"]:
+            return "size {0} != {1}".format(size, entry["size"])
+        if hash_file(path) != entry["sha256"]:
+            return "checksum mismatch"
+        if entry.get("duration"):
+            duration = probe_duration(path)
+            if duration is not None:
+                return duration_problem(duration, entry["duration"], duration_tolerance)
+        return None
+
+    def check_unrecorded(self, name, expected_duration=None, duration_tolerance=2.0):
+        # files downloaded before the manifest existed have no size or checksum to check,
+        # only their duration against the playlist. Returns (problem, None) if broken,
+        # (None, why it is unverified) otherwise
+        path = os.path.join(self._output_dir, name)
+        duration = probe_duration(path)
+        if duration is None:
+            return None, "cannot read its duration"
+        if not expected_duration:
+            return None, "no checksum recorded, no expected duration"
+        problem = duration_problem(duration, expected_duration, duration_tolerance)
+        if problem is not None:
+            return problem, None
+        return None, "no checksum recorded, duration OK"
+
+    def verify(self, workers=4):
+        # {name: problem} of every recorded file that is broken
+        names = sorted(self._entries.keys())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            problems = list(executor.map(self.check, names))
+        return {name: problem for name, problem in zip(names, problems) if problem is not None}
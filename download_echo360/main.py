@@ -1,9 +1,12 @@
 # Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
 import logging
-import os
 import re
+from collections import OrderedDict
 from download_echo360.course import Echo360Course
-from download_echo360.downloader import Echo360Downloader
+from download_echo360.download_binary.chromedriver import ChromedriverDownloader
+from download_echo360.downloader import Echo360Downloader, get_chrome_binary_path, write_plans
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.transport import close_transports, print_transport_summary
 
 
 logging.basicConfig(
@@ -28,33 +31,37 @@ def run_setup_credentials(driver, url):
     except KeyboardInterrupt:
         pass 
 
-def main(course_url, output_dir="download", course_hostname="", webdriver_to_use="chrome"):
-
-    print("> Echo360 platform detected")
-    print("> Please wait for Echo360 to load on SSO")
-    print("-" * 80)
-
+def setup_webdriver_binary(webdriver_to_use="chrome"):
     if webdriver_to_use == "chrome":
         binary_type = "chromedriver"
-        from download_echo360.download_binary.chromedriver import (
-            ChromedriverDownloader as binary_downloader
-        )
-    
-    binary_downloader = binary_downloader()
-    _logger.info(
-        f"Downloading {binary_downloader.get_download_link()[1]} binary to {binary_downloader.get_bin()}"
-    )
+        # matched to the installed browser, so it has to be found first
+        binary_downloader = ChromedriverDownloader(chrome_binary=get_chrome_binary_path())
 
-    # check if the binary exists
-    if not os.path.isfile(binary_downloader.get_bin()):
+    # check if the binary is already in the cache (and intact)
+    if not binary_downloader.is_installed():
         start_download_binary(binary_downloader, binary_type)
+    _logger.info(f"Using {binary_type} binary {binary_downloader.get_bin()}")
+    return binary_downloader.get_bin()
 
-    course_uuid = re.search(
+def get_course_uuid(course_url):
+    return re.search(
             "[^/]([0-9a-zA-Z]+[-])+[0-9a-zA-Z]+", course_url
         ).group()
+
+def main(course_url, output_dir="download", course_hostname="", webdriver_to_use="chrome",
+         downloader_options=None, plan_options=None):
+
+    print("> Echo360 platform detected")
+    print("> Please wait for Echo360 to load on SSO")
+    print("-" * 80)
+
+    setup_webdriver_binary(webdriver_to_use)
+
+    course_uuid = get_course_uuid(course_url)
     
     course = Echo360Course(uuid=course_uuid, hostname=course_hostname)
-    downloader = Echo360Downloader(course=course, output_dir=output_dir, webdriver_to_use=webdriver_to_use)
+    downloader = Echo360Downloader(course=course, output_dir=output_dir, webdriver_to_use=webdriver_to_use,
+                                   **(downloader_options or {}))
 
     _logger.info(
         '> Download will use {} webdriver'.format(webdriver_to_use)
@@ -63,5 +70,92 @@ def main(course_url, output_dir="download", course_hostname="", webdriver_to_use
     # wait for user to login
     run_setup_credentials(driver=downloader._driver, url=course_hostname)
     
+    if plan_options is not None:
+        # dry run, only list what would be downloaded
+        write_plans([downloader.plan()], **plan_options)
+        return
+
     # download all videos
-    downloader.download_all()
\ No newline at end of file
+    try:
+        downloader.download_all()
+        downloader.collect_store_garbage()
+    finally:
+        print_connection_summary()
+
+def print_connection_summary():
+    print("-" * 80)
+    http_pool = get_shared_pool()
+    http_pool.print_summary()
+    print_transport_summary()
+    http_pool.close()
+    close_transports()
+
+def print_batch_summary(results):
+    print("=" * 80)
+    print("    Batch summary")
+    print("-" * 80)
+    for course_url, status, detail in results:
+        print("    [{0}] {1}: {2}".format(status, course_url, detail))
+    print_connection_summary()
+    print("=" * 80)
+
+def run_course(downloader, course_url, course_hostname, plan_options=None, plans=None,
+               cancel_event=None):
+    # returns (status, detail) with status OK, PARTIAL, FAIL or CANCELLED
+    try:
+        course = Echo360Course(uuid=get_course_uuid(course_url), hostname=course_hostname)
+        downloader.set_course(course)
+        if plan_options is not None:
+            plans.append(downloader.plan(close_driver=False))
+            failed = []
+        else:
+            failed = downloader.download_all(close_driver=False, cancel_event=cancel_event)
+    except Exception as e:
+        _logger.debug("Course {} failed: {}".format(course_url, e))
+        print(">> Failed to download course {0}: {1}".format(course_url, e))
+        return "FAIL", str(e)
+    if cancel_event is not None and cancel_event.is_set():
+        return "CANCELLED", "cancelled, {0} lecture(s) failed".format(len(failed))
+    if failed:
+        return "PARTIAL", "{0} lecture(s) failed: {1}".format(len(failed), ", ".join(failed))
+    return "OK", "all lectures downloaded"
+
+def main_batch(courses, output_dir="download", webdriver_to_use="chrome", downloader_options=None,
+               plan_options=None):
+    # group courses by host so that each host gets a single browser (and login)
+    courses_by_host = OrderedDict()
+    for course_url, course_hostname in courses:
+        courses_by_host.setdefault(course_hostname, []).append(course_url)
+
+    print("> Echo360 batch mode: {0} course(s) on {1} host(s)".format(
+        len(courses), len(courses_by_host)))
+    print("-" * 80)
+
+    setup_webdriver_binary(webdriver_to_use)
+
+    results = []
+    plans = []
+    downloader = None
+    for course_hostname, course_urls in courses_by_host.items():
+        print("> Please wait for Echo360 to load on SSO for {0}".format(course_hostname))
+        downloader = Echo360Downloader(course=None, output_dir=output_dir, webdriver_to_use=webdriver_to_use,
+                                       **(downloader_options or {}))
+        try:
+            run_setup_credentials(driver=downloader._driver, url=course_hostname)
+            for i, course_url in enumerate(course_urls):
+                print("=" * 80)
+                print("> Course {0}/{1} on {2}: {3}".format(
+                    i + 1, len(course_urls), course_hostname, course_url))
+                status, detail = run_course(downloader, course_url, course_hostname,
+                                            plan_options=plan_options, plans=plans)
+                results.append((course_url, status, detail))
+        finally:
+            downloader.close()
+
+    if plan_options is not None:
+        write_plans(plans, **plan_options)
+    elif downloader is not None:
+        # every host shares the store
+        downloader.collect_store_garbage()
+    print_batch_summary(results)
+    return 0 if all(status == "OK" for _, status, _ in results) else 1
\ No newline at end of file
@@ -67,6 +67,81 @@ class NaiveM3U8Parser:
                     break
         return video_uri, audio_uri
 
+    def get_audio(self):
+        # uri for audio-only downloads: the audio rendition of the video picked by
+        # get_video_and_audio, else any audio rendition, else the lowest-bandwidth
+        # variant (whose audio has to be extracted)
+        if self.videos:
+            _, audio_uri = self.get_video_and_audio()
+            if audio_uri is not None:
+                return audio_uri
+        if self.audios:
+            return NaiveM3U8Parser._remove_quotes(self.audios[-1]["URI"])
+        if self.videos:
+            return min(self.videos, key=lambda v: v.get("bandwidth", float("inf")))["URI"]
+        return None
+
+    def get_video_resolution(self):
+        return self.videos[-1].get("resolution")
+
+    def get_video_bandwidth(self):
+        # bandwidth (bits/s) of the video picked by get_video_and_audio, if advertised
+        return self.videos[-1].get("bandwidth")
+
+    @staticmethod
+    def get_total_duration(line_list):
+        # sum of the #EXTINF durations (seconds) of a media playlist
+        duration = 0.0
+        for line in line_list:
+            if line.startswith("#EXTINF:"):
+                duration += float(line[len("#EXTINF:"):].split(",")[0])
+        return duration
+
+    @staticmethod
+    def iter_segments(line_list):
+        # (uri, duration, uri of its #EXT-X-MAP init segment or None) of every segment of a
+        # media playlist, in playlist order and in a single pass
+        duration = 0.0
+        map_uri = None
+        for line in line_list:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif line.startswith("#EXT-X-MAP:"):
+                match = re.search(r'URI="([^"]*)"', line)
+                map_uri = match.group(1) if match else None
+            elif line and not line.startswith("#"):
+                yield line, duration, map_uri
+                duration = 0.0
+
+    @staticmethod
+    def get_variant(line_list):
+        # uri of the highest-bandwidth variant (the last of equals) if this is a master
+        # playlist, None if it is a media playlist
+        variant = None
+        variant_bandwidth = -1
+        bandwidth = None
+        nested = None
+        has_segments = False
+        for line in line_list:
+            line = line.strip()
+            if line.startswith("#EXT-X-STREAM-INF:"):
+                match = re.search(r"[:,]BANDWIDTH=(\d+)", line)
+                bandwidth = int(match.group(1)) if match else 0
+            elif line.startswith("#EXTINF:"):
+                has_segments = True
+            elif line and not line.startswith("#"):
+                if bandwidth is not None:
+                    if bandwidth >= variant_bandwidth:
+                        variant, variant_bandwidth = line, bandwidth
+                    bandwidth = None
+                elif line.split("?")[0].endswith(".m3u8"):
+                    # a playlist only wrapping another one, without #EXT-X-STREAM-INF
+                    nested = line
+        if variant is None and not has_segments:
+            return nested
+        return variant
+
     def parse(self):
         lines = self.line_list
         for i in range(len(lines)):
@@ -92,6 +167,13 @@ class NaiveM3U8Parser:
         else:
             # Look at next line to obtain URI
             properties["URI"] = lines[idx + 1].strip()
+        if "RESOLUTION" in tokens.keys():
+            properties["resolution"] = tokens["RESOLUTION"]
+        if "BANDWIDTH" in tokens.keys():
+            try:
+                properties["bandwidth"] = int(tokens["BANDWIDTH"])
+            except ValueError:
+                pass
         if properties["type"] == "video":
             # is a video
             try:
@@ -0,0 +1,76 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import json
+import logging
+import time
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# chrome has to be started with this capability for driver.get_log("performance")
+PERFORMANCE_LOGGING_PREFS = {"performance": "ALL"}
+
+NETWORK_EVENTS = ("Network.requestWillBeSent", "Network.responseReceived")
+
+class StreamRequestsSeen(object):
+    """
+    Wait condition for `WebDriverWait` that reads the DevTools performance log and
+    collects the urls of every request whose path ends with one of the suffixes.
+    """
+
+    def __init__(self, suffixes):
+        self.suffixes = tuple(suffixes)
+        self.urls = {suffix: set() for suffix in self.suffixes}
+        self.last_seen = None
+
+    def _collect(self, driver):
+        for entry in driver.get_log("performance"):
+            try:
+                message = json.loads(entry["message"])["message"]
+            except (KeyError, ValueError):
+                continue
+            if message.get("method") not in NETWORK_EVENTS:
+                continue
+            params = message.get("params", {})
+            url = params.get("request", params.get("response", {})).get("url", "")
+            path = urlparse(url).path
+            for suffix in self.suffixes:
+                if path.endswith(".{}".format(suffix)) and url not in self.urls[suffix]:
+                    self.urls[suffix].add(url)
+                    self.last_seen = time.time()
+
+    def __call__(self, driver):
+        self._collect(driver)
+        return self.last_seen is not None
+
+    def settled(self, quiet_period):
+        # multiple feeds are requested close to each other, wait until no new one shows up
+        def condition(driver):
+            self._collect(driver)
+            return time.time() - self.last_seen >= quiet_period
+        return condition
+
+def capture_stream_urls(driver, url, suffixes, timeout=15, quiet_period=1.0):
+    # a page that fails to load raises TimeoutException, so the caller can load it again;
+    # a page that loads but requests no stream within timeout gives empty sets
+    # drop whatever was logged by previous navigations
+    driver.get_log("performance")
+    driver.get(url)
+    seen = StreamRequestsSeen(suffixes)
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.25).until(seen)
+    except TimeoutException:
+        # e.g. a lesson without video, loading it again would not help
+        _logger.debug("No stream requested by {}".format(url))
+        return seen.urls
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.25).until(seen.settled(quiet_period))
+    except TimeoutException:
+        # streams keep showing up, go with what was seen so far
+        _logger.debug("Timed out waiting for stream requests of {}".format(url))
+    return seen.urls
@@ -0,0 +1,15 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import os
+import sys
+
+def get_user_cache_dir(*parts):
+    # per-user cache that survives runs and does not depend on the working directory
+    if sys.platform.startswith("win"):
+        root = os.environ.get("LOCALAPPDATA", os.path.expanduser("~\\AppData\\Local"))
+    elif sys.platform.startswith("darwin"):
+        root = os.path.expanduser("~/Library/Caches")
+    else:
+        root = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    path = os.path.join(root, "download_echo360", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
\ No newline at end of file
@@ -0,0 +1,206 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from download_echo360.hls_downloader import urljoin
+from download_echo360.naive_m3u8_parser import NaiveM3U8Parser
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# which feeds (camera, slides, ...) of a lecture are fetched
+FEED_POLICIES = ("primary", "all", "best")
+
+def existing_parent(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+def inspect_feed(session, url, timeout=10):
+    # what would be fetched for a feed, without downloading any media
+    feed = {"url": url, "kind": "mp4", "rendition": None, "bandwidth": None,
+            "duration": None, "size": None}
+    if not urlparse(url).path.endswith(".m3u8"):
+        r = session.head(url, allow_redirects=True, timeout=timeout)
+        content_length = r.headers.get("content-length")
+        if r.ok and content_length:
+            feed["size"] = int(content_length)
+        return feed
+
+    feed["kind"] = "hls"
+    r = session.get(url, timeout=timeout)
+    if not r.ok:
+        return feed
+    m3u8_parser = NaiveM3U8Parser(r.content.decode().split("\n"))
+    m3u8_parser.parse()
+    m3u8_video, _ = m3u8_parser.get_video_and_audio()
+    feed["rendition"] = m3u8_parser.get_video_resolution()
+    feed["bandwidth"] = m3u8_parser.get_video_bandwidth()
+    r = session.get(urljoin(url, m3u8_video), timeout=timeout)
+    if not r.ok:
+        return feed
+    feed["duration"] = NaiveM3U8Parser.get_total_duration(r.content.decode().split("\n"))
+    if feed["bandwidth"] is not None:
+        # BANDWIDTH of a variant covers all of its renditions (audio included)
+        feed["size"] = int(feed["bandwidth"] / 8.0 * feed["duration"])
+    return feed
+
+def estimate_feed_size(session, url, timeout=10):
+    return inspect_feed(session, url, timeout)["size"]
+
+def _inspect_feeds(session, urls):
+    feeds = []
+    for url in urls:
+        try:
+            feeds.append(inspect_feed(session, url))
+        except Exception as e:
+            _logger.debug("Cannot inspect {}: {}".format(url, e))
+            feeds.append({"url": url, "kind": None, "rendition": None, "bandwidth": None,
+                          "duration": None, "size": None})
+    return feeds
+
+def _feed_rank(feed):
+    # most pixels first, then the highest bitrate (or the largest file)
+    pixels = 0
+    if feed["rendition"]:
+        try:
+            width, height = feed["rendition"].lower().split("x")
+            pixels = int(width) * int(height)
+        except ValueError:
+            pass
+    return pixels, feed["bandwidth"] or 0, feed["size"] or 0
+
+def select_feeds(feeds, feed_policy="all"):
+    # feeds are inspected feeds in resolution order, the first one is the primary feed
+    if feed_policy == "primary":
+        return feeds[:1]
+    if feed_policy == "best" and feeds:
+        # max keeps the first of equals, i.e. the primary feed
+        return [max(feeds, key=_feed_rank)]
+    return feeds
+
+def select_feed_urls(session, urls, feed_policy="all"):
+    if feed_policy == "all" or len(urls) <= 1:
+        return urls
+    if feed_policy == "primary":
+        return urls[:1]
+    return [feed["url"] for feed in select_feeds(_inspect_feeds(session, urls), feed_policy)]
+
+def inspect_lecture(session, video, feed_policy="all"):
+    urls = video.url
+    if urls is False:
+        return {"feeds": [], "size": None, "duration": None}
+    if not isinstance(urls, list):
+        urls = [urls]
+    if feed_policy == "primary":
+        urls = urls[:1]
+    # only the feeds that would be fetched
+    feeds = select_feeds(_inspect_feeds(session, urls), feed_policy)
+    sizes = [feed["size"] for feed in feeds]
+    durations = [feed["duration"] for feed in feeds if feed["duration"] is not None]
+    return {
+        "feeds": feeds,
+        # the size is only known if it is known for every feed
+        "size": None if None in sizes else sum(sizes),
+        "duration": max(durations) if durations else None,
+    }
+
+def estimate_lecture_size(session, video, feed_policy="all"):
+    return inspect_lecture(session, video, feed_policy)["size"]
+
+class DownloadPlanner(object):
+    """
+    Estimates the size of every lecture before downloading anything, and admits
+    lectures only while the output (and scratch) volumes stay under the watermark.
+    """
+
+    def __init__(self, session, staging, watermark=0.95, workers=16, feed_policy="all"):
+        super(DownloadPlanner, self).__init__()
+        self._session = session
+        self._feed_policy = feed_policy
+        self._staging = staging
+        self._watermark = watermark
+        self._workers = workers
+
+    def inspect(self, videos):
+        # HEAD / playlist requests are issued in parallel
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            return list(executor.map(
+                lambda video: inspect_lecture(self._session, video, self._feed_policy), videos
+            ))
+
+    def estimate(self, videos):
+        return [inspection["size"] for inspection in self.inspect(videos)]
+
+    def admission(self, output_dir):
+        return DiskAdmission(self._staging, output_dir, self._watermark)
+
+    def plan(self, jobs, output_dir, estimates=None):
+        # jobs: [(filename, video)], returns (admitted jobs, skipped jobs, estimates)
+        if estimates is None:
+            estimates = self.estimate([video for _, video in jobs])
+        known = [e for e in estimates if e is not None]
+        # lectures we know nothing about are assumed to be average ones
+        fallback = int(sum(known) / len(known)) if known else 0
+
+        admission = self.admission(output_dir)
+        admitted = []
+        skipped = []
+        for (filename, video), estimate in zip(jobs, estimates):
+            if admission.admit(estimate if estimate is not None else fallback):
+                admitted.append((filename, video))
+            else:
+                skipped.append((filename, video))
+        return admitted, skipped, estimates
+
+class DiskAdmission(object):
+    """
+    Admits lectures one at a time while the output (and scratch) volumes stay under
+    the watermark, counting the space of every lecture admitted before.
+
+    The disk usage is read once, when admission starts: admitted lectures written in
+    the meantime are already counted as reserved.
+    """
+
+    def __init__(self, staging, output_dir, watermark=0.95):
+        super(DiskAdmission, self).__init__()
+        self._watermark = watermark
+        self._reserved = 0
+        self._largest = 0
+        self._known = []
+        # nothing is created here, so planning also works as a dry run
+        scratch_dir = staging.scratch_dir_for(output_dir, create=False)
+        self._volumes = {}
+        for role, path in (("output", output_dir), ("scratch", scratch_dir)):
+            path = existing_parent(path)
+            device = os.stat(path).st_dev
+            volume = self._volumes.setdefault(device, {"path": path, "roles": set()})
+            volume["roles"].add(role)
+        for volume in self._volumes.values():
+            volume["usage"] = shutil.disk_usage(volume["path"])
+
+    def admit(self, size):
+        if size is None:
+            # lectures we know nothing about are assumed to be average ones
+            size = int(sum(self._known) / len(self._known)) if self._known else 0
+        else:
+            self._known.append(size)
+        for volume in self._volumes.values():
+            usage = volume["usage"]
+            needed = 0
+            if "output" in volume["roles"]:
+                needed += self._reserved + size
+            if "scratch" in volume["roles"]:
+                # joined segments and the muxed file exist at the same time
+                needed += 2 * max(self._largest, size)
+            if usage.used + needed > self._watermark * usage.total:
+                return False
+        self._reserved += size
+        self._largest = max(self._largest, size)
+        return True
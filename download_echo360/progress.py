@@ -0,0 +1,296 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+PROGRESS_MODES = ("auto", "dashboard", "quiet", "jsonl")
+
+def format_size(size):
+    if size is None:
+        return "unknown"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024.0:
+            return "{0:.1f} {1}".format(size, unit)
+        size /= 1024.0
+    return "{0:.1f} TB".format(size)
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class ProgressJob(object):
+    """
+    Counters of one transfer (a rendition or an mp4 file). Reporting only updates
+    the counters, rendering is left to the bus.
+    """
+
+    def __init__(self, bus, name, total=None, unit="segments", listeners=(), shown=True):
+        super(ProgressJob, self).__init__()
+        self._bus = bus
+        self.listeners = listeners
+        # False for jobs of redirected threads, which only report to their listeners
+        self.shown = shown
+        self.last_notified = 0.0
+        self.name = name
+        self.unit = unit
+        self.total = total
+        self.done = 0
+        self.bytes = 0
+        self.phase = "downloading"
+        self.ok = None
+        self.start_time = time.monotonic()
+
+    def add_bytes(self, n):
+        self.bytes += n
+        if self.unit == "bytes":
+            self.done += n
+        self._bus.notify(self)
+
+    def segment_done(self, nbytes=0):
+        self.bytes += nbytes
+        self.done += 1
+        self._bus.notify(self)
+
+    def set_total(self, total):
+        self.total = total
+        self._bus.notify(self)
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self._bus.notify(self, event="phase")
+
+    def finish(self, ok=True):
+        self.ok = ok
+        self.phase = "done" if ok else "failed"
+        self._bus.finish(self)
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        rate = self.bytes / elapsed
+        eta = None
+        if self.total and 0 < self.done < self.total:
+            eta = elapsed * (self.total - self.done) / self.done
+        elif self.total and self.done >= self.total:
+            eta = 0
+        return {
+            "job": self.name,
+            "phase": self.phase,
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "bytes": self.bytes,
+            "rate": rate,
+            "eta": eta,
+            "ok": self.ok,
+        }
+
+    def format(self, bar_length=20):
+        snapshot = self.snapshot()
+        if self.total:
+            progress = min(1.0, float(self.done) / self.total)
+            block = "=" * int(round(bar_length * progress))
+            if len(block) < bar_length:
+                block += ">"
+            bar = "[{0}] {1:6.2f}%".format(block + " " * (bar_length - len(block)), progress * 100)
+        else:
+            bar = "[{0}]".format("?" * bar_length)
+        if self.unit == "segments":
+            count = " {0}/{1}".format(self.done, self.total if self.total else "?")
+        else:
+            count = ""
+        return "  > {0}: {1}{2}  {3}  {4}/s  ETA {5}  {6}".format(
+            self.name, bar, count, format_size(self.bytes), format_size(snapshot["rate"]),
+            format_eta(snapshot["eta"]), self.phase,
+        )
+
+class ProgressBus(object):
+    """
+    Collects the progress events of every running transfer and renders them at most
+    a few times per second: a multi-line dashboard on a terminal, JSON lines (on
+    stderr) for scripts, or nothing at all.
+
+    Messages printed while transfers run go through log(), so that they end up above
+    the dashboard instead of inside it.
+    """
+
+    def __init__(self, mode="auto", interval=0.25):
+        super(ProgressBus, self).__init__()
+        self._lock = threading.Lock()
+        self._jobs = []
+        self._drawn = 0
+        self._last_render = 0.0
+        self._local = threading.local()
+        self.configure(mode, interval)
+
+    def configure(self, mode=None, interval=None):
+        if mode is not None:
+            assert mode in PROGRESS_MODES, "Unknown progress mode {}".format(mode)
+            if mode == "auto":
+                mode = "dashboard" if sys.stdout.isatty() else "quiet"
+            self._mode = mode
+        if interval is not None:
+            self._interval = interval
+
+    @property
+    def mode(self):
+        return self._mode
+
+    def listeners(self):
+        # the callbacks of this thread
+        return getattr(self._local, "callbacks", ())
+
+    def _log_sink(self):
+        return getattr(self._local, "log_sink", None)
+
+    @contextlib.contextmanager
+    def listening(self, *callbacks):
+        # jobs started by this thread meanwhile also report to callback(event, snapshot)
+        previous = self.listeners()
+        self._local.callbacks = previous + callbacks
+        try:
+            yield
+        finally:
+            self._local.callbacks = previous
+
+    @contextlib.contextmanager
+    def redirected(self, log_sink):
+        # meanwhile the log lines of this thread go to log_sink(line), and its jobs only
+        # report to their listeners: nothing is written to the terminal
+        previous = self._log_sink()
+        self._local.log_sink = log_sink
+        try:
+            yield
+        finally:
+            self._local.log_sink = previous
+
+    def context(self):
+        # the listeners and redirection of this thread, to pass on with attached()
+        return self.listeners(), self._log_sink()
+
+    @contextlib.contextmanager
+    def attached(self, context):
+        # a worker thread reports like the thread the context was taken from
+        callbacks, log_sink = context
+        with self.listening(*callbacks):
+            if log_sink is None:
+                yield
+            else:
+                with self.redirected(log_sink):
+                    yield
+
+    def log(self, message="", end="\n"):
+        # print() for messages written while transfers may be running
+        log_sink = self._log_sink()
+        if log_sink is None and self._mode != "dashboard":
+            sys.stdout.write(message + end)
+            sys.stdout.flush()
+            return
+        # only whole lines are written above the dashboard (or to the sink)
+        text = getattr(self._local, "partial", "") + message + end
+        lines = text.split("\n")
+        self._local.partial = lines.pop()
+        if not lines:
+            return
+        if log_sink is not None:
+            for line in lines:
+                log_sink(line)
+            return
+        with self._lock:
+            self._render(above=lines)
+
+    def _call_listeners(self, job, event):
+        for callback in job.listeners:
+            try:
+                callback(event, job.snapshot())
+            except Exception as e:
+                _logger.debug("Progress listener failed: {}".format(e))
+
+    def job(self, name, total=None, unit="segments"):
+        job = ProgressJob(self, name, total=total, unit=unit,
+                          listeners=self.listeners(), shown=self._log_sink() is None)
+        self._call_listeners(job, "start")
+        if not job.shown:
+            return job
+        with self._lock:
+            self._jobs.append(job)
+            if self._mode == "jsonl":
+                self._write_event("start", job)
+            self._render()
+        return job
+
+    def notify(self, job, event=None):
+        now = time.monotonic()
+        if job.listeners and (event is not None or now - job.last_notified >= self._interval):
+            job.last_notified = now
+            self._call_listeners(job, event or "progress")
+        if self._mode == "quiet" or not job.shown:
+            return
+        if event is None and now - self._last_render < self._interval:
+            return
+        with self._lock:
+            if self._mode == "jsonl" and event is not None:
+                self._write_event(event, job)
+            self._render(now)
+
+    def finish(self, job):
+        self._call_listeners(job, "finish")
+        if not job.shown:
+            return
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+            if self._mode == "jsonl":
+                self._write_event("finish", job)
+            # finished jobs stay above the dashboard
+            self._render(above=[job.format()] if self._mode == "dashboard" else ())
+
+    def _write_event(self, event, job):
+        line = dict(job.snapshot(), event=event, time=time.time())
+        sys.stderr.write(json.dumps(line) + "\n")
+
+    def _render(self, now=None, above=()):
+        # above: lines written once above the dashboard, which is drawn again below them
+        self._last_render = time.monotonic() if now is None else now
+        if self._mode == "jsonl":
+            for job in self._jobs:
+                self._write_event("progress", job)
+            sys.stderr.flush()
+        elif self._mode == "dashboard":
+            out = []
+            if self._drawn:
+                # back to the first line of the previous dashboard
+                out.append("\x1b[{}F".format(self._drawn))
+            for line in above:
+                out.append("\x1b[K" + line + "\n")
+            for job in self._jobs:
+                out.append("\x1b[K" + job.format() + "\n")
+            if self._drawn:
+                # whatever is left of a longer previous dashboard
+                out.append("\x1b[J")
+            self._drawn = len(self._jobs)
+            sys.stdout.write("".join(out))
+            sys.stdout.flush()
+
+_shared_bus = None
+_shared_bus_lock = threading.Lock()
+
+def get_progress_bus():
+    global _shared_bus
+    with _shared_bus_lock:
+        if _shared_bus is None:
+            _shared_bus = ProgressBus()
+        return _shared_bus
+
+def print_line(message="", end="\n"):
+    # print() through the shared bus, see ProgressBus.log
+    get_progress_bus().log(message, end)
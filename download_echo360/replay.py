@@ -0,0 +1,392 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import argparse
+import atexit
+import functools
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, urlunparse
+
+from download_echo360.http_pool import CountingHTTPAdapter, get_shared_pool
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = "download_echo360-replay"
+ARCHIVE_VERSION = 1
+# the original host of a replayed request, the replay server serves every host
+REPLAY_HOST_HEADER = "X-Echo360-Replay-Host"
+# bodies of these are kept (syllabus, playlists, pages), of the media only the size
+TEXT_CONTENT_TYPES = ("json", "mpegurl", "html", "text", "xml", "javascript")
+# and of these paths, whatever their content type
+METADATA_SUFFIXES = (".m3u8", ".json", "/syllabus")
+MAX_BODY_SIZE = 16 * 1024 * 1024
+KEPT_HEADERS = ("Content-Type", "Location", "Accept-Ranges", "Last-Modified", "ETag")
+# query strings of urls inside bodies, e.g. seg0.ts?Policy=...&Signature=...
+_URL_QUERY = re.compile(r"(\.(?:m3u8|ts|m4s|mp4|aac|vtt|key|json)|/)\?[^\s\"'<>]*")
+
+def scrub_url(url):
+    # access tokens only travel in the query string
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, "", "", ""))
+
+def scrub_text(text):
+    return _URL_QUERY.sub(r"\1", text)
+
+def _is_text(request, response):
+    content_type = response.headers.get("Content-Type", "").lower()
+    return (any(t in content_type for t in TEXT_CONTENT_TYPES)
+            or urlparse(request.url).path.endswith(METADATA_SUFFIXES))
+
+class HttpRecorder(object):
+    """
+    Writes the HTTP exchanges of a run to a gzipped JSON lines archive: url, status,
+    latency and duration of every request, and the body of the metadata (syllabus,
+    playlists, pages). Query strings, cookies and request headers are left out.
+    """
+
+    def __init__(self, path):
+        super(HttpRecorder, self).__init__()
+        self._path = path
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self.count = 0
+        self._write({"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "created": time.time()})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def record(self, request, response, latency, duration, body=None):
+        headers = {name: response.headers[name] for name in KEPT_HEADERS
+                   if name in response.headers}
+        if "Location" in headers:
+            headers["Location"] = scrub_url(headers["Location"])
+        if body is not None:
+            size = len(body)
+            body = scrub_text(body.decode("utf-8", errors="replace"))
+        else:
+            size = int(response.headers.get("Content-Length", 0) or 0)
+        entry = {
+            "method": request.method,
+            "url": scrub_url(request.url),
+            "status": response.status_code,
+            "headers": headers,
+            "latency": latency,
+            "duration": duration,
+            "size": size,
+            "body": body,
+            "at": time.monotonic() - self._start,
+        }
+        with self._lock:
+            if self._file is not None:
+                self._write(entry)
+                self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class RecordingAdapter(CountingHTTPAdapter):
+    # records every exchange of its session into an HttpRecorder
+
+    def __init__(self, recorder, *args, **kwargs):
+        self._recorder = recorder
+        super(RecordingAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        start = time.monotonic()
+        response = super(RecordingAdapter, self).send(request, stream=stream, **kwargs)
+        latency = response.elapsed.total_seconds()
+        body = None
+        length = int(response.headers.get("Content-Length", 0) or 0)
+        try:
+            if _is_text(request, response) and length <= MAX_BODY_SIZE:
+                body = response.content
+                if stream:
+                    # callers may still read the raw stream (e.g. ijson on the syllabus)
+                    response.raw = io.BytesIO(body)
+            elif not stream:
+                # timed here instead of in the session, which reads it right after
+                length = len(response.content)
+        except Exception as e:
+            _logger.debug("Cannot record the body of {}: {}".format(scrub_url(request.url), e))
+            return response
+        self._recorder.record(request, response, latency, time.monotonic() - start, body)
+        return response
+
+def start_recording(path):
+    # every session of the shared pool created from now on is recorded
+    recorder = HttpRecorder(path)
+    get_shared_pool().configure(adapter_factory=functools.partial(RecordingAdapter, recorder))
+    atexit.register(recorder.close)
+    return recorder
+
+class ReplayArchive(object):
+    """
+    The exchanges of a recorded archive by (method, host, path). Requests repeated
+    in the recording (retries, refreshed playlists) are answered in recorded order.
+    """
+
+    def __init__(self, path):
+        super(ReplayArchive, self).__init__()
+        self._lock = threading.Lock()
+        self._exchanges = {}
+        self._served = {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != ARCHIVE_FORMAT:
+                raise ValueError("{} is not a recorded archive".format(path))
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._exchanges.setdefault(self._key(entry["method"], entry["url"]), []).append(entry)
+        self.header = header
+
+    @staticmethod
+    def _key(method, url):
+        parsed = urlparse(url)
+        return method, parsed.netloc, parsed.path
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._exchanges.values())
+
+    def find(self, method, host, path):
+        key = (method, host, path)
+        entries = self._exchanges.get(key)
+        if not entries:
+            return None
+        with self._lock:
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        return entries[min(served, len(entries) - 1)]
+
+    def course_hostname(self, uuid):
+        # where the syllabus of the course was fetched from
+        for method, host, path in self._exchanges.keys():
+            if path.endswith("/section/{}/syllabus".format(uuid)):
+                for entry in self._exchanges[(method, host, path)]:
+                    return "{0}://{1}".format(urlparse(entry["url"]).scheme, host)
+        return None
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    _filler = bytes(64 * 1024)
+
+    def log_message(self, format, *args):
+        _logger.info(format % args)
+
+    def do_GET(self):
+        self._replay()
+
+    def do_HEAD(self):
+        self._replay(send_body=False)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self._replay()
+
+    def _replay(self, send_body=True):
+        server = self.server
+        host = self.headers.get(REPLAY_HOST_HEADER) or self.headers.get("Host")
+        entry = server.archive.find(self.command, host, urlparse(self.path).path)
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # the original time to the first byte, then the body at the original rate
+        time.sleep(entry["latency"] / server.speed)
+        body = entry["body"].encode("utf-8") if entry["body"] is not None else None
+        size = len(body) if body is not None else entry["size"]
+        self.send_response(entry["status"])
+        for name, value in entry["headers"].items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        if not send_body or not size:
+            return
+        transfer_time = max(0.0, entry["duration"] - entry["latency"]) / server.speed
+        start = time.monotonic()
+        sent = 0
+        while sent < size:
+            n = min(len(self._filler), size - sent)
+            self.wfile.write(body[sent:sent + n] if body is not None else self._filler[:n])
+            sent += n
+            ahead = start + transfer_time * sent / size - time.monotonic()
+            if ahead > 0:
+                time.sleep(ahead)
+
+class ReplayServer(object):
+    """
+    Serves a recorded archive on localhost with its original latencies and transfer
+    rates (scaled by speed). Media bodies are replaced by zeros of the recorded size.
+    """
+
+    def __init__(self, archive_path, host="127.0.0.1", port=0, speed=1.0):
+        super(ReplayServer, self).__init__()
+        self._server = ThreadingHTTPServer((host, port), ReplayRequestHandler)
+        self._server.daemon_threads = True
+        self._server.archive = ReplayArchive(archive_path)
+        self._server.speed = speed
+        self._thread = None
+
+    @property
+    def archive(self):
+        return self._server.archive
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{0}:{1}".format(host, port)
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class ReplayAdapter(CountingHTTPAdapter):
+    # sends every request of its session to a ReplayServer, whatever the host
+
+    def __init__(self, replay_url, *args, **kwargs):
+        self._replay_url = replay_url.rstrip("/")
+        super(ReplayAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        parsed = urlparse(request.url)
+        replayed = request.copy()
+        replayed.url = self._replay_url + (parsed.path or "/") + (
+            "?" + parsed.query if parsed.query else "")
+        replayed.headers[REPLAY_HOST_HEADER] = parsed.netloc
+        response = super(ReplayAdapter, self).send(replayed, **kwargs)
+        # redirects and relative urls resolve against the original host
+        response.url = request.url
+        response.request = request
+        return response
+
+def replay_course(archive_path, uuid, hostname=None, output_dir=None, pool_size=50, speed=1.0):
+    # runs the course end to end against a replay of the archive, offline; returns
+    # the timings and throughput, to compare between versions
+    from download_echo360.course import Echo360Course, Echo360Videos
+    from download_echo360.progress import get_progress_bus
+
+    server = ReplayServer(archive_path, speed=speed).start()
+    if hostname is None:
+        hostname = server.archive.course_hostname(uuid) or "https://echo360.org"
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix="download_echo360-replay-")
+    pool = get_shared_pool()
+    pool.configure(adapter_factory=functools.partial(ReplayAdapter, server.url))
+    transferred = []
+
+    def on_progress(event, snapshot):
+        if event == "finish":
+            transferred.append(snapshot["bytes"])
+
+    try:
+        start = time.monotonic()
+        course = Echo360Course(uuid=uuid, hostname=hostname)
+        session = pool.session(hostname)
+        course.set_session(session)
+        lessons = course.get_lessons()
+        syllabus_time = time.monotonic() - start
+        videos = Echo360Videos(lessons, None, hostname)
+        resolved = 0
+        downloaded = 0
+        resolve_time = 0.0
+        download_time = 0.0
+        with get_progress_bus().listening(on_progress):
+            resolve_start = time.monotonic()
+            for number, video in videos:
+                resolve_time += time.monotonic() - resolve_start
+                for i, part in enumerate(video.get_all_parts()):
+                    resolved += 1
+                    if part.url is False:
+                        continue
+                    download_start = time.monotonic()
+                    # without ffmpeg the mux fails, the transfer is measured all the same
+                    if part.download(output_dir, "Lecture {0}.{1}".format(number, i + 1),
+                                     pool_size=pool_size, session=session):
+                        downloaded += 1
+                    download_time += time.monotonic() - download_start
+                resolve_start = time.monotonic()
+        elapsed = time.monotonic() - start
+    finally:
+        server.close()
+        pool.close()
+    total_bytes = sum(transferred)
+    return {
+        "archive": os.path.basename(archive_path),
+        "lessons": len(lessons),
+        "resolved": resolved,
+        "downloaded": downloaded,
+        "bytes": total_bytes,
+        "syllabus_time": syllabus_time,
+        "resolve_time": resolve_time,
+        "download_time": download_time,
+        "elapsed": elapsed,
+        "throughput": total_bytes / download_time if download_time else None,
+        "output_dir": output_dir,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay an archive recorded with --record, offline",
+        prog="python -m download_echo360.replay",
+    )
+    parser.add_argument("archive", help="Archive written by --record")
+    parser.add_argument("course", nargs="?",
+                        help="Course UUID to download end to end against the replay, "
+                             "printing its timings as JSON")
+    parser.add_argument("--serve", metavar="HOST:PORT",
+                        help="Only serve the archive, e.g. to point a browser at it")
+    parser.add_argument("--hostname", help="Course hostname (default: from the archive)")
+    parser.add_argument("-o", "--output", help="Output directory (default: a temporary one)")
+    parser.add_argument("--pool-size", type=int, default=50, metavar="N")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay this many times faster than recorded (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.serve is not None:
+        host, _, port = args.serve.rpartition(":")
+        server = ReplayServer(args.archive, host=host or "127.0.0.1", port=int(port),
+                              speed=args.speed)
+        print("> Serving {0} exchanges on {1}, send the original host in the {2} header".format(
+            len(server.archive), server.url, REPLAY_HOST_HEADER))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.course is None:
+        parser.error("a course UUID or --serve is required")
+    result = replay_course(args.archive, args.course, hostname=args.hostname,
+                           output_dir=args.output, pool_size=args.pool_size, speed=args.speed)
+    print(json.dumps(result, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
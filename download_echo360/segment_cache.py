@@ -0,0 +1,162 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from urllib.parse import urlparse
+
+from download_echo360.paths import get_user_cache_dir
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+def default_segment_cache_dir():
+    return get_user_cache_dir("segments")
+
+class SegmentCache(object):
+    """
+    On-disk LRU cache of hls segments, so that a lecture whose mux failed (or whose
+    run was interrupted) is put together again without downloading it.
+
+    Segments are keyed by their url without the query string, which only carries
+    expiring access tokens. The segments of a lecture are pinned until its final
+    file is in place and are never evicted before; the others are evicted least
+    recently used first once the cache grows over max_size bytes.
+    """
+
+    def __init__(self, root=None, max_size=2 * 1024 ** 3):
+        super(SegmentCache, self).__init__()
+        self._root = root if root is not None else default_segment_cache_dir()
+        self._pins_dir = os.path.join(self._root, "pins")
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(self._pins_dir, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path, _ in self._entries())
+
+    @property
+    def size(self):
+        return self._size
+
+    @staticmethod
+    def key(url):
+        parsed = urlparse(url)
+        return hashlib.sha256("{0}{1}".format(parsed.netloc, parsed.path).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._root, key[:2], key)
+
+    def _entries(self):
+        # [(path, key)] of every cached segment
+        entries = []
+        for name in os.listdir(self._root):
+            directory = os.path.join(self._root, name)
+            if len(name) != 2 or not os.path.isdir(directory):
+                continue
+            for key in os.listdir(directory):
+                if not key.endswith(".partial"):
+                    entries.append((os.path.join(directory, key), key))
+        return entries
+
+    def _pin_path(self, owner):
+        return os.path.join(self._pins_dir, hashlib.sha1(owner.encode("utf-8")).hexdigest())
+
+    def pin(self, owner, urls):
+        # keeps the segments of urls until release(owner), also across runs
+        pin_path = self._pin_path(owner)
+        with self._lock:
+            try:
+                with open(pin_path) as f:
+                    keys = set(json.load(f)["keys"])
+            except (OSError, ValueError, KeyError):
+                keys = set()
+            keys.update(self.key(url) for url in urls)
+            with open(pin_path + ".tmp", "w") as f:
+                json.dump({"owner": owner, "keys": sorted(keys)}, f)
+            os.replace(pin_path + ".tmp", pin_path)
+
+    def release(self, owner):
+        with self._lock:
+            try:
+                os.remove(self._pin_path(owner))
+            except FileNotFoundError:
+                pass
+
+    def _pinned(self):
+        pinned = set()
+        for name in os.listdir(self._pins_dir):
+            try:
+                with open(os.path.join(self._pins_dir, name)) as f:
+                    pinned.update(json.load(f)["keys"])
+            except (OSError, ValueError, KeyError) as e:
+                _logger.debug("Ignoring pin file {}: {}".format(name, e))
+        return pinned
+
+    def get(self, url, dest):
+        # copies (or links) the cached segment of url to dest, False on a miss
+        path = self._path(self.key(url))
+        try:
+            try:
+                os.link(path, dest)
+            except FileExistsError:
+                os.remove(dest)
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+            # most recently used
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put(self, url, src):
+        path = self._path(self.key(url))
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + ".partial"
+        try:
+            try:
+                os.link(src, partial)
+            except FileExistsError:
+                os.remove(partial)
+                os.link(src, partial)
+            except OSError:
+                shutil.copyfile(src, partial)
+            os.replace(partial, path)
+        except OSError as e:
+            # the cache is only an optimization
+            _logger.debug("Cannot cache {}: {}".format(url, e))
+            return
+        with self._lock:
+            self._size += os.path.getsize(path)
+            over = self._size > self._max_size
+        if over:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            pinned = self._pinned()
+            entries = []
+            for path, key in self._entries():
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path, key))
+            self._size = sum(size for _, size, _, _ in entries)
+            for _, size, path, key in sorted(entries):
+                if self._size <= self._max_size:
+                    break
+                if key in pinned:
+                    continue
+                try:
+                    os.remove(path)
+                    self._size -= size
+                except FileNotFoundError:
+                    pass
+            if self._size > self._max_size:
+                _logger.debug("Segment cache is over its size, {} bytes pinned".format(self._size))
@@ -0,0 +1,98 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import errno
+import hashlib
+import logging
+import os
+import shutil
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("never", "final", "always")
+
+class Staging(object):
+    """
+    Where intermediate files are written and how finished lectures get into the archive.
+
+    Intermediate files live in a scratch directory (by default a hidden folder inside
+    the output directory, or e.g. a local SSD/tmpfs), are preallocated when their size
+    is known, and each finished file is moved into the output directory with a single
+    atomic rename, so other tools never see half-written lectures.
+    """
+
+    PARTIAL_DIR = ".download_echo360.partial"
+
+    def __init__(self, scratch_dir=None, fsync_policy="final", copy_buffer_size=8 * 1024 * 1024):
+        super(Staging, self).__init__()
+        assert fsync_policy in FSYNC_POLICIES, "Unknown fsync policy {}".format(fsync_policy)
+        self._scratch_dir = scratch_dir
+        self._fsync_policy = fsync_policy
+        self._copy_buffer_size = copy_buffer_size
+
+    def scratch_dir_for(self, output_dir, create=True):
+        if self._scratch_dir is None:
+            path = os.path.join(output_dir, Staging.PARTIAL_DIR)
+        else:
+            # one folder per output directory, so courses with equal names don't clash
+            digest = hashlib.sha1(os.path.abspath(output_dir).encode("utf-8")).hexdigest()[:8]
+            name = "{0}-{1}".format(os.path.basename(os.path.normpath(output_dir)), digest)
+            path = os.path.join(self._scratch_dir, name)
+        if create:
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    def cleanup(self, output_dir):
+        # remove the scratch folder if nothing is left in it
+        try:
+            os.rmdir(self.scratch_dir_for(output_dir, create=False))
+        except OSError:
+            pass
+
+    @staticmethod
+    def preallocate(f, size):
+        if not size or size <= 0 or not hasattr(os, "posix_fallocate"):
+            return
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except OSError as e:
+            # e.g. not supported by the filesystem, the file just grows as usual
+            _logger.debug("Cannot preallocate {} bytes: {}".format(size, e))
+
+    def sync(self, f, final=False):
+        if self._fsync_policy == "always" or (final and self._fsync_policy == "final"):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync_dir(self, path):
+        if self._fsync_policy == "never" or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def finalize(self, src, dest):
+        dest_dir = os.path.dirname(os.path.abspath(dest))
+        os.makedirs(dest_dir, exist_ok=True)
+        if self._fsync_policy != "never":
+            with open(src, "rb+") as f:
+                self.sync(f, final=True)
+        try:
+            os.replace(src, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # scratch is on another filesystem: copy next to the destination first,
+            # so the file still appears in the archive with one atomic rename
+            partial = os.path.join(dest_dir, ".{0}.partial".format(os.path.basename(dest)))
+            with open(src, "rb") as fsrc, open(partial, "wb") as fdest:
+                self.preallocate(fdest, os.fstat(fsrc.fileno()).st_size)
+                shutil.copyfileobj(fsrc, fdest, self._copy_buffer_size)
+                self.sync(fdest, final=True)
+            os.replace(partial, dest)
+            os.remove(src)
+        self._sync_dir(dest_dir)
+        return dest
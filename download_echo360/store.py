@@ -0,0 +1,209 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+from urllib.parse import urlparse
+
+from download_echo360.integrity import hash_file
+from download_echo360.paths import get_user_cache_dir
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# ioctl cloning a whole file on btrfs/xfs (linux/fs.h)
+FICLONE = 0x40049409
+
+def default_store_dir():
+    return get_user_cache_dir("store")
+
+def clone_file(src, dest):
+    # hardlink, else reflink, else a plain copy; returns how dest was made
+    try:
+        os.link(src, dest)
+        return "hardlink"
+    except OSError as e:
+        _logger.debug("Cannot hardlink {} to {}: {}".format(src, dest, e))
+    if sys.platform.startswith("linux"):
+        import fcntl
+        try:
+            with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except OSError as e:
+            _logger.debug("Cannot reflink {} to {}: {}".format(src, dest, e))
+    shutil.copyfile(src, dest)
+    return "copy"
+
+class ContentStore(object):
+    """
+    Finished lectures addressed by their content, so that a lecture cross-listed in
+    several sections is downloaded once and linked into every course folder.
+
+    A lecture is looked up by the path of its media url (without host and query
+    tokens, which differ between sections) and the variant (window, audio format)
+    that was downloaded. Objects are named after their sha256 and remember the files
+    linked to them; `gc` drops objects none of those files refer to anymore. Objects
+    are not re-hashed when linked, a broken one is found by --verify and `discard`ed.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root=None):
+        super(ContentStore, self).__init__()
+        self._root = root if root is not None else default_store_dir()
+        self._objects_dir = os.path.join(self._root, "objects")
+        self._index_path = os.path.join(self._root, ContentStore.INDEX_FILE)
+        self._lock = threading.Lock()
+        os.makedirs(self._objects_dir, exist_ok=True)
+
+    @property
+    def root(self):
+        return self._root
+
+    @staticmethod
+    def key(url, variant=""):
+        path = urlparse(url).path
+        return hashlib.sha256("{0}|{1}".format(path, variant).encode("utf-8")).hexdigest()
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def _load(self):
+        # re-read on every change, other processes (e.g. the daemon) share the store
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {}
+        except ValueError as e:
+            _logger.debug("Ignoring corrupt store index {}: {}".format(self._index_path, e))
+            index = {}
+        index.setdefault("keys", {})
+        index.setdefault("refs", {})
+        return index
+
+    def _save(self, index):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._index_path)
+
+    @staticmethod
+    def _ref(path):
+        st = os.stat(path)
+        return {"size": st.st_size, "mtime": st.st_mtime_ns}
+
+    def lookup(self, key):
+        # {"object", "size", "ext", "duration"} of a stored lecture, None if unknown
+        with self._lock:
+            entry = self._load()["keys"].get(key)
+        if entry is None:
+            return None
+        path = self._object_path(entry["object"])
+        if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            return None
+        return entry
+
+    def materialize(self, key, dest):
+        # links the stored lecture to dest, returns None if it is not (intact) in the store
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        src = self._object_path(entry["object"])
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        partial = os.path.join(os.path.dirname(os.path.abspath(dest)),
+                               ".{0}.partial".format(os.path.basename(dest)))
+        if os.path.exists(partial):
+            os.remove(partial)
+        clone_file(src, partial)
+        os.replace(partial, dest)
+        with self._lock:
+            index = self._load()
+            index["refs"].setdefault(entry["object"], {})[os.path.abspath(dest)] = self._ref(dest)
+            self._save(index)
+        return entry
+
+    def add(self, key, path, ext, duration=None):
+        # returns the sha256 of path, for the manifest to record
+        digest = hash_file(path)
+        object_path = self._object_path(digest)
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            partial = object_path + ".partial"
+            if os.path.exists(partial):
+                os.remove(partial)
+            clone_file(path, partial)
+            os.replace(partial, object_path)
+        with self._lock:
+            index = self._load()
+            index["keys"][key] = {
+                "object": digest,
+                "size": os.path.getsize(object_path),
+                "ext": ext,
+                "duration": duration,
+            }
+            index["refs"].setdefault(digest, {})[os.path.abspath(path)] = self._ref(path)
+            self._save(index)
+        return digest
+
+    def discard(self, digest):
+        # drops a (broken) object, the lectures stored as it are downloaded again
+        with self._lock:
+            index = self._load()
+            index["keys"] = {
+                key: entry for key, entry in index["keys"].items() if entry["object"] != digest
+            }
+            index["refs"].pop(digest, None)
+            object_path = self._object_path(digest)
+            if os.path.isfile(object_path):
+                os.remove(object_path)
+            self._save(index)
+
+    def _is_referenced_by(self, object_path, path, ref):
+        try:
+            if os.path.samefile(object_path, path):
+                return True
+            # a reflink or copy, still the same file if it was not rewritten since
+            return self._ref(path) == ref
+        except OSError:
+            return False
+
+    def gc(self):
+        # returns (objects removed, bytes freed)
+        removed = 0
+        freed = 0
+        with self._lock:
+            index = self._load()
+            for digest in list(index["refs"].keys()) + [
+                    d for d in self._list_objects() if d not in index["refs"]]:
+                object_path = self._object_path(digest)
+                refs = {
+                    path: ref for path, ref in index["refs"].get(digest, {}).items()
+                    if self._is_referenced_by(object_path, path, ref)
+                }
+                if refs:
+                    index["refs"][digest] = refs
+                    continue
+                index["refs"].pop(digest, None)
+                if os.path.isfile(object_path):
+                    freed += os.path.getsize(object_path)
+                    os.remove(object_path)
+                    removed += 1
+            index["keys"] = {
+                key: entry for key, entry in index["keys"].items()
+                if entry["object"] in index["refs"]
+            }
+            self._save(index)
+        return removed, freed
+
+    def _list_objects(self):
+        for root, _, files in os.walk(self._objects_dir):
+            for name in files:
+                if not name.endswith(".partial"):
+                    yield name
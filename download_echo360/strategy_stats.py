@@ -0,0 +1,98 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import json
+import logging
+import os
+import random
+import threading
+
+from download_echo360.paths import get_user_cache_dir
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+class StrategyStats(object):
+    """
+    Remembers, per hostname, which url resolution strategy works and how long it takes.
+
+    Strategies that worked are tried first (best success rate, then lowest latency),
+    strategies that never worked after `min_attempts` tries are skipped, and once in a
+    while (`reprobe_rate`) the default order is used again to notice platform changes.
+    """
+
+    _default = None
+
+    def __init__(self, path, reprobe_rate=0.05, min_attempts=3):
+        super(StrategyStats, self).__init__()
+        self._path = path
+        self._reprobe_rate = reprobe_rate
+        self._min_attempts = min_attempts
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._dirty = False
+        self.load()
+
+    @classmethod
+    def default(cls):
+        # a single instance per process, so concurrent downloaders don't overwrite each other
+        if cls._default is None:
+            cls._default = cls(os.path.join(get_user_cache_dir(), "strategy_stats.json"))
+        return cls._default
+
+    def load(self):
+        try:
+            with open(self._path) as f:
+                self._stats = json.load(f)
+        except FileNotFoundError:
+            self._stats = {}
+        except ValueError as e:
+            _logger.debug("Ignoring corrupt strategy stats {}: {}".format(self._path, e))
+            self._stats = {}
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._stats, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self._path)
+            self._dirty = False
+
+    def record(self, hostname, strategy, success, latency):
+        with self._lock:
+            entry = self._stats.setdefault(hostname, {}).setdefault(
+                strategy, {"attempts": 0, "successes": 0, "success_time": 0.0}
+            )
+            entry["attempts"] += 1
+            if success:
+                entry["successes"] += 1
+                entry["success_time"] += latency
+            self._dirty = True
+
+    def order(self, hostname, strategies):
+        if random.random() < self._reprobe_rate:
+            return list(strategies)
+        with self._lock:
+            host_stats = {k: dict(v) for k, v in self._stats.get(hostname, {}).items()}
+
+        def rank(indexed_strategy):
+            index, strategy = indexed_strategy
+            entry = host_stats.get(strategy)
+            if entry is None or entry["successes"] == 0:
+                # untried (or not yet proven) strategies keep their default order
+                return (1, 0, 0, index)
+            success_rate = float(entry["successes"]) / entry["attempts"]
+            mean_time = entry["success_time"] / entry["successes"]
+            return (0, -success_rate, mean_time, index)
+
+        ordered = []
+        for index, strategy in sorted(enumerate(strategies), key=rank):
+            entry = host_stats.get(strategy)
+            if (entry is not None and entry["successes"] == 0
+                    and entry["attempts"] >= self._min_attempts):
+                continue
+            ordered.append(strategy)
+        # nothing ever worked for this host, so there is nothing to learn from
+        return ordered if ordered else list(strategies)
\ No newline at end of file
@@ -0,0 +1,141 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import logging
+import threading
+import weakref
+
+try:
+    # optional, multiplexes the segment requests over a few HTTP/2 connections
+    import httpx
+    import h2  # noqa: F401 (httpx needs it for http2=True)
+except ImportError:
+    httpx = None
+
+logging.basicConfig(
+    format="[%(levelname)s: %(name)-12s] %(message)s",
+    level=logging.ERROR)
+_logger = logging.getLogger(__name__)
+
+# how the hls segments are fetched
+TRANSPORTS = ("requests", "http2")
+
+class RequestsTransport(object):
+    """
+    HTTP/1.1 through the (shared) requests session: every segment in flight holds
+    a connection of its own.
+    """
+
+    name = "requests"
+
+    def __init__(self, session):
+        super(RequestsTransport, self).__init__()
+        self._session = session
+
+    def get(self, url, timeout=20):
+        # returns (response, content)
+        r = self._session.get(url, timeout=timeout)
+        return r, r.content
+
+    def connection_count(self):
+        return None
+
+    def close(self):
+        # the session belongs to the HttpPool
+        pass
+
+class Http2Response(object):
+    # the part of a requests response the segment downloader looks at
+
+    def __init__(self, response):
+        super(Http2Response, self).__init__()
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.http_version = response.http_version
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+class Http2Transport(object):
+    """
+    HTTP/2 through httpx: the segment requests are multiplexed as streams over at
+    most max_connections connections per host, instead of one TLS connection per
+    segment in flight. Cookies and headers are those of the requests session.
+
+    HTTP/2 is negotiated with ALPN on https urls, servers that do not offer it are
+    spoken to over HTTP/1.1. prior_knowledge speaks HTTP/2 on cleartext urls too
+    (h2c, e.g. a local test server).
+    """
+
+    name = "http2"
+
+    def __init__(self, session, max_connections=4, prior_knowledge=False):
+        super(Http2Transport, self).__init__()
+        if httpx is None:
+            raise ImportError("the http2 transport needs httpx[http2]")
+        self._connections = 0
+        self._lock = threading.Lock()
+        self._client = httpx.Client(
+            http1=not prior_knowledge,
+            http2=True,
+            headers=dict(session.headers),
+            cookies=session.cookies,
+            verify=session.verify,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+        )
+
+    def _trace(self, event, info):
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self._connections += 1
+
+    def get(self, url, timeout=20):
+        r = self._client.get(url, timeout=timeout, extensions={"trace": self._trace})
+        return Http2Response(r), r.content
+
+    def connection_count(self):
+        # connections opened so far
+        with self._lock:
+            return self._connections
+
+    def close(self):
+        self._client.close()
+
+# one transport per session and kind, so that the downloaders of a run share connections
+_transports = weakref.WeakKeyDictionary()
+_transports_lock = threading.Lock()
+
+def get_transport(session, name="requests", **options):
+    if name not in TRANSPORTS:
+        raise ValueError("unknown transport {}".format(name))
+    with _transports_lock:
+        transports = _transports.setdefault(session, {})
+        transport = transports.get(name)
+        if transport is None:
+            if name == "http2" and httpx is None:
+                print('[WARN] The http2 transport needs "httpx[http2]", falling back to requests.')
+                transport = transports.get("requests") or RequestsTransport(session)
+            elif name == "http2":
+                transport = Http2Transport(session, **options)
+            else:
+                transport = RequestsTransport(session)
+            transports[name] = transport
+        return transport
+
+def _all_transports():
+    with _transports_lock:
+        return [t for kinds in _transports.values() for t in kinds.values()]
+
+def print_transport_summary():
+    connections = [t.connection_count() for t in _all_transports() if t.name == "http2"]
+    if connections:
+        print("    Connections of the http2 transport: {}".format(sum(connections)))
+
+def close_transports():
+    transports = _all_transports()
+    with _transports_lock:
+        _transports.clear()
+    for transport in transports:
+        transport.close()
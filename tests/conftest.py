@@ -0,0 +1,184 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import functools
+import json
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from download_echo360 import downloader as downloader_module
+from download_echo360.course import Echo360Course, Echo360Video, LessonRecord
+from download_echo360.downloader import Echo360Downloader
+from download_echo360.http_pool import get_shared_pool
+from download_echo360.progress import get_progress_bus
+
+SECTION = "00000000-0000-0000-0000-000000000001"
+
+# the master playlist of a lecture, named like the audio+video manifests of Echo360
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=100000,RESOLUTION=640x360
+media.m3u8
+"""
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def write_lecture(root, segments=5, duration=2.0, segment_size=1000, name="hls"):
+    # an hls lecture of `segments` segments of `duration` seconds under root/name, with
+    # the master playlist s1_av.m3u8 and the media playlist media.m3u8
+    hls = os.path.join(root, name)
+    os.makedirs(hls, exist_ok=True)
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:{}".format(int(duration))]
+    for i in range(segments):
+        lines += ["#EXTINF:{},".format(duration), "seg{}.ts".format(i)]
+        with open(os.path.join(hls, "seg{}.ts".format(i)), "wb") as f:
+            f.write(bytes([i % 256]) * segment_size)
+    lines.append("#EXT-X-ENDLIST")
+    with open(os.path.join(hls, "media.m3u8"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(os.path.join(hls, "s1_av.m3u8"), "w") as f:
+        f.write(MASTER_PLAYLIST)
+
+def write_file(root, name, size):
+    with open(os.path.join(root, name), "wb") as f:
+        f.write(b"\0" * size)
+
+def lesson_json(lesson_id, manifests=(), primary_files=(), start_time=None):
+    # a lesson of the syllabus, as the section syllabus api returns it
+    return {
+        "lesson": {
+            "lesson": {"id": lesson_id, "name": "Lecture {}".format(lesson_id)},
+            "startTimeUTC": start_time,
+            "hasVideo": True,
+            "hasAvailableVideo": True,
+            "video": {
+                "published": {"courseName": "TEST101"},
+                "media": {"media": {
+                    "current": {"primaryFiles": list(primary_files)},
+                    "versions": [{"manifests": list(manifests)}],
+                }},
+            },
+        },
+    }
+
+def performance_entry(url, method="Network.requestWillBeSent"):
+    # an entry of chrome's performance log for a request of url
+    return {"message": json.dumps({"message": {
+        "method": method, "params": {"request": {"url": url}},
+    }})}
+
+class FakeDriver(object):
+    """
+    Stands in for a selenium Chrome driver: loading a page "requests" the stream urls
+    given for it ({page url: [stream urls]}, or [stream urls] for every page), which
+    then show up in the performance log.
+    """
+
+    def __init__(self, streams=(), on_load=None):
+        super(FakeDriver, self).__init__()
+        self.streams = streams
+        self.loads = []
+        self._on_load = on_load
+        self._log = []
+
+    def get(self, url):
+        self.loads.append(url)
+        if self._on_load is not None:
+            self._on_load(url)
+        streams = self.streams.get(url, ()) if isinstance(self.streams, dict) else self.streams
+        for stream in streams:
+            self.request(stream)
+
+    def request(self, url):
+        # a request made by the current page
+        self._log.append(performance_entry(url))
+
+    def get_log(self, kind):
+        log, self._log = self._log, []
+        return log
+
+    def get_cookies(self):
+        return []
+
+    def close(self):
+        pass
+
+    def quit(self):
+        pass
+
+@pytest.fixture(autouse=True)
+def quiet_progress():
+    get_progress_bus().configure(mode="quiet")
+
+@pytest.fixture(autouse=True, scope="session")
+def user_cache(tmp_path_factory):
+    # strategy stats, stores and caches of the tests stay out of the user's cache
+    previous = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path_factory.mktemp("cache"))
+    yield
+    if previous is None:
+        del os.environ["XDG_CACHE_HOME"]
+    else:
+        os.environ["XDG_CACHE_HOME"] = previous
+
+@pytest.fixture
+def server(tmp_path):
+    # serves tmp_path/www over HTTP, with an hls lecture under /hls
+    root = tmp_path / "www"
+    root.mkdir()
+    write_lecture(str(root))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0),
+                                functools.partial(QuietHandler, directory=str(root)))
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.root = str(root)
+    httpd.url = "http://127.0.0.1:{}".format(httpd.server_address[1])
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+@pytest.fixture
+def session():
+    with requests.Session() as s:
+        yield s
+
+@pytest.fixture
+def make_course(server):
+    # an Echo360Course of the given syllabus lessons (or raw syllabus text), served by server
+    def make_course(lessons):
+        directory = os.path.join(server.root, "section", SECTION)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "syllabus"), "w") as f:
+            f.write(lessons if isinstance(lessons, str) else json.dumps({"data": lessons}))
+        echo_course = Echo360Course(SECTION, hostname=server.url)
+        echo_course.set_session(get_shared_pool().session(server.url))
+        return echo_course
+    return make_course
+
+@pytest.fixture
+def make_video(server):
+    # an Echo360Video resolved from a syllabus lesson, pages are loaded with driver
+    def make_video(lesson=None, driver=None, **options):
+        if lesson is None:
+            lesson = lesson_json("1")
+        return Echo360Video(LessonRecord.from_json(lesson), driver or FakeDriver(), server.url,
+                            **options)
+    return make_video
+
+@pytest.fixture
+def make_downloader(tmp_path, monkeypatch):
+    # an Echo360Downloader of a course, with driver standing in for Chrome
+    def make_downloader(echo_course, driver=None, **options):
+        driver = driver or FakeDriver()
+        monkeypatch.setattr(downloader_module, "get_chrome_binary_path", lambda: None)
+        monkeypatch.setattr(downloader_module, "build_chrome_driver",
+                            lambda *args, **kwargs: driver)
+        options.setdefault("scrape_workers", 1)
+        return Echo360Downloader(echo_course, str(tmp_path / "out"), **options)
+    return make_downloader
@@ -0,0 +1,44 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import asyncio
+import os
+import threading
+import time
+
+import ffmpy
+import pytest
+
+from download_echo360.aio import AsyncCourse
+from download_echo360.hls_downloader import DownloadCancelled, run_ffmpeg
+
+from tests.conftest import SECTION, lesson_json, write_file
+
+def test_lessons_are_downloaded_without_printing(server, make_course, tmp_path, capsys):
+    write_file(server.root, "lecture1.mp4", 2000)
+    make_course([lesson_json("1", primary_files=[{"s3Url": server.url + "/lecture1.mp4"}])])
+    events = []
+
+    async def download():
+        async with AsyncCourse(SECTION, server.url) as course:
+            return [await lesson.download(str(tmp_path / "out"),
+                                          progress=lambda *args: events.append(args[1]))
+                    async for lesson in course.lessons()]
+
+    results = asyncio.run(download())
+    assert [(result.ok, len(result.files)) for result in results] == [(True, 1)]
+    assert os.path.getsize(results[0].files[0][0]) == 2000
+    assert events[0] == "start" and events[-1] == "finish"
+    assert capsys.readouterr().out == ""
+
+def test_cancelled_ffmpeg_is_terminated(tmp_path):
+    # stands in for a long ffmpeg run
+    ff = ffmpy.FFmpeg(executable="sleep", global_options="30")
+    output = tmp_path / "partial.mp4"
+    output.write_bytes(b"partial")
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+    start = time.monotonic()
+    with pytest.raises(DownloadCancelled):
+        run_ffmpeg(ff, cancel_event, str(output))
+    assert time.monotonic() - start < 5
+    assert ff.process.returncode is not None
+    assert not output.exists()
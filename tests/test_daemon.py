@@ -0,0 +1,31 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import pytest
+
+from download_echo360 import daemon
+from download_echo360.daemon import Echo360Daemon
+
+class FakeDownloader(object):
+    instances = []
+
+    def __init__(self, **kwargs):
+        self._driver = object()
+        self.closed = False
+        FakeDownloader.instances.append(self)
+
+    def close(self):
+        self.closed = True
+
+def test_failed_login_closes_the_browser(tmp_path, monkeypatch):
+    def fail_login(driver, url):
+        raise EOFError("no terminal")
+
+    FakeDownloader.instances = []
+    monkeypatch.setattr(daemon, "Echo360Downloader", FakeDownloader)
+    monkeypatch.setattr(daemon, "run_setup_credentials", fail_login)
+    echo360_daemon = Echo360Daemon(str(tmp_path), "https://echo360.org",
+                                   job_file=str(tmp_path / "jobs.json"))
+    for _ in range(2):
+        with pytest.raises(EOFError):
+            echo360_daemon._get_downloader("https://echo360.org")
+    assert [downloader.closed for downloader in FakeDownloader.instances] == [True, True]
+    assert echo360_daemon._downloaders == {}
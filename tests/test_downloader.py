@@ -0,0 +1,94 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import os
+import threading
+
+from download_echo360 import integrity, store
+from download_echo360.progress import get_progress_bus
+
+from tests.conftest import FakeDriver, lesson_json, write_file
+
+def test_downloads_overlap_with_resolution(server, tmp_path, make_course, make_downloader):
+    write_file(server.root, "lecture1.mp4", 2000)
+    write_file(server.root, "lecture2.mp4", 3000)
+    echo_course = make_course([
+        lesson_json("1", primary_files=[{"s3Url": server.url + "/lecture1.mp4"}],
+                    start_time="2024-01-01T10:00:00Z"),
+        # scraped from its page, which only loads once the first download has started
+        lesson_json("2", start_time="2024-01-08T10:00:00Z"),
+    ])
+    download_started = threading.Event()
+    overlapped = []
+
+    def on_load(url):
+        overlapped.append(download_started.wait(timeout=5))
+
+    def listener(event, snapshot):
+        if event == "start":
+            download_started.set()
+
+    driver = FakeDriver([server.url + "/lecture2.mp4"], on_load=on_load)
+    downloader = make_downloader(echo_course, driver=driver)
+    with get_progress_bus().listening(listener):
+        assert downloader.download_all() == []
+    assert overlapped == [True]
+    files = os.listdir(str(tmp_path / "out" / "TEST101"))
+    assert sorted(name for name in files if name.endswith(".mp4")) == [
+        "2024-01-01 - Lecture 1 [Lecture 1]1.mp4", "2024-01-08 - Lecture 2 [Lecture 2]1.mp4"]
+
+def test_cancel_stops_the_lecture_in_progress(server, tmp_path, make_course, make_downloader):
+    write_file(server.root, "lecture1.mp4", 4 * 1024 * 1024)
+    write_file(server.root, "lecture2.mp4", 2000)
+    echo_course = make_course([
+        lesson_json("1", primary_files=[{"s3Url": server.url + "/lecture1.mp4"}],
+                    start_time="2024-01-01T10:00:00Z"),
+        lesson_json("2", primary_files=[{"s3Url": server.url + "/lecture2.mp4"}],
+                    start_time="2024-01-08T10:00:00Z"),
+    ])
+    cancel_event = threading.Event()
+
+    def listener(event, snapshot):
+        # e.g. DELETE /jobs/<id> while the first lecture is transferred
+        if event == "start":
+            cancel_event.set()
+
+    downloader = make_downloader(echo_course)
+    with get_progress_bus().listening(listener):
+        failed = downloader.download_all(cancel_event=cancel_event)
+    assert failed == ["2024-01-01 - Lecture 1 [Lecture 1]"]
+    # nothing of either lecture is left behind
+    for _, _, files in os.walk(str(tmp_path / "out")):
+        assert not [name for name in files if name.endswith(".mp4")]
+
+
+def test_stored_lectures_are_hashed_once(server, tmp_path, make_course, make_downloader,
+                                         monkeypatch):
+    write_file(server.root, "lecture1.mp4", 2000)
+    hashed = []
+    original_hash_file = integrity.hash_file
+
+    def hash_file(path):
+        hashed.append(os.path.basename(path))
+        return original_hash_file(path)
+
+    monkeypatch.setattr(store, "hash_file", hash_file)
+    monkeypatch.setattr(integrity, "hash_file", hash_file)
+    lecture = "2024-01-01 - Lecture 1 [Lecture 1]1.mp4"
+    course_dir = tmp_path / "out" / "TEST101"
+    for run in range(2):
+        echo_course = make_course([
+            lesson_json("1", primary_files=[{"s3Url": server.url + "/lecture1.mp4"}],
+                        start_time="2024-01-01T10:00:00Z"),
+        ])
+        downloader = make_downloader(echo_course, store_dir=str(tmp_path / "store"))
+        assert downloader.download_all() == []
+        # the second run links the lecture from the store
+        assert hashed == [lecture]
+        entry = integrity.DownloadManifest(str(course_dir)).entries[lecture]
+        assert entry["sha256"] == original_hash_file(str(course_dir / lecture))
+        os.remove(str(course_dir / lecture))
+        os.remove(str(course_dir / integrity.DownloadManifest.FILENAME))
+    # the store is only cleaned up when the run ends
+    objects = tmp_path / "store" / "objects"
+    assert [name for _, _, names in os.walk(str(objects)) for name in names]
+    downloader.collect_store_garbage()
+    assert not [name for _, _, names in os.walk(str(objects)) for name in names]
@@ -0,0 +1,32 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import os
+import threading
+
+from download_echo360.progress import get_progress_bus
+from download_echo360.staging import Staging
+
+from tests.conftest import FakeDriver, write_file
+
+def test_feeds_report_to_the_callers_listeners(server, session, tmp_path, make_video):
+    write_file(server.root, "camera.mp4", 3000)
+    write_file(server.root, "slides.mp4", 5000)
+    video = make_video(driver=FakeDriver([server.url + "/camera.mp4",
+                                          server.url + "/slides.mp4"]))
+    assert video.url == [server.url + "/camera.mp4", server.url + "/slides.mp4"]
+    events = []
+    lock = threading.Lock()
+
+    def listener(event, snapshot):
+        with lock:
+            events.append((event, snapshot["job"], threading.current_thread()))
+
+    output_dir = str(tmp_path / "out")
+    with get_progress_bus().listening(listener):
+        assert video.download(output_dir, "lecture", session=session, staging=Staging())
+    # both feeds ran on worker threads and still reported to the listener
+    finished = sorted(job for event, job, _ in events if event == "finish")
+    assert finished == ["lecture1", "lecture2"]
+    assert all(thread is not threading.current_thread() for _, _, thread in events)
+    assert [os.path.getsize(path) for path, _ in video.downloaded_files] == [3000, 5000]
+    # the worker threads do not keep the listener
+    assert get_progress_bus().listeners() == ()
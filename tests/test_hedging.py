@@ -0,0 +1,78 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from download_echo360.hedging import HedgedFetcher
+from download_echo360.hls_downloader import Downloader
+
+BODY_SIZE = 100
+
+class StragglerHandler(BaseHTTPRequestHandler):
+    # the first request of /straggler trickles its body, every other request is fast
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            straggler = self.path == "/straggler" and server.requests == 2
+        self.send_response(200)
+        self.send_header("Content-Length", str(BODY_SIZE))
+        self.end_headers()
+        if not straggler:
+            self.wfile.write(b"x" * BODY_SIZE)
+            return
+        try:
+            for _ in range(BODY_SIZE):
+                self.wfile.write(b"x")
+                self.wfile.flush()
+                time.sleep(0.2)
+        except OSError:
+            server.dropped.set()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def straggler_server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StragglerHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = 0
+    httpd.dropped = threading.Event()
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.url = "http://127.0.0.1:{}".format(httpd.server_address[1])
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+def test_losing_hedge_is_dropped_while_reading(straggler_server, session):
+    fetcher = HedgedFetcher(session, concurrency=2, min_samples=1, min_delay=0.2)
+    try:
+        # one fast request makes the latency percentile known
+        fetcher.get(straggler_server.url + "/fast")
+        r, content = fetcher.get(straggler_server.url + "/straggler")
+        assert content == b"x" * BODY_SIZE
+        assert fetcher.hedges_won == 1
+        # the straggler would still trickle for ~20s had its connection not been dropped
+        assert straggler_server.dropped.wait(timeout=5)
+    finally:
+        fetcher.close()
+
+def test_segment_retries_stop_when_cancelled(server, session):
+    cancel_event = threading.Event()
+    downloader = Downloader(1, session=session, cancel_event=cancel_event)
+    # a missing segment is requested again and again until the download is cancelled
+    worker = threading.Thread(target=downloader._worker, args=((server.url + "/missing.ts", 0),))
+    worker.start()
+    time.sleep(0.3)
+    cancel_event.set()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert downloader.failed == []
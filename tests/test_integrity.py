@@ -0,0 +1,31 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+from download_echo360 import integrity
+from download_echo360.integrity import DownloadManifest
+
+def write(tmp_path, name, data=b"video"):
+    (tmp_path / name).write_bytes(data)
+
+def test_recorded_file_is_checked(tmp_path):
+    write(tmp_path, "lecture.mp4")
+    manifest = DownloadManifest(str(tmp_path))
+    manifest.record(str(tmp_path / "lecture.mp4"))
+    assert manifest.verify() == {}
+    write(tmp_path, "lecture.mp4", b"other")
+    assert manifest.verify() == {"lecture.mp4": "checksum mismatch"}
+
+def test_unrecorded_file_is_never_passed(tmp_path, monkeypatch):
+    write(tmp_path, "lecture.mp4")
+    manifest = DownloadManifest(str(tmp_path))
+    monkeypatch.setattr(integrity, "probe_duration", lambda path: 600.0)
+    assert manifest.check_unrecorded("lecture.mp4", 601.0) == \
+        (None, "no checksum recorded, duration OK")
+    assert manifest.check_unrecorded("lecture.mp4", None) == \
+        (None, "no checksum recorded, no expected duration")
+    assert manifest.check_unrecorded("lecture.mp4", 1200.0) == \
+        ("duration 600.0s != 1200.0s", None)
+
+def test_unreadable_unrecorded_file_is_unverified(tmp_path, monkeypatch):
+    write(tmp_path, "lecture.mp4")
+    monkeypatch.setattr(integrity, "probe_duration", lambda path: None)
+    assert DownloadManifest(str(tmp_path)).check_unrecorded("lecture.mp4", 600.0) == \
+        (None, "cannot read its duration")
@@ -0,0 +1,41 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from download_echo360.network_log import capture_stream_urls
+
+from tests.conftest import FakeDriver
+
+PAGE = "https://echo360.org/lesson/1/classroom"
+
+def test_stream_requests_are_collected():
+    driver = FakeDriver({PAGE: [
+        "https://content.echo360.org/0/1/s1_av.m3u8?token=1",
+        "https://content.echo360.org/0/1/s2_av.m3u8",
+        "https://echo360.org/player.js",
+    ]})
+    urls = capture_stream_urls(driver, PAGE, suffixes=("mp4", "m3u8"), timeout=1,
+                               quiet_period=0.1)
+    assert urls == {"mp4": set(), "m3u8": {"https://content.echo360.org/0/1/s1_av.m3u8?token=1",
+                                           "https://content.echo360.org/0/1/s2_av.m3u8"}}
+    assert driver.loads == [PAGE]
+
+def test_requests_of_previous_pages_are_ignored():
+    driver = FakeDriver({PAGE: ["https://content.echo360.org/0/1/s1_av.m3u8"]})
+    # logged while another lesson was loaded
+    driver.request("https://content.echo360.org/0/0/s1_av.m3u8")
+    urls = capture_stream_urls(driver, PAGE, suffixes=("m3u8",), timeout=1, quiet_period=0.1)
+    assert urls == {"m3u8": {"https://content.echo360.org/0/1/s1_av.m3u8"}}
+
+def test_page_without_streams_is_loaded_once():
+    driver = FakeDriver()
+    urls = capture_stream_urls(driver, PAGE, suffixes=("mp4", "m3u8"), timeout=0.3)
+    assert urls == {"mp4": set(), "m3u8": set()}
+    assert driver.loads == [PAGE]
+
+def test_page_load_timeout_is_raised():
+    def time_out(url):
+        raise TimeoutException("page load")
+
+    with pytest.raises(TimeoutException):
+        capture_stream_urls(FakeDriver(on_load=time_out), PAGE, suffixes=("m3u8",), timeout=0.3)
@@ -0,0 +1,29 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import collections
+
+from download_echo360 import planning
+from download_echo360.planning import DiskAdmission
+from download_echo360.staging import Staging
+
+DiskUsage = collections.namedtuple("DiskUsage", "total used free")
+
+def test_written_lectures_are_not_counted_twice(tmp_path, monkeypatch):
+    disk = {"used": 0}
+    monkeypatch.setattr(planning.shutil, "disk_usage",
+                        lambda path: DiskUsage(1000, disk["used"], 1000 - disk["used"]))
+    # scratch on the output volume: 2x the largest lecture is kept free for the mux
+    admission = DiskAdmission(Staging(), str(tmp_path), watermark=1.0)
+    for _ in range(8):
+        assert admission.admit(100)
+        # the lecture is written before the next one is admitted
+        disk["used"] += 100
+    assert not admission.admit(100)
+
+def test_unknown_sizes_count_as_average(tmp_path, monkeypatch):
+    monkeypatch.setattr(planning.shutil, "disk_usage",
+                        lambda path: DiskUsage(1200, 0, 1200))
+    admission = DiskAdmission(Staging(), str(tmp_path), watermark=1.0)
+    assert admission.admit(300)
+    # 300 reserved + 300 + 2 * 300 for the mux
+    assert admission.admit(None)
+    assert not admission.admit(None)
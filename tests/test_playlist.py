@@ -0,0 +1,29 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+from download_echo360.hls_downloader import Downloader
+
+PLAYLIST = """#EXTM3U
+#EXT-X-MAP:URI="a.mp4"
+#EXTINF:2.0,
+a0.m4s
+#EXTINF:2.0,
+a1.m4s
+#EXT-X-MAP:URI="b.mp4"
+#EXTINF:2.0,
+b0.m4s
+#EXT-X-MAP:URI="a.mp4"
+#EXTINF:2.0,
+a2.m4s
+#EXT-X-ENDLIST
+"""
+
+def plan(window=None):
+    downloader = Downloader(1)
+    return [url.split("/")[-1] for url, _ in downloader._plan_segments(
+        "http://host/hls/media.m3u8", PLAYLIST.splitlines(), window)]
+
+def test_init_segment_on_every_map_change():
+    assert plan() == ["a.mp4", "a0.m4s", "a1.m4s", "b.mp4", "b0.m4s", "a.mp4", "a2.m4s"]
+
+def test_init_segment_before_first_segment_of_window():
+    assert plan(window=(3, 8)) == ["a.mp4", "a1.m4s", "b.mp4", "b0.m4s", "a.mp4", "a2.m4s"]
+    assert plan(window=(5, 8)) == ["b.mp4", "b0.m4s", "a.mp4", "a2.m4s"]
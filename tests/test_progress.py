@@ -0,0 +1,28 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+from download_echo360.progress import ProgressBus
+
+def test_log_lines_are_written_above_the_dashboard(capsys):
+    bus = ProgressBus(mode="dashboard")
+    bus.job("lecture", total=10)
+    capsys.readouterr()
+    bus.log("- Downloading video feed 2...")
+    out = capsys.readouterr().out
+    # back over the one-line dashboard, the message, then the dashboard again
+    assert out.startswith("\x1b[1F\x1b[K- Downloading video feed 2...\n\x1b[K  > lecture: [")
+    assert out.count("\n") == 2
+
+def test_partial_lines_wait_for_their_end(capsys):
+    bus = ProgressBus(mode="dashboard")
+    bus.job("lecture", total=10)
+    capsys.readouterr()
+    bus.log("  > Converting to mp4... ", end="")
+    assert capsys.readouterr().out == ""
+    bus.log("Done!")
+    assert "\x1b[K  > Converting to mp4... Done!\n" in capsys.readouterr().out
+
+def test_log_lines_are_printed_without_dashboard(capsys):
+    bus = ProgressBus(mode="quiet")
+    bus.job("lecture", total=10)
+    bus.log("  > Converting to mp4... ", end="")
+    bus.log("Done!")
+    assert capsys.readouterr().out == "  > Converting to mp4... Done!\n"
@@ -0,0 +1,62 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from download_echo360 import course as course_module
+from download_echo360.strategy_stats import StrategyStats
+
+from tests.conftest import FakeDriver, lesson_json
+
+LESSON = lesson_json(
+    "1",
+    manifests=[{"uri": "https://s3.example.com/0/1/s1_av.m3u8"},
+               {"uri": "https://s3.example.com/0/1/s0_a.m3u8"}],
+    primary_files=[{"s3Url": "https://s3.example.com/sd.mp4"},
+                   {"s3Url": "https://s3.example.com/hd.mp4"}],
+)
+
+def test_mp4_is_preferred_for_video(make_video):
+    video = make_video(LESSON)
+    assert video.url == "https://s3.example.com/hd.mp4"
+    assert video.strategy == "from_json_mp4"
+
+def test_audio_only_prefers_the_audio_rendition(make_video, server):
+    video = make_video(LESSON, audio_only=True)
+    assert video.strategy == "from_json_m3u8"
+    # manifests are fetched from the content host of the tenant
+    assert video.url[0] == "https://content.{}/0/1/s0_a.m3u8".format(server.url.split("//")[1])
+
+def test_audio_only_ignores_mp4_history(make_video, server, tmp_path):
+    stats = StrategyStats(str(tmp_path / "stats.json"), reprobe_rate=0.0)
+    for _ in range(5):
+        stats.record(server.url.split("//")[1], "from_json_mp4", success=True, latency=0.01)
+    video = make_video(LESSON, audio_only=True, strategy_stats=stats)
+    assert video.strategy == "from_json_m3u8"
+
+def test_scraped_lesson_loads_its_page_once(make_video, server):
+    # neither mp4 nor m3u8 urls in the syllabus, both come from a single page load
+    driver = FakeDriver([server.url + "/hls/s1_av.m3u8"])
+    video = make_video(driver=driver)
+    assert video.strategy == "brute_force_m3u8"
+    assert video.url == [server.url + "/hls/s1_av.m3u8"]
+    assert driver.loads == [server.url + "/lesson/1/classroom"]
+
+@pytest.fixture
+def short_page_wait(monkeypatch):
+    monkeypatch.setattr(course_module, "PAGE_LOAD_WAIT", 0.3)
+
+def test_lesson_without_streams_is_given_up_after_one_load(make_video, short_page_wait):
+    driver = FakeDriver()
+    video = make_video(driver=driver)
+    assert video.url is False
+    assert len(driver.loads) == 1
+
+def test_page_that_fails_to_load_is_loaded_again(make_video, server, short_page_wait):
+    def time_out_once(url):
+        if len(driver.loads) == 1:
+            raise TimeoutException("page load")
+
+    driver = FakeDriver([server.url + "/hls/s1_av.m3u8"], on_load=time_out_once)
+    video = make_video(driver=driver)
+    assert video.strategy == "brute_force_m3u8"
+    assert len(driver.loads) == 2
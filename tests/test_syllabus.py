@@ -0,0 +1,40 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import json
+
+import pytest
+
+from download_echo360 import course as course_module
+from download_echo360.course import LessonRecord
+
+from tests.conftest import lesson_json
+
+def test_files_without_url_are_skipped():
+    lesson = LessonRecord.from_json(lesson_json(
+        "1",
+        manifests=[{"uri": "https://content/s1_av.m3u8"}, {"size": 3}],
+        primary_files=[{"width": 640}, {"s3Url": "https://s3/hd.mp4"}],
+    ))
+    assert lesson.manifest_urls == ("https://content/s1_av.m3u8",)
+    assert lesson.mp4_urls == ("https://s3/hd.mp4",)
+
+@pytest.fixture(params=["json", "ijson"])
+def parser(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(course_module, "ijson", None)
+    elif course_module.ijson is None:
+        pytest.skip("ijson is not installed")
+
+def test_lesson_with_broken_manifest_is_kept(make_course, parser):
+    echo_course = make_course([
+        lesson_json("1", manifests=[{"uri": "https://content/s1_av.m3u8"}]),
+        lesson_json("2", manifests=[{}], primary_files=[{}]),
+    ])
+    lessons = echo_course.get_lessons()
+    assert [lesson.lesson_id for lesson in lessons] == ["1", "2"]
+    assert lessons[1].manifest_urls == () and lessons[1].mp4_urls == ()
+
+def test_truncated_syllabus_cannot_be_parsed(make_course, parser):
+    text = json.dumps({"data": [lesson_json("1"), lesson_json("2")]})
+    echo_course = make_course(text[:len(text) // 2])
+    with pytest.raises(Exception, match="Unable to retrieve JSON"):
+        echo_course.get_lessons()
@@ -0,0 +1,32 @@
+# Copyright (c) Subramanya N. Licensed under the Apache License 2.0. All Rights Reserved
+import os
+
+import pytest
+
+from download_echo360.hls_downloader import Downloader
+from download_echo360.staging import Staging
+
+from tests.conftest import FakeDriver
+
+@pytest.mark.parametrize("window", [(3600, None), (30, 10)])
+def test_empty_window_is_not_downloaded(server, session, tmp_path, window):
+    downloader = Downloader(2, session=session, staging=Staging())
+    assert downloader.run(server.url + "/hls/media.m3u8", str(tmp_path / "work"),
+                          convert_to_mp4=False, window=window) is False
+    assert downloader.result_file_name is None
+
+def test_window_keeps_covering_segments(server, session, tmp_path):
+    downloader = Downloader(2, session=session, staging=Staging())
+    assert downloader.run(server.url + "/hls/media.m3u8", str(tmp_path / "work"),
+                          convert_to_mp4=False, window=(3, 5))
+    # segments [2, 4) and [4, 6) cover the window
+    assert os.path.getsize(downloader.result_file_name) == 2000
+    assert downloader.window_offset == 1.0
+    assert downloader.duration == 2.0
+
+def test_empty_window_fails_the_lecture(server, session, tmp_path, make_video):
+    video = make_video(driver=FakeDriver([server.url + "/hls/s1_av.m3u8"]))
+    output_dir = str(tmp_path / "out")
+    assert video.download(output_dir, "lecture", pool_size=2, session=session,
+                          staging=Staging(), window=(3600, None)) is False
+    assert video.downloaded_files == []